@@ -0,0 +1,147 @@
+import os
+import unittest
+from __main__ import vtk, qt, ctk, slicer
+from slicer.ScriptedLoadableModule import *
+
+#
+# CLIFutureTest
+#
+
+class CLIFutureTest(ScriptedLoadableModule):
+  def __init__(self, parent):
+    parent.title = "CLIFutureTest"
+    parent.categories = ["Testing.TestCases"]
+    parent.dependencies = ["CLI4Test"]
+    parent.contributors = ["Slicer Community"]
+    parent.helpText = """
+    This is a self test that runs CLIs asynchronously with slicer.cli.runAsync
+    """
+    parent.acknowledgementText = """"""
+    self.parent = parent
+
+    try:
+      slicer.selfTests
+    except AttributeError:
+      slicer.selfTests = {}
+    slicer.selfTests['CLIFutureTest'] = self.runTest
+
+  def runTest(self):
+    tester = CLIFutureTestTest()
+    tester.runTest()
+
+#
+# CLIFutureTestWidget
+#
+
+class CLIFutureTestWidget(ScriptedLoadableModuleWidget):
+
+  def setup(self):
+    ScriptedLoadableModuleWidget.setup(self)
+
+#
+# CLIFutureTestTest
+#
+
+class CLIFutureTestTest(ScriptedLoadableModuleTest):
+
+  def setUp(self):
+    """ Reset the state for testing.
+    """
+    pass
+
+  def runTest(self):
+    """Run as few or as many tests as needed here.
+    """
+    self.setUp()
+    self.test_CLIFutureChain()
+    self.setUp()
+    self.test_CLIFutureCancel()
+    self.setUp()
+    self.test_CLISharedMemoryTransport()
+
+  def parameters(self, tempFile):
+    return {
+      "InputValue1": 1,
+      "InputValue2": 2,
+      "OperationType": 'Addition',
+      "OutputFile": tempFile.fileName(),
+      }
+
+  def test_CLIFutureChain(self):
+    self.delayDisplay('Running chained CLI futures')
+
+    tempFile = qt.QTemporaryFile("CLIFutureTest-outputFile-XXXXXX")
+    self.assertTrue(tempFile.open())
+
+    doneOrder = []
+    first = slicer.cli.runAsync(slicer.modules.cli4test, None, self.parameters(tempFile))
+    first.add_done_callback(lambda future: doneOrder.append("first"))
+    second = slicer.cli.runAsync(slicer.modules.cli4test, None, self.parameters(tempFile), after=first)
+    second.add_done_callback(lambda future: doneOrder.append("second"))
+    self.assertFalse(second.running())
+
+    self.assertTrue(slicer.cli.wait([first, second], timeout=60))
+    self.assertEqual(doneOrder, ["first", "second"])
+    self.assertEqual(second.result().GetStatusString(), 'Completed')
+    self.assertEqual(first.exception(), None)
+    self.assertEqual(first.progress(), 1.0)
+
+    # Callbacks added after completion are called immediately
+    first.add_done_callback(lambda future: doneOrder.append("late"))
+    self.assertEqual(doneOrder[-1], "late")
+
+    self.delayDisplay('Chained CLI futures test passed !')
+
+  def test_CLIFutureCancel(self):
+    self.delayDisplay('Cancelling CLI futures')
+
+    tempFile = qt.QTemporaryFile("CLIFutureTest-outputFile-XXXXXX")
+    self.assertTrue(tempFile.open())
+
+    first = slicer.cli.runAsync(slicer.modules.cli4test, None, self.parameters(tempFile))
+    second = slicer.cli.runAsync(slicer.modules.cli4test, None, self.parameters(tempFile), after=first)
+    self.assertTrue(first.cancel())
+
+    self.assertTrue(slicer.cli.wait([first, second], timeout=60))
+    self.assertTrue(first.cancelled())
+    self.assertRaises(slicer.cli.CLICancelledError, first.result)
+    # A CLI that depends on a cancelled one is never started
+    self.assertFalse(second.cancelled())
+    self.assertTrue(isinstance(second.exception(), slicer.cli.CLIError))
+    self.assertEqual(second.node.GetStatusString(), 'Idle')
+    self.assertFalse(second.cancel())
+
+    self.delayDisplay('Cancel CLI futures test passed !')
+
+  def test_CLISharedMemoryTransport(self):
+    self.delayDisplay('Running a CLI with shared memory data transport')
+
+    tempFile = qt.QTemporaryFile("CLIFutureTest-outputFile-XXXXXX")
+    self.assertTrue(tempFile.open())
+
+    future = slicer.cli.runAsync(slicer.modules.cli4test, None, self.parameters(tempFile), transport='memory')
+    self.assertEqual(future.result().GetStatusString(), 'Completed')
+    attributeName = slicer.cli.DATA_EXCHANGE_DIRECTORY_ATTRIBUTE
+    sharedMemoryDirectory = slicer.cli.sharedMemoryDirectory()
+    self.assertEqual(future.node.GetAttribute(attributeName), sharedMemoryDirectory)
+    if sharedMemoryDirectory:
+      # the exchanged files are only accessible by the current user
+      import stat
+      status = os.lstat(sharedMemoryDirectory)
+      self.assertTrue(stat.S_ISDIR(status.st_mode))
+      self.assertEqual(status.st_uid, os.getuid())
+      self.assertEqual(status.st_mode & (stat.S_IRWXG | stat.S_IRWXO), 0)
+
+    # the transport belongs to the node: another run of the module uses files
+    other = slicer.cli.runAsync(slicer.modules.cli4test, None, self.parameters(tempFile))
+    self.assertEqual(other.result().GetStatusString(), 'Completed')
+    self.assertIsNone(other.node.GetAttribute(attributeName))
+
+    # and running the node again without transport goes back to files
+    again = slicer.cli.runAsync(slicer.modules.cli4test, future.node, self.parameters(tempFile))
+    self.assertEqual(again.result().GetStatusString(), 'Completed')
+    self.assertIsNone(future.node.GetAttribute(attributeName))
+
+    self.assertRaises(ValueError, slicer.cli.setDataTransport, future.node, 'pipe')
+
+    self.delayDisplay('Shared memory data transport test passed !')
@@ -45,17 +45,75 @@ def setNodeParameters(node, parameters):
     else:
       print "parameter ", key, " has unsupported type ", value.__class__.__name__
 
-def runSync(module, node=None, parameters=None, delete_temporary_files=True, update_display=True):
+# CLI node attribute read by vtkSlicerCLIModuleLogic, see
+# vtkSlicerCLIModuleLogic::GetDataExchangeDirectoryAttributeName()
+DATA_EXCHANGE_DIRECTORY_ATTRIBUTE = 'CLI.DataExchangeDirectory'
+
+def sharedMemoryDirectory():
+  """Return a directory on a memory-backed file system (POSIX shared memory)
+  that can be used to exchange data with CLI executables, or None if the
+  system does not provide one.
+  The exchanged files can contain patient data: the directory is private to
+  the current user and is rejected if it is a symbolic link, belongs to
+  another user or is accessible by others.
+  """
+  import logging
+  import os
+  import stat
+  if not os.path.isdir('/dev/shm') or not os.access('/dev/shm', os.W_OK):
+    return None
+  directory = os.path.join('/dev/shm', 'Slicer-%d' % os.getuid())
+  try:
+    os.mkdir(directory, 0o700)
+  except OSError:
+    # already created, checked below
+    pass
+  try:
+    status = os.lstat(directory)
+  except OSError:
+    return None
+  if (not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid()
+      or status.st_mode & (stat.S_IRWXG | stat.S_IRWXO)):
+    logging.warning("%s is not a private directory of the current user, shared memory is not used" % directory)
+    return None
+  return directory
+
+def setDataTransport(node, transport):
+  """Select how node data is passed to and from the CLI executable of node
+  transport: 'file' or None writes temporary files in the application
+  temporary directory, 'memory' writes them to POSIX shared memory (see
+  sharedMemoryDirectory) so that large volumes never reach the disk.
+  Falls back to 'file' if shared memory is not available.
+  The setting is stored on the CLI node, so runs of the same module with
+  other nodes are not affected. Shared object CLIs always receive volumes
+  directly from the scene.
+  """
+  import logging
+  if transport not in (None, 'file', 'memory'):
+    raise ValueError("Unknown CLI data transport '%s'" % transport)
+  directory = ''
+  if transport == 'memory':
+    directory = sharedMemoryDirectory()
+    if directory is None:
+      logging.warning("Shared memory is not available, %s data is passed through temporary files" % node.GetName())
+      directory = ''
+  if directory:
+    node.SetAttribute(DATA_EXCHANGE_DIRECTORY_ATTRIBUTE, directory)
+  else:
+    node.RemoveAttribute(DATA_EXCHANGE_DIRECTORY_ATTRIBUTE)
+
+def runSync(module, node=None, parameters=None, delete_temporary_files=True, update_display=True, transport=None):
   """Run a CLI synchronously, optionally given a node with optional parameters,
   returning the node (or the new one if created)
   node: existing parameter node (None by default)
   parameters: dictionary of parameters for cli (None by default)
   delete_temporary_files: remove temp files created during exectuion (True by default)
   update_display: show output nodes after completion
+  transport: 'file' or 'memory', see setDataTransport (None by default, same as 'file')
   """
-  return run(module, node=node, parameters=parameters, wait_for_completion=True, delete_temporary_files=delete_temporary_files)
+  return run(module, node=node, parameters=parameters, wait_for_completion=True, delete_temporary_files=delete_temporary_files, transport=transport)
 
-def run(module, node = None, parameters = None, wait_for_completion = False, delete_temporary_files = True, update_display=True):
+def run(module, node = None, parameters = None, wait_for_completion = False, delete_temporary_files = True, update_display=True, transport=None):
   """Runs a CLI, optionally given a node with optional parameters, returning
   back the node (or the new one if created)
   node: existing parameter node (None by default)
@@ -63,6 +121,8 @@ def run(module, node = None, parameters = None, wait_for_completion = False, del
   wait_for_completion: block if True (False by default)
   delete_temporary_files: remove temp files created during exectuion (True by default)
   update_display: show output nodes after completion
+  transport: 'file' or 'memory', see setDataTransport (None by default, same as 'file')
+  Use runAsync to get a CLIFuture that reports progress, completion and allows cancellation.
   """
   import slicer.util
   if node:
@@ -75,6 +135,7 @@ def run(module, node = None, parameters = None, wait_for_completion = False, del
   logic = module.logic()
 
   logic.SetDeleteTemporaryFiles(1 if delete_temporary_files else 0)
+  setDataTransport(node, transport)
 
   if wait_for_completion:
       logic.ApplyAndWait(node, update_display)
@@ -88,5 +149,204 @@ def run(module, node = None, parameters = None, wait_for_completion = False, del
   #widget.apply()
   return node
 
+def runAsync(module, node=None, parameters=None, delete_temporary_files=True, update_display=True, after=None, transport=None):
+  """Runs a CLI without blocking and returns a CLIFuture for the execution
+  node: existing parameter node (None by default)
+  parameters: dictionary of parameters for cli (None by default)
+  delete_temporary_files: remove temp files created during exectuion (True by default)
+  update_display: show output nodes after completion
+  after: CLIFuture or list of CLIFutures that must complete successfully before
+  this CLI is started (None by default). CLIs that do not depend on each other
+  run at the same time. If a dependency fails or is cancelled, this CLI is not
+  started and its future fails.
+  transport: 'file' or 'memory', see setDataTransport (None by default, same as 'file')
+  """
+  if node:
+    setNodeParameters(node, parameters)
+  else:
+    node = createNode(module, parameters)
+    if not node:
+      return None
+  if after is None:
+    after = []
+  elif isinstance(after, CLIFuture):
+    after = [after]
+  future = CLIFuture(module, node, delete_temporary_files, update_display, after, transport)
+  future._startWhenReady()
+  return future
+
+def wait(futures, timeout=None):
+  """Wait until all the futures are done, keeping the application responsive.
+  Return True if all of them are done, False if timeout (in seconds) elapsed first.
+  """
+  import time
+  import slicer
+  startTime = time.time()
+  while not all([future.done() for future in futures]):
+    if timeout is not None and time.time() - startTime > timeout:
+      return False
+    slicer.app.processEvents()
+    time.sleep(0.01)
+  return True
+
 def cancel(node):
-  print "Not yet implemented"
+  """Request a running CLI to stop. The CLI process is killed by the module logic.
+  node: vtkMRMLCommandLineModuleNode or CLIFuture
+  """
+  if isinstance(node, CLIFuture):
+    return node.cancel()
+  if not node:
+    return False
+  wasBusy = node.IsBusy()
+  node.Cancel()
+  return wasBusy
+
+class CLIError(Exception):
+  """Raised by CLIFuture.result() when the CLI did not complete successfully"""
+  pass
+
+class CLICancelledError(CLIError):
+  """Raised by CLIFuture.result() when the CLI was cancelled"""
+  pass
+
+class CLIFuture(object):
+  """Handle on an asynchronous CLI execution, created by runAsync.
+  The interface follows concurrent.futures.Future. Callbacks are called on the
+  main thread with the future as single argument.
+  """
+
+  def __init__(self, module, node, delete_temporary_files=True, update_display=True, after=None, transport=None):
+    self.module = module
+    self.node = node
+    self.deleteTemporaryFiles = delete_temporary_files
+    self.transport = transport
+    self.updateDisplay = update_display
+    self.dependencies = list(after) if after else []
+    self._started = False
+    self._finished = False
+    self._cancelled = False
+    self._error = None
+    self._doneCallbacks = []
+    self._progressCallbacks = []
+    self._observerTags = []
+
+  def _startWhenReady(self):
+    for dependency in self.dependencies:
+      dependency.add_done_callback(self._onDependencyDone)
+    self._onDependencyDone(None)
+
+  def _onDependencyDone(self, dependency):
+    if self._started or self._finished:
+      return
+    for dependency in self.dependencies:
+      if not dependency.done():
+        return
+      if dependency.exception() is not None:
+        self._finish(CLIError("%s was not started: %s" % (self.module.name, dependency.exception())))
+        return
+    self._start()
+
+  def _start(self):
+    import vtk
+    import slicer
+    self._started = True
+    self._observerTags = [
+      self.node.AddObserver(slicer.vtkMRMLCommandLineModuleNode.StatusModifiedEvent, self._onStatusModified),
+      self.node.AddObserver(vtk.vtkCommand.ModifiedEvent, self._onNodeModified)]
+    logic = self.module.logic()
+    logic.SetDeleteTemporaryFiles(1 if self.deleteTemporaryFiles else 0)
+    setDataTransport(self.node, self.transport)
+    logic.Apply(self.node, self.updateDisplay)
+
+  def _onStatusModified(self, caller, event):
+    import slicer
+    status = self.node.GetStatus()
+    if status == slicer.vtkMRMLCommandLineModuleNode.Completed:
+      self._finish(None)
+    elif status == slicer.vtkMRMLCommandLineModuleNode.CompletedWithErrors:
+      self._finish(CLIError("%s completed with errors: %s" % (self.module.name, self.node.GetErrorText())))
+    elif status == slicer.vtkMRMLCommandLineModuleNode.Cancelled:
+      self._cancelled = True
+      self._finish(CLICancelledError("%s was cancelled" % self.module.name))
+
+  def _onNodeModified(self, caller, event):
+    if not self.running():
+      return
+    for callback in self._progressCallbacks:
+      self._invokeCallback(callback)
+
+  def _finish(self, error):
+    if self._finished:
+      return
+    self._finished = True
+    self._error = error
+    for tag in self._observerTags:
+      self.node.RemoveObserver(tag)
+    self._observerTags = []
+    for callback in self._doneCallbacks:
+      self._invokeCallback(callback)
+
+  def _invokeCallback(self, callback):
+    import logging
+    try:
+      callback(self)
+    except Exception:
+      logging.exception("Exception in callback of %s" % self.module.name)
+
+  def cancel(self):
+    """Stop the CLI. Return False if it is already done."""
+    if self._finished:
+      return False
+    if not self._started:
+      self._cancelled = True
+      self._finish(CLICancelledError("%s was cancelled" % self.module.name))
+      return True
+    self.node.Cancel()
+    return True
+
+  def cancelled(self):
+    return self._cancelled
+
+  def running(self):
+    return self._started and not self._finished
+
+  def done(self):
+    return self._finished
+
+  def progress(self):
+    """Overall progress of the CLI, between 0 and 1"""
+    if self._finished and self._error is None:
+      return 1.0
+    return self.node.GetProgress() if self._started else 0.0
+
+  def progressMessage(self):
+    return self.node.GetProgressMessage() if self._started else ""
+
+  def result(self, timeout=None):
+    """Wait for the CLI to complete, keeping the application responsive, and return its node.
+    Raise CLIError if it failed, CLICancelledError if it was cancelled.
+    """
+    if not wait([self], timeout):
+      raise CLIError("%s did not complete within %s seconds" % (self.module.name, timeout))
+    if self._error is not None:
+      raise self._error
+    return self.node
+
+  def exception(self, timeout=None):
+    """Wait for the CLI to complete and return the error it raised, or None if it succeeded"""
+    if not wait([self], timeout):
+      raise CLIError("%s did not complete within %s seconds" % (self.module.name, timeout))
+    return self._error
+
+  def add_done_callback(self, fn):
+    """Call fn(future) when the CLI completes, fails or is cancelled.
+    If the future is already done, fn is called immediately.
+    """
+    if self._finished:
+      self._invokeCallback(fn)
+    else:
+      self._doneCallbacks.append(fn)
+
+  def add_progress_callback(self, fn):
+    """Call fn(future) each time the running CLI reports progress"""
+    self._progressCallbacks.append(fn)
@@ -56,3 +56,36 @@ class SlicerUtilTest(unittest.TestCase):
         self.assertIsInstance(slicer.util.getNodes("Volume")["Volume"], vtk.vtkObject)
         self.assertEqual(slicer.util.getNodes("Volume",useLists=True).keys(), ["Volume"])
         self.assertIsInstance(slicer.util.getNodes("Volume",useLists=True)["Volume"], list)
+
+    def test_getNodesExactMatchByNameOrID(self):
+        scene = slicer.vtkMRMLScene()
+        nodes = self._configure_scene(scene)
+        self.assertEqual(slicer.util.getNodes("Volume", scene=scene, useLists=True)["Volume"], nodes[2:])
+        self.assertEqual(slicer.util.getNode("Volume", scene=scene), nodes[3])
+        self.assertEqual(slicer.util.getNode(nodes[1].GetID(), scene=scene), nodes[1])
+        # Renamed nodes are found by their new name only
+        nodes[1].SetName("Renamed")
+        self.assertIsNone(slicer.util.getNode("Volume2", scene=scene))
+        self.assertEqual(slicer.util.getNode("Renamed", scene=scene), nodes[1])
+        # Removed nodes are not found
+        scene.RemoveNode(nodes[0])
+        self.assertIsNone(slicer.util.getNode("Volume1", scene=scene))
+
+    def test_getNodesExactMatchDoesNotScanScene(self):
+
+        class CountingScene(slicer.vtkMRMLScene):
+            """Scene counting the calls to GetNodes made from Python"""
+            getNodesCalls = 0
+            def GetNodes(self):
+                self.getNodesCalls += 1
+                return slicer.vtkMRMLScene.GetNodes(self)
+
+        scene = CountingScene()
+        nodes = self._configure_scene(scene)
+        self.assertEqual(slicer.util.getNode("Volume2", scene=scene), nodes[1])
+        self.assertEqual(slicer.util.getNode(nodes[1].GetID(), scene=scene), nodes[1])
+        self.assertEqual(scene.getNodesCalls, 0)
+
+        # wildcard patterns do go through all the nodes
+        self.assertEqual(slicer.util.getNode("Volume2*", scene=scene), nodes[1])
+        self.assertEqual(scene.getNodesCalls, 1)
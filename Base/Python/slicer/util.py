@@ -561,6 +561,38 @@ def resetSliceViews():
 # MRML
 #
 
+def _collectionToList(collection):
+  """Return the items of a vtkCollection as a list, in collection order."""
+  items = []
+  collection.InitTraversal()
+  item = collection.GetNextItemAsObject()
+  while item:
+    items.append(item)
+    item = collection.GetNextItemAsObject()
+  return items
+
+def _getNodesMatching(pattern, scene):
+  """Return the nodes of the scene whose name or id matches ``pattern``, in scene order."""
+  import fnmatch, re
+  if pattern == "*":
+    return _collectionToList(scene.GetNodes())
+  if not any(wildcard in pattern for wildcard in "*?["):
+    # Exact match: the scene looks up IDs in its ID map and compares names
+    # in C++, which avoids visiting every node from Python.
+    nodesByName = scene.GetNodesByName(pattern)
+    nodesByName.UnRegister(scene)
+    nodes = _collectionToList(nodesByName)
+    nodeById = scene.GetNodeByID(pattern) if pattern else None
+    if nodeById and nodeById.GetName() != pattern:
+      nodes.append(nodeById)
+      if len(nodes) > 1:
+        sceneNodes = scene.GetNodes()
+        nodes.sort(key=sceneNodes.IsItemPresent)
+    return nodes
+  match = re.compile(fnmatch.translate(pattern)).match
+  return [node for node in _collectionToList(scene.GetNodes())
+    if match(node.GetName()) or match(node.GetID())]
+
 def getNodes(pattern="*", scene=None, useLists=False):
   """Return a dictionary of nodes where the name or id matches the ``pattern``.
   By default, ``pattern`` is a wildcard and it returns all nodes associated
@@ -568,22 +600,18 @@ def getNodes(pattern="*", scene=None, useLists=False):
   If multiple node share the same name, using ``useLists=False`` (default behavior)
   returns only the last node with that name. If ``useLists=True``, it returns
   a dictionary of lists of nodes.
+  Patterns without wildcard characters are looked up without scanning
+  the scene from Python.
   """
-  import slicer, collections, fnmatch
+  import slicer, collections
   nodes = collections.OrderedDict()
   if scene is None:
     scene = slicer.mrmlScene
-  count = scene.GetNumberOfNodes()
-  for idx in range(count):
-    node = scene.GetNthNode(idx)
-    name = node.GetName()
-    id = node.GetID()
-    if (fnmatch.fnmatchcase(name, pattern) or
-        fnmatch.fnmatchcase(id, pattern)):
-      if useLists:
-        nodes.setdefault(node.GetName(), []).append(node)
-      else:
-        nodes[node.GetName()] = node
+  for node in _getNodesMatching(pattern, scene):
+    if useLists:
+      nodes.setdefault(node.GetName(), []).append(node)
+    else:
+      nodes[node.GetName()] = node
   return nodes
 
 def getNode(pattern="*", index=0, scene=None):
@@ -603,15 +631,9 @@ def getNodesByClass(className, scene=None):
   import slicer
   if scene is None:
     scene = slicer.mrmlScene
-  nodes = slicer.mrmlScene.GetNodesByClass(className)
-  nodes.UnRegister(slicer.mrmlScene)
-  nodeList = []
-  nodes.InitTraversal()
-  node = nodes.GetNextItemAsObject()
-  while node:
-    nodeList.append(node)
-    node = nodes.GetNextItemAsObject()
-  return nodeList
+  nodes = scene.GetNodesByClass(className)
+  nodes.UnRegister(scene)
+  return _collectionToList(nodes)
 
 def getFirstNodeByClassByName(className, name, scene=None):
   """Return the frist node in the scene that matches the specified node name and node class.
@@ -403,6 +403,32 @@ int vtkSlicerCLIModuleLogic::GetAllowInMemoryTransfer() const
   return this->Internal->AllowInMemoryTransfer;
 }
 
+//----------------------------------------------------------------------------
+const char* vtkSlicerCLIModuleLogic::GetDataExchangeDirectoryAttributeName()
+{
+  return "CLI.DataExchangeDirectory";
+}
+
+//----------------------------------------------------------------------------
+std::string vtkSlicerCLIModuleLogic
+::GetTemporaryDirectory(vtkMRMLCommandLineModuleNode* node)
+{
+  const char* dataExchangeDirectory =
+    node ? node->GetAttribute(GetDataExchangeDirectoryAttributeName()) : 0;
+  if (dataExchangeDirectory && dataExchangeDirectory[0] != '\0')
+    {
+    return dataExchangeDirectory;
+    }
+  // by default use the current directory
+  std::string temporaryDirectory = ".";
+  vtkSlicerApplicationLogic* appLogic = this->GetApplicationLogic();
+  if (appLogic)
+    {
+    temporaryDirectory = appLogic->GetTemporaryPath();
+    }
+  return temporaryDirectory;
+}
+
 //----------------------------------------------------------------------------
 void vtkSlicerCLIModuleLogic::RedirectModuleStreamsOn()
 {
@@ -435,7 +461,8 @@ int vtkSlicerCLIModuleLogic::GetRedirectModuleStreams() const
 //----------------------------------------------------------------------------
 std::string
 vtkSlicerCLIModuleLogic
-::ConstructTemporarySceneFileName(vtkMRMLScene *scene)
+::ConstructTemporarySceneFileName(vtkMRMLScene *scene,
+                                  const std::string& temporaryDirectory)
 {
   std::string fname;
   std::ostringstream fnameString;
@@ -465,15 +492,7 @@ vtkSlicerCLIModuleLogic
   pid = pidString.str();
   std::transform(pid.begin(), pid.end(), pid.begin(), DigitsToCharacters());
 
-  // By default, the filename is based on the temporary directory and
-  // the pid
-  // by default use the current directory
-  std::string temporaryDirectory = ".";
-  vtkSlicerApplicationLogic* appLogic = this->GetApplicationLogic();
-  if (appLogic)
-    {
-    temporaryDirectory = appLogic->GetTemporaryPath();
-    }
+  // The filename is based on the temporary directory and the pid
   fname = temporaryDirectory + "/" + pid + "_" + fname + ".mrml";
 
   return fname;
@@ -486,7 +505,8 @@ vtkSlicerCLIModuleLogic
                              const std::string& type,
                              const std::string& name,
                              const std::vector<std::string>& extensions,
-                             CommandLineModuleType commandType)
+                             CommandLineModuleType commandType,
+                             const std::string& temporaryDirectory)
 {
   std::string fname = name;
   std::string pid;
@@ -540,14 +560,7 @@ vtkSlicerCLIModuleLogic
   std::transform(fname.begin(), fname.end(),
                  fname.begin(), DigitsToCharacters());
 
-  // By default, the filename is based on the temporary directory and
-  // the pid
-  std::string temporaryDirectory = ".";
-  vtkSlicerApplicationLogic* appLogic = this->GetApplicationLogic();
-  if (appLogic)
-    {
-    temporaryDirectory = appLogic->GetTemporaryPath();
-    }
+  // The filename is based on the temporary directory and the pid
   fname = temporaryDirectory + "/" + pid + "_" + fname;
 
   if (tag == "image")
@@ -909,8 +922,13 @@ void vtkSlicerCLIModuleLogic::ApplyTask(void *clientdata)
   // Additional handling is necessary because we use SmartPointers
   // (see http://slicer.spl.harvard.edu/slicerWiki/index.php/Slicer3:Memory_Management#SmartPointers)
   vtkNew<vtkMRMLScene> miniscene;
+
+  // Define a temporary directory for storing files, read once so that
+  // it does not change during the execution
+  std::string temporaryDirectory = this->GetTemporaryDirectory(node0);
+
   std::string minisceneFilename
-    = this->ConstructTemporarySceneFileName(miniscene.GetPointer());
+    = this->ConstructTemporarySceneFileName(miniscene.GetPointer(), temporaryDirectory);
   miniscene->SetRootDirectory(vtksys::SystemTools::GetParentDirectory(minisceneFilename.c_str()).c_str());
 
   // vector of files to delete
@@ -963,7 +981,8 @@ void vtkSlicerCLIModuleLogic::ApplyTask(void *clientdata)
                                              (*pit).GetType(),
                                              id,
                                              (*pit).GetFileExtensions(),
-                                             commandType);
+                                             commandType,
+                                             temporaryDirectory);
 
         filesToDelete.insert(fname);
         if ((*pit).GetChannel() == "input")
@@ -989,14 +1008,6 @@ void vtkSlicerCLIModuleLogic::ApplyTask(void *clientdata)
       }
     }
 
-  // Define a temporary directory for storing files
-  // by default use the current directory for storing files
-  std::string temporaryDirectory = ".";
-  vtkSlicerApplicationLogic* appLogic = this->GetApplicationLogic();
-  if (appLogic)
-    {
-    temporaryDirectory = appLogic->GetTemporaryPath();
-    }
 
   // write out the input datasets
   //
@@ -1088,7 +1099,7 @@ void vtkSlicerCLIModuleLogic::ApplyTask(void *clientdata)
     vtkMRMLModelHierarchyNode *mhnd = vtkMRMLModelHierarchyNode::SafeDownCast(nd);
     if (mhnd)
       {
-      this->AddCompleteModelHierarchyToMiniScene(miniscene.GetPointer(), mhnd, &sceneToMiniSceneMap, filesToDelete);
+      this->AddCompleteModelHierarchyToMiniScene(miniscene.GetPointer(), mhnd, &sceneToMiniSceneMap, filesToDelete, temporaryDirectory);
       }
 
     // check for a point file that may need to set a coordinate system flag
@@ -1724,6 +1735,8 @@ void vtkSlicerCLIModuleLogic::ApplyTask(void *clientdata)
         node0->SetErrorText(errorText, false);
         node0->SetStatus(vtkMRMLCommandLineModuleNode::Idle, false);
         this->GetApplicationLogic()->RequestModified( node0 );
+        filesToDelete.insert(minisceneFilename);
+        this->RemoveTemporaryFiles(filesToDelete);
         return;
         }
       }
@@ -1736,6 +1749,8 @@ void vtkSlicerCLIModuleLogic::ApplyTask(void *clientdata)
       node0->SetErrorText(errorText, false);
       node0->SetStatus(vtkMRMLCommandLineModuleNode::Idle, false);
       this->GetApplicationLogic()->RequestModified( node0 );
+      filesToDelete.insert(minisceneFilename);
+      this->RemoveTemporaryFiles(filesToDelete);
       return;
       }
     else
@@ -1788,6 +1803,8 @@ void vtkSlicerCLIModuleLogic::ApplyTask(void *clientdata)
         node0->SetErrorText(errorText, false);
         node0->SetStatus(vtkMRMLCommandLineModuleNode::CompletedWithErrors, false);
         this->GetApplicationLogic()->RequestModified( node0 );
+        filesToDelete.insert(minisceneFilename);
+        this->RemoveTemporaryFiles(filesToDelete);
         return;
         }
       }
@@ -2539,25 +2556,9 @@ void vtkSlicerCLIModuleLogic::ApplyTask(void *clientdata)
   delete [] command;
 
   // Remove any remaining temporary files.  At this point, these files
-  // should be the files written as inputs to the module
-  if ( this->GetDeleteTemporaryFiles() )
-    {
-    bool removed;
-    std::set<std::string>::iterator fit;
-    for (fit = filesToDelete.begin(); fit != filesToDelete.end(); ++fit)
-      {
-      if (itksys::SystemTools::FileExists((*fit).c_str()))
-        {
-        removed = itksys::SystemTools::RemoveFile((*fit).c_str());
-        if (!removed)
-          {
-          std::stringstream information;
-          information << "Unable to delete temporary file " << *fit << std::endl;
-          vtkWarningMacro( << information.str().c_str() );
-          }
-        }
-      }
-    }
+  // should be the files written as inputs to the module, or all the
+  // files if the module failed or was cancelled
+  this->RemoveTemporaryFiles(filesToDelete);
 
   // The CLI node is only completed if the outputs are loaded back into the
   // scene.
@@ -2841,8 +2842,33 @@ void vtkSlicerCLIModuleLogic
     reinterpret_cast<void*>(requestTime));
 }
 
+//----------------------------------------------------------------------------
+void vtkSlicerCLIModuleLogic::RemoveTemporaryFiles(const std::set<std::string>& filesToDelete)
+{
+  if ( !this->GetDeleteTemporaryFiles() )
+    {
+    return;
+    }
+  bool removed;
+  std::set<std::string>::const_iterator fit;
+  for (fit = filesToDelete.begin(); fit != filesToDelete.end(); ++fit)
+    {
+    if (itksys::SystemTools::FileExists((*fit).c_str()))
+      {
+      removed = itksys::SystemTools::RemoveFile((*fit).c_str());
+      if (!removed)
+        {
+        std::stringstream information;
+        information << "Unable to delete temporary file " << *fit << std::endl;
+        vtkWarningMacro( << information.str().c_str() );
+        }
+      }
+    }
+}
+
 void vtkSlicerCLIModuleLogic::AddCompleteModelHierarchyToMiniScene(vtkMRMLScene *miniscene, vtkMRMLModelHierarchyNode *mhnd,
-                                                                   MRMLIDMap *sceneToMiniSceneMap, std::set<std::string> &filesToDelete)
+                                                                   MRMLIDMap *sceneToMiniSceneMap, std::set<std::string> &filesToDelete,
+                                                                   const std::string& temporaryDirectory)
 {
     if (mhnd)
       {
@@ -2929,7 +2955,7 @@ void vtkSlicerCLIModuleLogic::AddCompleteModelHierarchyToMiniScene(vtkMRMLScene
                 vtkMRMLModelStorageNode *s = vtkMRMLModelStorageNode::SafeDownCast(mscp);
                 std::string fname
                     = this->ConstructTemporaryFileName("geometry", "", tmcp->GetID(), std::vector<std::string>(),
-                                                                                  CommandLineModule);
+                                                                                  CommandLineModule, temporaryDirectory);
 
                 s->SetFileName(fname.c_str());
                 filesToDelete.insert(fname);
@@ -80,6 +80,14 @@ public:
   void SetAllowInMemoryTransfer(int value);
   int GetAllowInMemoryTransfer() const;
 
+  /// Name of the CLI node attribute holding the directory where the data
+  /// passed to and from command line executables is written for that node.
+  /// Pointing it to a memory-backed file system (e.g. /dev/shm) avoids disk
+  /// I/O for large volumes. Without the attribute, or if it is empty, the
+  /// application temporary path is used. The attribute is read once when
+  /// the CLI starts executing.
+  static const char* GetDataExchangeDirectoryAttributeName();
+
   /// For debugging, control redirection of cout and cerr
   virtual void RedirectModuleStreamsOn();
   virtual void RedirectModuleStreamsOff();
@@ -127,8 +135,13 @@ protected:
                                          const std::string& type,
                                          const std::string& name,
                                      const std::vector<std::string>& extensions,
-                                     CommandLineModuleType commandType);
-  std::string ConstructTemporarySceneFileName(vtkMRMLScene *scene);
+                                     CommandLineModuleType commandType,
+                                     const std::string& temporaryDirectory);
+  std::string ConstructTemporarySceneFileName(vtkMRMLScene *scene,
+                                              const std::string& temporaryDirectory);
+  /// Directory for the files exchanged with the CLI of the node, see
+  /// GetDataExchangeDirectoryAttributeName()
+  std::string GetTemporaryDirectory(vtkMRMLCommandLineModuleNode* node);
   std::string FindHiddenNodeID(const ModuleDescription& d,
                                const ModuleParameter& p);
 
@@ -151,10 +164,14 @@ protected:
     RequestHierarchyEditEvent = vtkCommand::UserEvent + 1
   };
 
+  // Remove the files that exist, unless the temporary files are kept
+  void RemoveTemporaryFiles(const std::set<std::string>& filesToDelete);
+
   // Add a model hierarchy node and all its descendents to a scene (miniscene to sent to a CLI).
   // The mapping of ids from the original scene to the mini scene is put in (added to) sceneToMiniSceneMap.
   // Any files that will be created by writing out the miniscene are added to filesToDelete (i.e. models)
-  void AddCompleteModelHierarchyToMiniScene(vtkMRMLScene*, vtkMRMLModelHierarchyNode*, MRMLIDMap* sceneToMiniSceneMap, std::set<std::string> &filesToDelete);
+  void AddCompleteModelHierarchyToMiniScene(vtkMRMLScene*, vtkMRMLModelHierarchyNode*, MRMLIDMap* sceneToMiniSceneMap, std::set<std::string> &filesToDelete,
+                                            const std::string& temporaryDirectory);
 
 private:
   vtkSlicerCLIModuleLogic();
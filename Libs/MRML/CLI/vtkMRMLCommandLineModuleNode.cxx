@@ -661,6 +661,24 @@ void vtkMRMLCommandLineModuleNode::Cancel()
     }
 }
 
+//----------------------------------------------------------------------------
+double vtkMRMLCommandLineModuleNode::GetProgress()
+{
+  return this->GetModuleDescription().GetProcessInformation()->Progress;
+}
+
+//----------------------------------------------------------------------------
+double vtkMRMLCommandLineModuleNode::GetStageProgress()
+{
+  return this->GetModuleDescription().GetProcessInformation()->StageProgress;
+}
+
+//----------------------------------------------------------------------------
+std::string vtkMRMLCommandLineModuleNode::GetProgressMessage()
+{
+  return this->GetModuleDescription().GetProcessInformation()->ProgressMessage;
+}
+
 //----------------------------------------------------------------------------
 void vtkMRMLCommandLineModuleNode::AbortProcess()
 {
@@ -139,6 +139,19 @@ public:
   /// \sa IsBusy(), Cancelling, Cancelled
   void Cancel();
 
+  /// Return the overall progress (between 0 and 1) reported by the running CLI.
+  /// ModifiedEvent is invoked when the progress is updated.
+  /// \sa GetStageProgress(), GetProgressMessage()
+  double GetProgress();
+
+  /// Return the progress (between 0 and 1) of the current stage of the running CLI.
+  /// \sa GetProgress(), GetProgressMessage()
+  double GetStageProgress();
+
+  /// Return the progress message (filter name or stage description) reported by the running CLI.
+  /// \sa GetProgress(), GetStageProgress()
+  std::string GetProgressMessage();
+
   /// This enum type controls when the CLI should be run automatically.
   /// \sa SetAutoRun(), GetAutoRun()
   enum AutoRunMode
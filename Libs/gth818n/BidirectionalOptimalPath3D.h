@@ -0,0 +1,90 @@
+#ifndef BidirectionalOptimalPath3D_h
+#define BidirectionalOptimalPath3D_h
+
+#include <vector>
+
+#include "itkImage.h"
+
+namespace gth818n
+{
+  /***************************************************************************
+   * class BidirectionalOptimalPath3D
+   *
+   * Computes the same optimal path between two points as
+   * SeededOptimalPathFilter3D (26-neighborhood, the cost of a step is the
+   * mean of the source image values at its two ends), but:
+   *
+   * - the search is restricted to the bounding box of the two points,
+   *   dilated by a margin. If no path is found inside the box, the margin
+   *   is doubled until the box covers the whole image.
+   * - the search runs from both points at the same time and stops as soon
+   *   as the shortest path is known, so it visits far fewer voxels than a
+   *   search that runs until the end point is reached.
+   * - all the buffers are of the size of the search region, and no label
+   *   image is needed for the seeds nor the result: the path is returned
+   *   as a list of image linear indices.
+   ***************************************************************************/
+  template<typename SourceImageType>
+  class BidirectionalOptimalPath3D
+  {
+  public:
+    BidirectionalOptimalPath3D();
+    ~BidirectionalOptimalPath3D() {}
+
+    typedef typename SourceImageType::IndexType IndexType;
+    typedef typename SourceImageType::RegionType RegionType;
+
+    void SetSourceImage(const SourceImageType* img);
+
+    void SetStartIndex(const IndexType& index) {m_startIndex = index;}
+    void SetEndIndex(const IndexType& index) {m_endIndex = index;}
+
+    /// Number of voxels by which the bounding box of the start and end
+    /// points is dilated to get the search region.
+    void SetMargin(long margin) {m_margin = margin;}
+
+    void update();
+
+    bool GetPathFound() {return m_pathFound;}
+
+    /// Image linear indices of the path voxels, from the start to the end point
+    const std::vector<long>& GetPath() {return m_path;}
+
+    /// Sum of the step costs along the path
+    float GetPathCost() {return m_pathCost;}
+
+    /// Search region of the last attempt
+    RegionType GetSearchRegion() {return m_searchRegion;}
+
+    /// Number of voxels settled by the search, over all attempts
+    long GetNumberOfVisitedVoxels() {return m_numberOfVisitedVoxels;}
+
+  private:
+    float DIST_INF;
+
+    typedef typename SourceImageType::PixelType SourcePixelType;
+
+    const SourceImageType* m_img;
+    const SourcePixelType* m_imgBufferPointer;
+
+    IndexType m_startIndex;
+    IndexType m_endIndex;
+    long m_margin;
+
+    long m_DIMX, m_DIMY, m_DIMZ, m_DIMXY;
+
+    RegionType m_searchRegion;
+
+    bool m_pathFound;
+    std::vector<long> m_path;
+    float m_pathCost;
+    long m_numberOfVisitedVoxels;
+
+    bool searchInRegion(const RegionType& region);
+  };
+
+} ///< namespace gth818n
+
+#include "BidirectionalOptimalPath3D.hxx"
+
+#endif
@@ -0,0 +1,283 @@
+#ifndef BidirectionalOptimalPath3D_hxx
+#define BidirectionalOptimalPath3D_hxx
+
+#include <algorithm>
+#include <functional>
+#include <iostream>
+#include <limits>
+#include <queue>
+#include <utility>
+
+// local
+#include "BidirectionalOptimalPath3D.h"
+
+
+namespace gth818n
+{
+  template<typename SourceImageType>
+  BidirectionalOptimalPath3D<SourceImageType>::BidirectionalOptimalPath3D()
+  {
+    DIST_INF = std::numeric_limits<float>::max();
+
+    m_img = NULL;
+    m_imgBufferPointer = NULL;
+    m_margin = 10;
+
+    m_pathFound = false;
+    m_pathCost = DIST_INF;
+    m_numberOfVisitedVoxels = 0;
+
+    return;
+  }
+
+  template<typename SourceImageType>
+  void
+  BidirectionalOptimalPath3D<SourceImageType>::SetSourceImage(const SourceImageType* img)
+  {
+    m_img = img;
+
+    return;
+  }
+
+  template<typename SourceImageType>
+  void
+  BidirectionalOptimalPath3D<SourceImageType>::update()
+  {
+    if (!m_img)
+      {
+        std::cerr<<"!m_img\n";
+        abort();
+      }
+
+    RegionType largestRegion = m_img->GetLargestPossibleRegion();
+
+    m_imgBufferPointer = m_img->GetBufferPointer();
+
+    m_DIMX = largestRegion.GetSize()[0];
+    m_DIMY = largestRegion.GetSize()[1];
+    m_DIMZ = largestRegion.GetSize()[2];
+    m_DIMXY = m_DIMX*m_DIMY;
+
+    m_pathFound = false;
+    m_path.clear();
+    m_pathCost = DIST_INF;
+    m_numberOfVisitedVoxels = 0;
+
+    if (!largestRegion.IsInside(m_startIndex) || !largestRegion.IsInside(m_endIndex))
+      {
+        std::cerr<<"start or end point is outside of the image\n";
+        return;
+      }
+
+    long margin = m_margin;
+    while (true)
+      {
+        IndexType regionIndex;
+        typename RegionType::SizeType regionSize;
+        for (unsigned int d = 0; d < 3; ++d)
+          {
+            long lower = std::min(m_startIndex[d], m_endIndex[d]) - margin;
+            long upper = std::max(m_startIndex[d], m_endIndex[d]) + margin;
+            regionIndex[d] = lower;
+            regionSize[d] = upper - lower + 1;
+          }
+
+        m_searchRegion.SetIndex(regionIndex);
+        m_searchRegion.SetSize(regionSize);
+        m_searchRegion.Crop(largestRegion);
+
+        if (searchInRegion(m_searchRegion))
+          {
+            m_pathFound = true;
+            return;
+          }
+
+        if (m_searchRegion == largestRegion)
+          {
+            std::cerr<<"no path found between the start and end points\n";
+            return;
+          }
+
+        margin = margin > 0 ? 2*margin : 1;
+        std::cout<<"no path found in search region, extending the margin to "<<margin<<"\n"<<std::flush;
+      }
+  }
+
+  template<typename SourceImageType>
+  bool
+  BidirectionalOptimalPath3D<SourceImageType>::searchInRegion(const RegionType& region)
+  {
+    // offset of the region in the image, assuming the image region starts at 0 as in SeededOptimalPathFilter3D
+    const long ox = region.GetIndex()[0] - m_img->GetLargestPossibleRegion().GetIndex()[0];
+    const long oy = region.GetIndex()[1] - m_img->GetLargestPossibleRegion().GetIndex()[1];
+    const long oz = region.GetIndex()[2] - m_img->GetLargestPossibleRegion().GetIndex()[2];
+
+    const long rx = region.GetSize()[0];
+    const long ry = region.GetSize()[1];
+    const long rz = region.GetSize()[2];
+    const long rxy = rx*ry;
+    const long n = rxy*rz;
+
+    // index 0 is the search from the start point, 1 from the end point
+    std::vector<float> dist[2];
+    std::vector<int> pred[2];
+    std::vector<char> settled[2];
+
+    typedef std::pair<float, long> QueueEntryType;
+    typedef std::priority_queue<QueueEntryType, std::vector<QueueEntryType>, std::greater<QueueEntryType> > QueueType;
+    QueueType queue[2];
+
+    for (int side = 0; side < 2; ++side)
+      {
+        dist[side].assign(n, DIST_INF);
+        pred[side].assign(n, -1);
+        settled[side].assign(n, 0);
+      }
+
+    long startLocal = (m_startIndex[0] - region.GetIndex()[0]) + (m_startIndex[1] - region.GetIndex()[1])*rx + (m_startIndex[2] - region.GetIndex()[2])*rxy;
+    long endLocal = (m_endIndex[0] - region.GetIndex()[0]) + (m_endIndex[1] - region.GetIndex()[1])*rx + (m_endIndex[2] - region.GetIndex()[2])*rxy;
+
+    if (startLocal == endLocal)
+      {
+        m_path.assign(1, (startLocal % rx + ox) + ((startLocal / rx) % ry + oy)*m_DIMX + (startLocal / rxy + oz)*m_DIMXY);
+        m_pathCost = 0;
+        return true;
+      }
+
+    dist[0][startLocal] = 0;
+    queue[0].push(QueueEntryType(0, startLocal));
+    dist[1][endLocal] = 0;
+    queue[1].push(QueueEntryType(0, endLocal));
+
+    // length of the shortest path found so far, and the step where the two searches meet on it
+    float mu = DIST_INF;
+    long meetForward = -1;
+    long meetBackward = -1;
+
+    while (true)
+      {
+        // drop queue entries of settled voxels and outdated distances
+        for (int side = 0; side < 2; ++side)
+          {
+            while (!queue[side].empty() &&
+                   (settled[side][queue[side].top().second] || queue[side].top().first > dist[side][queue[side].top().second]))
+              {
+                queue[side].pop();
+              }
+          }
+
+        if (queue[0].empty() || queue[1].empty())
+          {
+            break;
+          }
+
+        // no path through unsettled voxels can be shorter than mu
+        if (queue[0].top().first + queue[1].top().first >= mu)
+          {
+            break;
+          }
+
+        // advance the smaller frontier
+        int side = queue[0].size() <= queue[1].size() ? 0 : 1;
+        int other = 1 - side;
+
+        long u = queue[side].top().second;
+        float du = queue[side].top().first;
+        queue[side].pop();
+        settled[side][u] = 1;
+        ++m_numberOfVisitedVoxels;
+
+        long ux = u % rx;
+        long uy = (u / rx) % ry;
+        long uz = u / rxy;
+
+        // As in SeededOptimalPathFilter3D, steps only start from voxels that are not on the image boundary.
+        // The search from the end point follows steps backwards, so it checks the voxel it steps to.
+        bool uInterior = (ux + ox > 0 && ux + ox < m_DIMX - 1 && uy + oy > 0 && uy + oy < m_DIMY - 1 && uz + oz > 0 && uz + oz < m_DIMZ - 1);
+        if (side == 0 && !uInterior)
+          {
+            continue;
+          }
+
+        SourcePixelType pixCenter = m_imgBufferPointer[(ux + ox) + (uy + oy)*m_DIMX + (uz + oz)*m_DIMXY];
+
+        for (long iz = -1; iz <= 1; iz++)
+          {
+            long vz = uz + iz;
+            if (vz < 0 || vz >= rz)
+              {
+                continue;
+              }
+            for (long iy = -1; iy <= 1; iy++)
+              {
+                long vy = uy + iy;
+                if (vy < 0 || vy >= ry)
+                  {
+                    continue;
+                  }
+                for (long ix = -1; ix <= 1; ix++)
+                  {
+                    long vx = ux + ix;
+                    if ((ix == 0 && iy == 0 && iz == 0) || vx < 0 || vx >= rx)
+                      {
+                        continue;
+                      }
+
+                    if (side == 1 &&
+                        !(vx + ox > 0 && vx + ox < m_DIMX - 1 && vy + oy > 0 && vy + oy < m_DIMY - 1 && vz + oz > 0 && vz + oz < m_DIMZ - 1))
+                      {
+                        continue;
+                      }
+
+                    long v = vx + vy*rx + vz*rxy;
+                    if (settled[side][v])
+                      {
+                        continue;
+                      }
+
+                    float t = (pixCenter + m_imgBufferPointer[(vx + ox) + (vy + oy)*m_DIMX + (vz + oz)*m_DIMXY])/2.0 + du;
+
+                    if (t < dist[side][v])
+                      {
+                        dist[side][v] = t;
+                        pred[side][v] = static_cast<int>(u);
+                        queue[side].push(QueueEntryType(t, v));
+                      }
+
+                    if (dist[other][v] < DIST_INF && t + dist[other][v] < mu)
+                      {
+                        mu = t + dist[other][v];
+                        meetForward = side == 0 ? u : v;
+                        meetBackward = side == 0 ? v : u;
+                      }
+                  }
+              }
+          }
+      }
+
+    if (meetForward < 0)
+      {
+        return false;
+      }
+
+    // start -> meetForward, then meetBackward -> end
+    m_path.clear();
+    for (long l = meetForward; l >= 0; l = pred[0][l])
+      {
+        m_path.push_back((l % rx + ox) + ((l / rx) % ry + oy)*m_DIMX + (l / rxy + oz)*m_DIMXY);
+      }
+    std::reverse(m_path.begin(), m_path.end());
+    for (long l = meetBackward; l >= 0; l = pred[1][l])
+      {
+        m_path.push_back((l % rx + ox) + ((l / rx) % ry + oy)*m_DIMX + (l / rxy + oz)*m_DIMXY);
+      }
+
+    m_pathCost = mu;
+
+    return true;
+  }
+
+} ///< namespace gth818n
+
+
+#endif
@@ -2,6 +2,7 @@
 
 #include <omp.h>
 
+#include "BidirectionalOptimalPath3D.h"
 #include "SeededOptimalPathFilter3D.h"
 #include "ShortCutFilter3D.h"
 
@@ -56,6 +57,13 @@ namespace
   // end is labeled as 2, compute the optimal path
   LabelImageType::Pointer computeOptimalPathLabelImage(ImageType::Pointer metricImage, LabelImageType::Pointer inputSeedLabelImage);
 
+  // Same paths as computeOptimalPathLabelImage for each i-1, i point
+  // pair, but each search is restricted to the bounding box of the
+  // two points dilated by searchMargin, and all the paths are written
+  // in a single label image, so no per-pair seed or path image is
+  // allocated.
+  LabelImageType::Pointer computeOptimalPathsInRegions(ImageType::Pointer metricImage, const std::vector<std::vector<float> >& fiducialList, long searchMargin);
+
   // Merge each optimal path between i-1 and i points
   LabelImageType::Pointer mergeLabelImages(std::vector<LabelImageType::Pointer> labelImageList);
 
@@ -91,39 +99,48 @@ int main( int argc, char * argv[] )
 
   ImageType::Pointer vesselnessMetricImage = reader->GetOutput();
 
-  //--------------------------------------------------------------------------------
-  // Get label image from fiducial list
-  std::vector<LabelImageType::Pointer> seedImageList = getLabelImageListFromFiducialList(vesselnessMetricImage, fiducialsAlongCA);
+  LabelImageType::Pointer caAxiaLabelImage;
 
-  //--------------------------------------------------------------------------------
-  // for each separated seed label image, trace in that one, in parallel
-  std::vector<LabelImageType::Pointer> optimalPathLabelImageList(seedImageList.size());
-#pragma omp parallel for
-  for (std::size_t it = 0; it < seedImageList.size(); ++it)
+  if (pathMode == "Region")
     {
-      std::cout<<"tracing in the "<<it<<" of "<<seedImageList.size()<<" images\n"<<std::flush;
-      LabelImageType::Pointer thisSeedImage = seedImageList[it];
-
-      // {
-      //   char name[1000];
-      //   sprintf(name, "seed_%d.nrrd", it);
-      //   typedef itk::ImageFileWriter<LabelImageType> WriterType;
-      //   typename WriterType::Pointer writer = WriterType::New();
-      //   writer->SetFileName( name );
-      //   writer->SetInput( thisSeedImage );
-      //   writer->SetUseCompression(1);
-      //   writer->Update();
-      // }
-
-      optimalPathLabelImageList[it] = computeOptimalPathLabelImage(vesselnessMetricImage, thisSeedImage);
+      caAxiaLabelImage = computeOptimalPathsInRegions(vesselnessMetricImage, fiducialsAlongCA, searchMargin);
     }
+  else
+    {
+      //--------------------------------------------------------------------------------
+      // Get label image from fiducial list
+      std::vector<LabelImageType::Pointer> seedImageList = getLabelImageListFromFiducialList(vesselnessMetricImage, fiducialsAlongCA);
 
-
-  //--------------------------------------------------------------------------------
-  // merge resulting optimal path label images
-  std::cout<<"merge sections of axis ..."<<std::flush;
-  LabelImageType::Pointer caAxiaLabelImage = mergeLabelImages(optimalPathLabelImageList);
-  std::cout<<"done.\n"<<std::flush;
+      //--------------------------------------------------------------------------------
+      // for each separated seed label image, trace in that one, in parallel
+      std::vector<LabelImageType::Pointer> optimalPathLabelImageList(seedImageList.size());
+#pragma omp parallel for
+      for (std::size_t it = 0; it < seedImageList.size(); ++it)
+        {
+          std::cout<<"tracing in the "<<it<<" of "<<seedImageList.size()<<" images\n"<<std::flush;
+          LabelImageType::Pointer thisSeedImage = seedImageList[it];
+
+          // {
+          //   char name[1000];
+          //   sprintf(name, "seed_%d.nrrd", it);
+          //   typedef itk::ImageFileWriter<LabelImageType> WriterType;
+          //   typename WriterType::Pointer writer = WriterType::New();
+          //   writer->SetFileName( name );
+          //   writer->SetInput( thisSeedImage );
+          //   writer->SetUseCompression(1);
+          //   writer->Update();
+          // }
+
+          optimalPathLabelImageList[it] = computeOptimalPathLabelImage(vesselnessMetricImage, thisSeedImage);
+        }
+
+
+      //--------------------------------------------------------------------------------
+      // merge resulting optimal path label images
+      std::cout<<"merge sections of axis ..."<<std::flush;
+      caAxiaLabelImage = mergeLabelImages(optimalPathLabelImageList);
+      std::cout<<"done.\n"<<std::flush;
+    }
 
   //--------------------------------------------------------------------------------
   // write output
@@ -202,6 +219,62 @@ namespace
     return optimalPathLabelImage;
   }
 
+  LabelImageType::Pointer computeOptimalPathsInRegions(ImageType::Pointer metricImage, const std::vector<std::vector<float> >& fiducialList, long searchMargin)
+  {
+    //----------------------------------------------------------------------
+    // final output label image
+    LabelImageType::Pointer axisLabelImage = LabelImageType::New();
+    axisLabelImage->SetRegions(metricImage->GetLargestPossibleRegion() );
+    axisLabelImage->Allocate();
+    axisLabelImage->CopyInformation(metricImage);
+    axisLabelImage->FillBuffer(0);
+
+    LabelImageType::PixelType* axisLabelImageBufferPointer = axisLabelImage->GetBufferPointer();
+
+    long numberOfPairs = static_cast<long>(fiducialList.size()) - 1;
+
+#pragma omp parallel for schedule(dynamic)
+    for (long i = 0; i < numberOfPairs; ++i)
+      {
+        ImageType::PointType lpsPointStart;
+        lpsPointStart[0] = fiducialList[i][0];
+        lpsPointStart[1] = fiducialList[i][1];
+        lpsPointStart[2] = fiducialList[i][2];
+        ImageType::IndexType indexStart;
+        metricImage->TransformPhysicalPointToIndex(lpsPointStart, indexStart);
+
+        ImageType::PointType lpsPointEnd;
+        lpsPointEnd[0] = fiducialList[i+1][0];
+        lpsPointEnd[1] = fiducialList[i+1][1];
+        lpsPointEnd[2] = fiducialList[i+1][2];
+        ImageType::IndexType indexEnd;
+        metricImage->TransformPhysicalPointToIndex(lpsPointEnd, indexEnd);
+
+        gth818n::BidirectionalOptimalPath3D<ImageType> op;
+        op.SetSourceImage(metricImage);
+        op.SetStartIndex(indexStart);
+        op.SetEndIndex(indexEnd);
+        op.SetMargin(searchMargin);
+        op.update();
+
+#pragma omp critical
+        {
+          std::cout<<"traced section "<<i<<" of "<<numberOfPairs<<" from "<<indexStart<<" to "<<indexEnd
+                   <<" in region of size "<<op.GetSearchRegion().GetSize()
+                   <<", visited "<<op.GetNumberOfVisitedVoxels()<<" voxels\n"<<std::flush;
+
+          // as in SeededOptimalPathFilter3D, the starting point is not part of the back trace
+          const std::vector<long>& path = op.GetPath();
+          for (std::size_t it = 1; it < path.size(); ++it)
+            {
+              axisLabelImageBufferPointer[path[it]] = 1;
+            }
+        }
+      }
+
+    return axisLabelImage;
+  }
+
   LabelImageType::Pointer mergeLabelImages(std::vector<LabelImageType::Pointer> labelImageList)
   {
     //--------------------------------------------------------------------------------
@@ -0,0 +1,163 @@
+// Compare the full image optimal path (SeededOptimalPathFilter3D, one
+// seed and one path label image per pair of points, then merged) with
+// the region restricted bidirectional search (BidirectionalOptimalPath3D)
+// on a synthetic vessel. Both must give paths of the same cost.
+//
+// Usage: ComputeAxisFromVesselnessBenchmark [imageSize] [numberOfPoints] [searchMargin]
+
+#include <algorithm>
+#include <cmath>
+#include <cstdlib>
+#include <iostream>
+#include <vector>
+
+#include "itkImage.h"
+#include "itkTimeProbe.h"
+
+#include "BidirectionalOptimalPath3D.h"
+#include "SeededOptimalPathFilter3D.h"
+
+namespace
+{
+  const int ImageDimension = 3;
+
+  typedef float FloatPixelType;
+  typedef itk::Image<FloatPixelType, ImageDimension> ImageType;
+
+  typedef short LabelPixelType;
+  typedef itk::Image<LabelPixelType, ImageDimension> LabelImageType;
+
+  //--------------------------------------------------------------------------------
+  // metric image with a low cost helix in a high cost background, and
+  // numberOfPoints points along the helix
+  ImageType::Pointer createHelixMetricImage(long imageSize, long numberOfPoints, std::vector<ImageType::IndexType>& pointList)
+  {
+    ImageType::SizeType size;
+    size.Fill(imageSize);
+    ImageType::RegionType region;
+    region.SetSize(size);
+
+    ImageType::Pointer metricImage = ImageType::New();
+    metricImage->SetRegions(region);
+    metricImage->Allocate();
+    metricImage->FillBuffer(100.0);
+
+    double center = imageSize/2.0;
+    double radius = imageSize/4.0;
+    double turns = 2.0;
+    long numberOfSamples = 20*imageSize;
+    for (long it = 0; it <= numberOfSamples; ++it)
+      {
+        double s = static_cast<double>(it)/numberOfSamples;
+        double angle = 2*M_PI*turns*s;
+
+        ImageType::IndexType index;
+        index[0] = static_cast<long>(center + radius*std::cos(angle));
+        index[1] = static_cast<long>(center + radius*std::sin(angle));
+        index[2] = static_cast<long>(2 + s*(imageSize - 5));
+
+        // tube of radius 1
+        for (long iz = -1; iz <= 1; ++iz)
+          {
+            for (long iy = -1; iy <= 1; ++iy)
+              {
+                for (long ix = -1; ix <= 1; ++ix)
+                  {
+                    ImageType::IndexType tubeIndex = index;
+                    tubeIndex[0] += ix;
+                    tubeIndex[1] += iy;
+                    tubeIndex[2] += iz;
+                    metricImage->SetPixel(tubeIndex, (ix == 0 && iy == 0 && iz == 0) ? 1.0 : 10.0);
+                  }
+              }
+          }
+
+        if (it % (numberOfSamples/(numberOfPoints - 1)) == 0 && static_cast<long>(pointList.size()) < numberOfPoints)
+          {
+            pointList.push_back(index);
+          }
+      }
+
+    return metricImage;
+  }
+}
+
+int main(int argc, char* argv[])
+{
+  long imageSize = argc > 1 ? atol(argv[1]) : 96;
+  long numberOfPoints = argc > 2 ? atol(argv[2]) : 6;
+  long searchMargin = argc > 3 ? atol(argv[3]) : 20;
+
+  std::vector<ImageType::IndexType> pointList;
+  ImageType::Pointer metricImage = createHelixMetricImage(imageSize, numberOfPoints, pointList);
+  long numberOfPairs = static_cast<long>(pointList.size()) - 1;
+  double numberOfVoxels = static_cast<double>(metricImage->GetLargestPossibleRegion().GetNumberOfPixels());
+
+  itk::TimeProbe fullImageProbe;
+  itk::TimeProbe regionProbe;
+  double fullImageBytes = 0;
+  double regionBytes = numberOfVoxels*sizeof(LabelPixelType);
+
+  int status = EXIT_SUCCESS;
+
+  for (long i = 0; i < numberOfPairs; ++i)
+    {
+      //--------------------------------------------------------------------------------
+      // full image search, as in computeOptimalPathLabelImage
+      fullImageProbe.Start();
+
+      LabelImageType::Pointer seedImage = LabelImageType::New();
+      seedImage->SetRegions(metricImage->GetLargestPossibleRegion() );
+      seedImage->Allocate();
+      seedImage->CopyInformation(metricImage);
+      seedImage->FillBuffer(0);
+      seedImage->SetPixel(pointList[i], 1);
+      seedImage->SetPixel(pointList[i+1], 2);
+
+      gth818n::SeededOptimalPathFilter3D<ImageType, LabelImageType> sc;
+      sc.SetSourceImage(metricImage);
+      sc.SetSeedlImage(seedImage);
+      sc.update();
+
+      fullImageProbe.Stop();
+
+      float fullImageCost = sc.GetDistanceImage()->GetPixel(pointList[i+1]);
+
+      // the seed and path label images are kept for the merge, the heap
+      // nodes and the distance image only while tracing
+      fullImageBytes = std::max(fullImageBytes, numberOfVoxels*(sizeof(gth818n::HeapNodeWithPre) + sizeof(float)));
+
+      //--------------------------------------------------------------------------------
+      // region restricted bidirectional search
+      regionProbe.Start();
+
+      gth818n::BidirectionalOptimalPath3D<ImageType> op;
+      op.SetSourceImage(metricImage);
+      op.SetStartIndex(pointList[i]);
+      op.SetEndIndex(pointList[i+1]);
+      op.SetMargin(searchMargin);
+      op.update();
+
+      regionProbe.Stop();
+
+      double searchRegionVoxels = static_cast<double>(op.GetSearchRegion().GetNumberOfPixels());
+      regionBytes = std::max(regionBytes, numberOfVoxels*sizeof(LabelPixelType) + 2*searchRegionVoxels*(sizeof(float) + sizeof(int) + sizeof(char)));
+
+      std::cout<<"section "<<i<<": full image cost "<<fullImageCost<<", region cost "<<op.GetPathCost()
+               <<", search region "<<op.GetSearchRegion().GetSize()<<", visited "<<op.GetNumberOfVisitedVoxels()<<" voxels\n";
+
+      // the full image distance starts at a small epsilon instead of 0
+      if (!op.GetPathFound() || std::fabs(fullImageCost - op.GetPathCost()) > 1e-2 + 1e-4*fullImageCost)
+        {
+          std::cerr<<"section "<<i<<": the region search did not find the optimal path\n";
+          status = EXIT_FAILURE;
+        }
+    }
+
+  fullImageBytes += 2*numberOfPairs*numberOfVoxels*sizeof(LabelPixelType) + numberOfVoxels*sizeof(LabelPixelType);
+
+  std::cout<<"full image: "<<fullImageProbe.GetTotal()<<" s, about "<<fullImageBytes/(1024*1024)<<" MB\n";
+  std::cout<<"region:     "<<regionProbe.GetTotal()<<" s, about "<<regionBytes/(1024*1024)<<" MB\n";
+
+  return status;
+}
@@ -46,6 +46,19 @@ namespace
 
 
   std::vector<std::vector<float> > findNewFiducialPoints(LabelImageType::Pointer axisLabelImage, const std::vector<std::vector<float> >& fiducialList);
+
+  // Geodesic distance (same metric as the optimal path) from the
+  // center axis to every voxel of the image. It is computed once for
+  // all the branches and can be saved and given back to the next run,
+  // so that adding a branch only needs a back trace.
+  ImageType::Pointer computeDistanceImageFromAxis(ImageType::Pointer metricImage, LabelImageType::Pointer axisLabelImage);
+
+  // From each point, go down the distance image back to the axis or to
+  // a branch traced before. The axis keeps its labels (1) and the
+  // voxels of the i-th branch are labeled i + 2, so that each branch
+  // only contains the section from its point to where it joins the
+  // tree.
+  LabelImageType::Pointer backTraceBranchTree(ImageType::Pointer metricImage, ImageType::Pointer distanceImage, LabelImageType::Pointer axisLabelImage, const std::vector<std::vector<float> >& fiducialList);
 }
 
 int main( int argc, char * argv[] )
@@ -68,8 +81,46 @@ int main( int argc, char * argv[] )
 
   LabelImageType::Pointer axisLabelWithBranches = LabelImageType::New();
 
+  if (branchMode == "Tree")
+    {
+      std::vector<std::vector<float> > newFiducials = findNewFiducialPoints(caAxiaLabelImage, fiducialsOnBranches);
+      std::cout<<"Totally "<<fiducialsOnBranches.size()<<" fiducials. "<<newFiducials.size()<<" new.\n";
+
+      ImageType::Pointer distanceImage;
+      if (!inputDistanceMapVolume.empty())
+        {
+          ReaderType::Pointer distanceReader = ReaderType::New();
+          distanceReader->SetFileName( inputDistanceMapVolume.c_str() );
+          distanceReader->Update();
+          distanceImage = distanceReader->GetOutput();
+
+          if (distanceImage->GetLargestPossibleRegion() != vesselnessMetricImage->GetLargestPossibleRegion())
+            {
+              std::cerr<<"the input distance map volume must have the same dimensions as the vesselness volume\n";
+              return EXIT_FAILURE;
+            }
+        }
+      else
+        {
+          std::cout<<"compute distance from the axis ..."<<std::flush;
+          distanceImage = computeDistanceImageFromAxis(vesselnessMetricImage, caAxiaLabelImage);
+          std::cout<<"done.\n"<<std::flush;
+        }
+
+      axisLabelWithBranches = backTraceBranchTree(vesselnessMetricImage, distanceImage, caAxiaLabelImage, newFiducials);
+
+      if (!outputDistanceMapVolume.empty())
+        {
+          typedef itk::ImageFileWriter<ImageType> DistanceWriterType;
+          DistanceWriterType::Pointer distanceWriter = DistanceWriterType::New();
+          distanceWriter->SetFileName( outputDistanceMapVolume.c_str() );
+          distanceWriter->SetInput( distanceImage );
+          distanceWriter->SetUseCompression(1);
+          distanceWriter->Update();
+        }
+    }
   // Segment branches
-  if (!fiducialsOnBranches.empty())
+  else if (!fiducialsOnBranches.empty())
     {
       std::vector<std::vector<float> > newFiducials = findNewFiducialPoints(caAxiaLabelImage, fiducialsOnBranches);
 
@@ -203,4 +254,138 @@ namespace
     return axisWithBranches;
   }
 
+  ImageType::Pointer computeDistanceImageFromAxis(ImageType::Pointer metricImage, LabelImageType::Pointer axisLabelImage)
+  {
+    LabelImageType::Pointer seedLabelImage = LabelImageType::New();
+    seedLabelImage->SetRegions(axisLabelImage->GetLargestPossibleRegion() );
+    seedLabelImage->Allocate();
+    seedLabelImage->CopyInformation(axisLabelImage);
+    seedLabelImage->FillBuffer(0);
+
+    const LabelImageType::PixelType* axisLabelImagePtr = axisLabelImage->GetBufferPointer();
+    LabelImageType::PixelType* seedLabelImagePtr = seedLabelImage->GetBufferPointer();
+    long np = axisLabelImage->GetLargestPossibleRegion().GetNumberOfPixels();
+
+    for (long it = 0; it < np; ++it)
+      {
+        if (axisLabelImagePtr[it] != 0)
+          {
+            seedLabelImagePtr[it] = 1;
+          }
+      }
+
+    // Without end seed (label 2), the filter does not stop early and
+    // the distance is computed in the whole image.
+    gth818n::SeededOptimalPathFilter3D<ImageType, LabelImageType> sc;
+    sc.SetSourceImage(metricImage);
+    sc.SetSeedlImage(seedLabelImage);
+    sc.update();
+
+    return sc.GetDistanceImage();
+  }
+
+  LabelImageType::Pointer backTraceBranchTree(ImageType::Pointer metricImage, ImageType::Pointer distanceImage, LabelImageType::Pointer axisLabelImage, const std::vector<std::vector<float> >& fiducialList)
+  {
+    LabelImageType::Pointer treeLabelImage = LabelImageType::New();
+    treeLabelImage->SetRegions(axisLabelImage->GetLargestPossibleRegion() );
+    treeLabelImage->Allocate();
+    treeLabelImage->CopyInformation(axisLabelImage);
+    treeLabelImage->FillBuffer(0);
+
+    const LabelImageType::PixelType* axisLabelImagePtr = axisLabelImage->GetBufferPointer();
+    LabelImageType::PixelType* treeLabelImagePtr = treeLabelImage->GetBufferPointer();
+    long np = axisLabelImage->GetLargestPossibleRegion().GetNumberOfPixels();
+
+    for (long it = 0; it < np; ++it)
+      {
+        if (axisLabelImagePtr[it] != 0)
+          {
+            treeLabelImagePtr[it] = 1;
+          }
+      }
+
+    const ImageType::PixelType* metricImagePtr = metricImage->GetBufferPointer();
+    const ImageType::PixelType* distanceImagePtr = distanceImage->GetBufferPointer();
+
+    long DIMX = axisLabelImage->GetLargestPossibleRegion().GetSize()[0];
+    long DIMY = axisLabelImage->GetLargestPossibleRegion().GetSize()[1];
+    long DIMZ = axisLabelImage->GetLargestPossibleRegion().GetSize()[2];
+    long DIMXY = DIMX*DIMY;
+
+    for (std::size_t i = 0; i < fiducialList.size(); ++i)
+      {
+        LabelImageType::PointType lpsPoint;
+        lpsPoint[0] = fiducialList[i][0];
+        lpsPoint[1] = fiducialList[i][1];
+        lpsPoint[2] = fiducialList[i][2];
+        LabelImageType::IndexType index;
+        if (!axisLabelImage->TransformPhysicalPointToIndex(lpsPoint, index))
+          {
+            std::cerr<<"branch point "<<i<<" is outside of the image\n";
+            continue;
+          }
+
+        LabelImageType::PixelType branchLabel = static_cast<LabelImageType::PixelType>(i + 2);
+
+        // As in SeededOptimalPathFilter3D, a voxel u was reached from
+        // an interior neighbor v minimizing distance(v) + (metric(u) +
+        // metric(v))/2, which gives the optimal path when followed
+        // from the branch point down to the tree.
+        long u = index[0] + index[1]*DIMX + index[2]*DIMXY;
+        long length = 0;
+        while (treeLabelImagePtr[u] == 0)
+          {
+            treeLabelImagePtr[u] = branchLabel;
+            ++length;
+
+            long ux = u % DIMX;
+            long uy = (u / DIMX) % DIMY;
+            long uz = u / DIMXY;
+
+            long previous = -1;
+            double previousDistance = distanceImagePtr[u];
+            for (long iz = -1; iz <= 1; ++iz)
+              {
+                for (long iy = -1; iy <= 1; ++iy)
+                  {
+                    for (long ix = -1; ix <= 1; ++ix)
+                      {
+                        long vx = ux + ix;
+                        long vy = uy + iy;
+                        long vz = uz + iz;
+                        if ((ix == 0 && iy == 0 && iz == 0) || vx < 1 || vx >= DIMX - 1 || vy < 1 || vy >= DIMY - 1 || vz < 1 || vz >= DIMZ - 1)
+                          {
+                            continue;
+                          }
+
+                        long v = vx + vy*DIMX + vz*DIMXY;
+                        if (distanceImagePtr[v] >= distanceImagePtr[u])
+                          {
+                            continue;
+                          }
+
+                        double d = distanceImagePtr[v] + (metricImagePtr[u] + metricImagePtr[v])/2.0;
+                        if (previous < 0 || d < previousDistance)
+                          {
+                            previous = v;
+                            previousDistance = d;
+                          }
+                      }
+                  }
+              }
+
+            if (previous < 0)
+              {
+                std::cerr<<"branch point "<<i<<" is not connected to the axis\n";
+                break;
+              }
+
+            u = previous;
+          }
+
+        std::cout<<"branch "<<i<<" (label "<<branchLabel<<"): "<<length<<" voxels, joins label "<<treeLabelImagePtr[u]<<"\n"<<std::flush;
+      }
+
+    return treeLabelImage;
+  }
 }
@@ -1,4 +1,5 @@
 #include <algorithm>
+#include <cmath>
 
 #include "itkImageFileWriter.h"
 
@@ -6,6 +7,10 @@
 
 #include "itkHessian3DToVesselnessMeasureImageFilter.h"
 #include "itkHessianRecursiveGaussianImageFilter.h"
+#include "itkImageRegionConstIterator.h"
+#include "itkImageRegionConstIteratorWithIndex.h"
+#include "itkImageRegionIterator.h"
+#include "itkRegionOfInterestImageFilter.h"
 
 #include "itkPluginUtilities.h"
 
@@ -26,13 +31,38 @@ namespace
   typedef itk::Image<FloatPixelType, ImageDimension> FloatImageType;
   typedef FloatImageType ImageType;
 
+  typedef short LabelPixelType;
+  typedef itk::Image<LabelPixelType, ImageDimension> LabelImageType;
+
   //--------------------------------------------------------------------------------
   // functions
   ImageType::Pointer flipImageIntensity(ImageType::Pointer image);
 
   // Compute the vesselness. Assuming the vessle is BRIGHT wrt surrounding
   ImageType::Pointer compueVesselnessImage1(ImageType::Pointer ctImage, float sigma, float alpha1, float alpha2, double calcificationThreshold);
-  ImageType::Pointer compueVesselnessMetricImage1(ImageType::Pointer ctImage, float sigma, float alpha1, float alpha2, double calcificationThreshold);
+
+  // Bounding box of the voxels > 0 of the mask. Its size is 0 if there
+  // is no such voxel.
+  ImageType::RegionType computeMaskBoundingBox(LabelImageType::Pointer maskImage);
+
+  // Compute the vesselness in the bounding box of the mask, or in the
+  // whole image if there is no mask, as the maximum of the responses
+  // over the sigma list. With several sigmas, the responses are scale
+  // normalized and the maximum is divided by referenceSigma^2, which
+  // brings it back to the range of the unnormalized response at
+  // referenceSigma. The region is processed in tiles of tileSize
+  // voxels (0 for a single tile), each padded by the support of the
+  // Gaussian derivatives, so that the Hessian, which takes 6 times the
+  // memory of the image, is only allocated for one tile at a
+  // time. Voxels outside of the mask are 0.
+  ImageType::Pointer computeMultiscaleVesselnessImage(ImageType::Pointer ctImage, LabelImageType::Pointer maskImage, const std::vector<float>& sigmaList, float referenceSigma, float alpha1, float alpha2, long tileSize);
+
+  // From vesselness image, compute metric image to be used in short
+  // cut. This is done in place to avoid allocating another image. The
+  // metric of the voxels outside of the mask, if any, is maximal. If
+  // monotonic is true, responses above the one of lowest cost are given
+  // that cost, so that the metric never increases with the vesselness.
+  void convertVesselnessToMetricImage(ImageType::Pointer vesselnessImage, LabelImageType::Pointer maskImage, bool monotonic);
 }
 
 
@@ -58,11 +88,39 @@ int main( int argc, char * argv[] )
       image = flipImageIntensity(image);
     }
 
+  //--------------------------------------------------------------------------------
+  // read the optional mask of the region to process
+  LabelImageType::Pointer maskImage;
+  if (!roiMaskVolume.empty())
+    {
+      typedef itk::ImageFileReader<LabelImageType>  LabelReaderType;
+      typename LabelReaderType::Pointer labelReader = LabelReaderType::New();
+      labelReader->SetFileName( roiMaskVolume.c_str() );
+      labelReader->Update();
+
+      maskImage = labelReader->GetOutput();
+
+      if (maskImage->GetLargestPossibleRegion() != image->GetLargestPossibleRegion())
+        {
+          std::cerr<<"the ROI mask volume must have the same dimensions as the input volume\n";
+          return EXIT_FAILURE;
+        }
+    }
+
+  std::vector<float> sigmas = sigmaList;
+  if (sigmas.empty())
+    {
+      sigmas.push_back(sigma);
+    }
+
   //--------------------------------------------------------------------------------
   // compute vesselness image from CT
   std::cout<<"compute vesselness metric image ..."<<std::flush;
   //ImageType::Pointer vesselnessImage = compueVesselnessImage1(image, sigma, alpha1, alpha2, calcificationThreshold);
-  ImageType::Pointer vesselnessMetricImage = compueVesselnessMetricImage1(image, sigma, alpha1, alpha2, calcificationThreshold);
+  ImageType::Pointer vesselnessMetricImage = computeMultiscaleVesselnessImage(image, maskImage, sigmas, sigma, alpha1, alpha2, tileSize);
+  // the metric was tuned for the single sigma response, the larger
+  // multiscale responses of strong or large vessels must not cost more
+  convertVesselnessToMetricImage(vesselnessMetricImage, maskImage, sigmas.size() > 1);
   std::cout<<"done.\n"<<std::flush;
 
   //--------------------------------------------------------------------------------
@@ -116,50 +174,229 @@ namespace
     return vesselnessImage;
   }
 
-  ImageType::Pointer compueVesselnessMetricImage1(ImageType::Pointer ctImage, float sigma, float alpha1, float alpha2, double calcificationThreshold)
+  ImageType::RegionType computeMaskBoundingBox(LabelImageType::Pointer maskImage)
   {
+    ImageType::IndexType lower;
+    ImageType::IndexType upper;
+    lower.Fill(itk::NumericTraits<ImageType::IndexValueType>::max());
+    upper.Fill(itk::NumericTraits<ImageType::IndexValueType>::NonpositiveMin());
+
+    typedef itk::ImageRegionConstIteratorWithIndex<LabelImageType> LabelIteratorType;
+    LabelIteratorType it(maskImage, maskImage->GetLargestPossibleRegion());
+    for (it.GoToBegin(); !it.IsAtEnd(); ++it)
+      {
+        if (it.Get() > 0)
+          {
+            const LabelImageType::IndexType& index = it.GetIndex();
+            for (unsigned int d = 0; d < ImageDimension; ++d)
+              {
+                lower[d] = std::min(lower[d], index[d]);
+                upper[d] = std::max(upper[d], index[d]);
+              }
+          }
+      }
+
+    ImageType::RegionType boundingBox;
+    if (lower[0] > upper[0])
+      {
+        // empty mask
+        return boundingBox;
+      }
+
+    ImageType::SizeType size;
+    for (unsigned int d = 0; d < ImageDimension; ++d)
+      {
+        size[d] = upper[d] - lower[d] + 1;
+      }
+    boundingBox.SetIndex(lower);
+    boundingBox.SetSize(size);
+
+    return boundingBox;
+  }
+
+  ImageType::Pointer computeMultiscaleVesselnessImage(ImageType::Pointer ctImage, LabelImageType::Pointer maskImage, const std::vector<float>& sigmaList, float referenceSigma, float alpha1, float alpha2, long tileSize)
+  {
+    typedef itk::RegionOfInterestImageFilter< ImageType, ImageType > ROIFilterType;
     typedef itk::HessianRecursiveGaussianImageFilter< ImageType > HessianFilterType;
     typedef itk::Hessian3DToVesselnessMeasureImageFilter< FloatPixelType > VesselnessMeasureFilterType;
 
-    HessianFilterType::Pointer hessianFilter = HessianFilterType::New();
-    hessianFilter->SetInput( ctImage );
-    hessianFilter->SetSigma( sigma );
+    ImageType::RegionType largestRegion = ctImage->GetLargestPossibleRegion();
 
-    VesselnessMeasureFilterType::Pointer vesselnessFilter = VesselnessMeasureFilterType::New();
-    vesselnessFilter->SetInput( hessianFilter->GetOutput() );
-    vesselnessFilter->SetAlpha1( alpha1 );
-    vesselnessFilter->SetAlpha2( alpha2 );
-    vesselnessFilter->Update();
+    ImageType::Pointer vesselnessImage = ImageType::New();
+    vesselnessImage->SetRegions(largestRegion);
+    vesselnessImage->Allocate();
+    vesselnessImage->CopyInformation(ctImage);
+    vesselnessImage->FillBuffer(0);
 
-    //return vesselnessFilter->GetOutput();
-    ImageType::Pointer vesselnessImage = vesselnessFilter->GetOutput();
-
-    //return vesselnessImage;
+    ImageType::RegionType processingRegion = maskImage ? computeMaskBoundingBox(maskImage) : largestRegion;
+    if (processingRegion.GetNumberOfPixels() == 0)
+      {
+        std::cout<<"the ROI mask is empty\n"<<std::flush;
+        return vesselnessImage;
+      }
 
     //--------------------------------------------------------------------------------
-    // from vesselness image, compute metric image to be used in short cut.
-    ImageType::Pointer metricImage = ImageType::New();
-    metricImage->SetRegions(vesselnessImage->GetLargestPossibleRegion() );
-    metricImage->Allocate();
-    metricImage->CopyInformation(vesselnessImage);
-    metricImage->FillBuffer(0);
+    // padding of the tiles so that the Gaussian derivatives at the tile
+    // borders are computed from the image around them
+    float maxSigma = *std::max_element(sigmaList.begin(), sigmaList.end());
+    ImageType::SizeType padding;
+    for (unsigned int d = 0; d < ImageDimension; ++d)
+      {
+        padding[d] = static_cast<ImageType::SizeValueType>(std::ceil(4.0*maxSigma/ctImage->GetSpacing()[d])) + 2;
+      }
+
+    ImageType::SizeType tileStep;
+    for (unsigned int d = 0; d < ImageDimension; ++d)
+      {
+        tileStep[d] = tileSize > 0 ? static_cast<ImageType::SizeValueType>(tileSize) : processingRegion.GetSize()[d];
+      }
+
+    std::vector<ImageType::RegionType> tileList;
+    ImageType::IndexType processingStart = processingRegion.GetIndex();
+    ImageType::IndexType processingEnd = processingRegion.GetUpperIndex();
+    for (long z = processingStart[2]; z <= processingEnd[2]; z += tileStep[2])
+      {
+        for (long y = processingStart[1]; y <= processingEnd[1]; y += tileStep[1])
+          {
+            for (long x = processingStart[0]; x <= processingEnd[0]; x += tileStep[0])
+              {
+                ImageType::IndexType tileIndex;
+                tileIndex[0] = x;
+                tileIndex[1] = y;
+                tileIndex[2] = z;
+
+                ImageType::RegionType tileRegion(tileIndex, tileStep);
+                tileRegion.Crop(processingRegion);
+                tileList.push_back(tileRegion);
+              }
+          }
+      }
+
+    // Hessian3DToVesselnessMeasureImageFilter does not normalize its
+    // response, so the Hessians are normalized when responses of
+    // different scales are compared. Normalization multiplies the
+    // Hessian by sigma^2, the combined response is scaled back to the
+    // range of the response at the reference sigma.
+    bool normalizeAcrossScale = sigmaList.size() > 1;
+    ImageType::PixelType responseScale = normalizeAcrossScale ? 1.0/(referenceSigma*referenceSigma) : 1.0;
+
+    for (std::size_t iTile = 0; iTile < tileList.size(); ++iTile)
+      {
+        const ImageType::RegionType& tileRegion = tileList[iTile];
 
+        ImageType::RegionType inputRegion = tileRegion;
+        inputRegion.PadByRadius(padding);
+        inputRegion.Crop(largestRegion);
+
+        if (tileList.size() > 1)
+          {
+            std::cout<<"processing tile "<<iTile + 1<<" of "<<tileList.size()<<"\n"<<std::flush;
+          }
+
+        ROIFilterType::Pointer roiFilter = ROIFilterType::New();
+        roiFilter->SetInput( ctImage );
+        roiFilter->SetRegionOfInterest( inputRegion );
+        roiFilter->Update();
+
+        ImageType::Pointer tileVesselnessImage;
+        for (std::size_t iSigma = 0; iSigma < sigmaList.size(); ++iSigma)
+          {
+            HessianFilterType::Pointer hessianFilter = HessianFilterType::New();
+            hessianFilter->SetInput( roiFilter->GetOutput() );
+            hessianFilter->SetSigma( sigmaList[iSigma] );
+            hessianFilter->SetNormalizeAcrossScale( normalizeAcrossScale );
+
+            VesselnessMeasureFilterType::Pointer vesselnessFilter = VesselnessMeasureFilterType::New();
+            vesselnessFilter->SetInput( hessianFilter->GetOutput() );
+            vesselnessFilter->SetAlpha1( alpha1 );
+            vesselnessFilter->SetAlpha2( alpha2 );
+            vesselnessFilter->Update();
+
+            ImageType::Pointer thisVesselnessImage = vesselnessFilter->GetOutput();
+            thisVesselnessImage->DisconnectPipeline();
+
+            if (!tileVesselnessImage)
+              {
+                tileVesselnessImage = thisVesselnessImage;
+                continue;
+              }
+
+            // keep the maximal response over the scales
+            ImageType::PixelType* tileVesselnessBufferPointer = tileVesselnessImage->GetBufferPointer();
+            const ImageType::PixelType* thisVesselnessBufferPointer = thisVesselnessImage->GetBufferPointer();
+            long np = tileVesselnessImage->GetLargestPossibleRegion().GetNumberOfPixels();
+            for (long it = 0; it < np; ++it)
+              {
+                tileVesselnessBufferPointer[it] = std::max(tileVesselnessBufferPointer[it], thisVesselnessBufferPointer[it]);
+              }
+          }
+
+        //--------------------------------------------------------------------------------
+        // copy the tile, without its padding, to the output. The output
+        // of the ROI filter starts at index 0.
+        ImageType::IndexType tileIndexInInput;
+        for (unsigned int d = 0; d < ImageDimension; ++d)
+          {
+            tileIndexInInput[d] = tileRegion.GetIndex()[d] - inputRegion.GetIndex()[d];
+          }
+        ImageType::RegionType tileRegionInInput(tileIndexInInput, tileRegion.GetSize());
+
+        itk::ImageRegionConstIterator<ImageType> tileIt(tileVesselnessImage, tileRegionInInput);
+        itk::ImageRegionIterator<ImageType> outputIt(vesselnessImage, tileRegion);
+        if (maskImage)
+          {
+            itk::ImageRegionConstIterator<LabelImageType> maskIt(maskImage, tileRegion);
+            for (tileIt.GoToBegin(), outputIt.GoToBegin(), maskIt.GoToBegin(); !outputIt.IsAtEnd(); ++tileIt, ++outputIt, ++maskIt)
+              {
+                if (maskIt.Get() > 0)
+                  {
+                    outputIt.Set(responseScale*tileIt.Get());
+                  }
+              }
+          }
+        else
+          {
+            for (tileIt.GoToBegin(), outputIt.GoToBegin(); !outputIt.IsAtEnd(); ++tileIt, ++outputIt)
+              {
+                outputIt.Set(responseScale*tileIt.Get());
+              }
+          }
+      }
+
+    return vesselnessImage;
+  }
+
+  void convertVesselnessToMetricImage(ImageType::Pointer vesselnessImage, LabelImageType::Pointer maskImage, bool monotonic)
+  {
     ImageType::PixelType* vesselnessImageBufferPointer = vesselnessImage->GetBufferPointer();
     long np = vesselnessImage->GetLargestPossibleRegion().GetNumberOfPixels();
-    ImageType::PixelType maxVesselness = *std::max_element(vesselnessImageBufferPointer, vesselnessImageBufferPointer+np);
 
-    const ImageType::PixelType* ctImageBufferPtr = ctImage->GetBufferPointer();
-    ImageType::PixelType* metricImageBufferPointer = metricImage->GetBufferPointer();
+    const LabelImageType::PixelType* maskImageBufferPointer = maskImage ? maskImage->GetBufferPointer() : 0;
+
+    // vesselness of the lowest metric, and upper bound of the metric,
+    // which is given to the voxels outside of the mask
+    const ImageType::PixelType lowestMetricVesselness = 13.0;
+    const ImageType::PixelType highestMetric = 100.0 + 0.01;
 
     ImageType::PixelType v;
     ImageType::PixelType m;
     for (long it = 0; it < np; ++it)
       {
+        if (maskImageBufferPointer && maskImageBufferPointer[it] <= 0)
+          {
+            vesselnessImageBufferPointer[it] = highestMetric;
+            continue;
+          }
+
         v = vesselnessImageBufferPointer[it];
+        if (monotonic)
+          {
+            v = std::min(v, lowestMetricVesselness);
+          }
 
         //m = maxVesselness - v;
 
-        m = exp(-(v - 13.0)*(v - 13.0)/(2*3.14*80.0));
+        m = exp(-(v - lowestMetricVesselness)*(v - lowestMetricVesselness)/(2*3.14*80.0));
         //m = exp(-(v - 13.0)*(v - 13.0));
         //m = atan2(30.0 - v, 10.0)/3.1415926 + 0.5;
         //m = m<0?0:m;
@@ -169,15 +406,10 @@ namespace
 
         //m = (v<20 && v > 10)?1:0;
 
-        metricImageBufferPointer[it] = m;
-
-        // if (ctImageBufferPtr[it] > calcificationThreshold)
-        //   {
-        //     metricImageBufferPointer[it] = 80;
-        //   }
+        vesselnessImageBufferPointer[it] = m;
       }
 
-    return metricImage;
+    return;
   }
 
 
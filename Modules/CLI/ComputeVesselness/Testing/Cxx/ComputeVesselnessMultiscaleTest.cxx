@@ -0,0 +1,261 @@
+// Run ComputeVesselness with a sigma list on a synthetic bright tube
+// whose radius grows along the x axis. The metric on the axis of the
+// tube must be well below the background metric and must not increase
+// with the radius. With a ROI mask, the voxels outside of the mask
+// must have the maximal metric and the ones inside must not change.
+// Processed in tiles smaller than the image, the metric must match the
+// one computed in a single piece.
+//
+// Usage: ComputeVesselnessMultiscaleTest temporaryDirectory
+
+#include <algorithm>
+#include <cmath>
+#include <cstdlib>
+#include <iostream>
+#include <string>
+#include <vector>
+
+#include "itkImage.h"
+#include "itkImageFileReader.h"
+#include "itkImageFileWriter.h"
+
+#ifdef WIN32
+# define MODULE_IMPORT __declspec(dllimport)
+#else
+# define MODULE_IMPORT
+#endif
+
+extern "C" MODULE_IMPORT int ModuleEntryPoint(int, char* []);
+
+namespace
+{
+  const int ImageDimension = 3;
+
+  typedef float FloatPixelType;
+  typedef itk::Image<FloatPixelType, ImageDimension> ImageType;
+
+  typedef short LabelPixelType;
+  typedef itk::Image<LabelPixelType, ImageDimension> LabelImageType;
+
+  const long imageSizeX = 80;
+  const long imageSizeYZ = 40;
+  const double minimumRadius = 1.5;
+  const double maximumRadius = 6.0;
+  const double tubeIntensity = 300.0;
+
+  double tubeRadius(long x)
+  {
+    return minimumRadius + (maximumRadius - minimumRadius)*x/(imageSizeX - 1);
+  }
+
+  template <class TImage>
+  typename TImage::Pointer createImage()
+  {
+    typename TImage::SizeType size;
+    size[0] = imageSizeX;
+    size[1] = imageSizeYZ;
+    size[2] = imageSizeYZ;
+    typename TImage::RegionType region;
+    region.SetSize(size);
+
+    typename TImage::Pointer image = TImage::New();
+    image->SetRegions(region);
+    image->Allocate();
+    image->FillBuffer(0);
+    return image;
+  }
+
+  template <class TImage>
+  bool writeImage(typename TImage::Pointer image, const std::string& fileName)
+  {
+    typedef itk::ImageFileWriter<TImage> WriterType;
+    typename WriterType::Pointer writer = WriterType::New();
+    writer->SetFileName(fileName.c_str());
+    writer->SetInput(image);
+    try
+      {
+        writer->Update();
+      }
+    catch (itk::ExceptionObject& e)
+      {
+        std::cerr<<e<<"\n";
+        return false;
+      }
+    return true;
+  }
+
+  // Run the module with arguments and return the metric image, or a
+  // null pointer on failure
+  ImageType::Pointer computeMetricImage(std::vector<std::string> arguments)
+  {
+    arguments.insert(arguments.begin(), "ComputeVesselness");
+    std::vector<char*> argv;
+    for (std::size_t i = 0; i < arguments.size(); ++i)
+      {
+        argv.push_back(const_cast<char*>(arguments[i].c_str()));
+      }
+    if (ModuleEntryPoint(static_cast<int>(argv.size()), &argv[0]) != EXIT_SUCCESS)
+      {
+        return 0;
+      }
+
+    typedef itk::ImageFileReader<ImageType> ReaderType;
+    ReaderType::Pointer reader = ReaderType::New();
+    reader->SetFileName(arguments.back().c_str());
+    reader->Update();
+    return reader->GetOutput();
+  }
+
+  ImageType::IndexType makeIndex(long x, long y, long z)
+  {
+    ImageType::IndexType index;
+    index[0] = x;
+    index[1] = y;
+    index[2] = z;
+    return index;
+  }
+}
+
+int ComputeVesselnessMultiscaleTest(int argc, char* argv[])
+{
+  if (argc < 2)
+    {
+      std::cerr<<"Usage: "<<argv[0]<<" temporaryDirectory\n";
+      return EXIT_FAILURE;
+    }
+  std::string temporaryDirectory = argv[1];
+  std::string inputFileName = temporaryDirectory + "/ComputeVesselnessMultiscaleTestInput.nrrd";
+  std::string maskFileName = temporaryDirectory + "/ComputeVesselnessMultiscaleTestMask.nrrd";
+  std::string outputFileName = temporaryDirectory + "/ComputeVesselnessMultiscaleTestOutput.nrrd";
+  std::string maskedOutputFileName = temporaryDirectory + "/ComputeVesselnessMultiscaleTestMaskedOutput.nrrd";
+  std::string tiledOutputFileName = temporaryDirectory + "/ComputeVesselnessMultiscaleTestTiledOutput.nrrd";
+
+  //--------------------------------------------------------------------------------
+  // tube along x, centered in y and z, and a mask of the lower half in x
+  const long center = imageSizeYZ/2;
+  ImageType::Pointer tubeImage = createImage<ImageType>();
+  LabelImageType::Pointer maskImage = createImage<LabelImageType>();
+  for (long z = 0; z < imageSizeYZ; ++z)
+    {
+      for (long y = 0; y < imageSizeYZ; ++y)
+        {
+          for (long x = 0; x < imageSizeX; ++x)
+            {
+              double r = std::sqrt(static_cast<double>((y - center)*(y - center) + (z - center)*(z - center)));
+              if (r <= tubeRadius(x))
+                {
+                  tubeImage->SetPixel(makeIndex(x, y, z), tubeIntensity);
+                }
+              if (x < imageSizeX/2)
+                {
+                  maskImage->SetPixel(makeIndex(x, y, z), 1);
+                }
+            }
+        }
+    }
+
+  if (!writeImage<ImageType>(tubeImage, inputFileName) || !writeImage<LabelImageType>(maskImage, maskFileName))
+    {
+      return EXIT_FAILURE;
+    }
+
+  std::vector<std::string> arguments;
+  arguments.push_back("--sigmaList");
+  arguments.push_back("1,2,3,4");
+  arguments.push_back(inputFileName);
+  arguments.push_back(outputFileName);
+  ImageType::Pointer metricImage = computeMetricImage(arguments);
+
+  // tiles with seams along x, y and z
+  std::vector<std::string> tiledArguments = arguments;
+  tiledArguments.insert(tiledArguments.begin(), "16");
+  tiledArguments.insert(tiledArguments.begin(), "--tileSize");
+  tiledArguments.back() = tiledOutputFileName;
+  ImageType::Pointer tiledMetricImage = computeMetricImage(tiledArguments);
+
+  arguments.insert(arguments.begin(), maskFileName);
+  arguments.insert(arguments.begin(), "--roiMask");
+  arguments.back() = maskedOutputFileName;
+  ImageType::Pointer maskedMetricImage = computeMetricImage(arguments);
+
+  if (!metricImage || !maskedMetricImage || !tiledMetricImage)
+    {
+      std::cerr<<"ComputeVesselness failed\n";
+      return EXIT_FAILURE;
+    }
+
+  int status = EXIT_SUCCESS;
+
+  //--------------------------------------------------------------------------------
+  // metric on the axis, away from the ends of the tube
+  const long margin = 10;
+  float backgroundMetric = metricImage->GetPixel(makeIndex(imageSizeX/2, 2, 2));
+  float thinnestMetric = metricImage->GetPixel(makeIndex(margin, center, center));
+  for (long x = margin; x < imageSizeX - margin; ++x)
+    {
+      float axisMetric = metricImage->GetPixel(makeIndex(x, center, center));
+      std::cout<<"radius "<<tubeRadius(x)<<": metric "<<axisMetric<<"\n";
+      if (axisMetric > 0.5*backgroundMetric)
+        {
+          std::cerr<<"the metric "<<axisMetric<<" on the axis at radius "<<tubeRadius(x)
+                   <<" is not well below the background metric "<<backgroundMetric<<"\n";
+          status = EXIT_FAILURE;
+        }
+      if (axisMetric > thinnestMetric + 0.5)
+        {
+          std::cerr<<"the metric "<<axisMetric<<" on the axis at radius "<<tubeRadius(x)
+                   <<" is higher than at the thinnest radius "<<thinnestMetric<<"\n";
+          status = EXIT_FAILURE;
+        }
+    }
+
+  //--------------------------------------------------------------------------------
+  // masked output
+  const float highestMetric = 100.0;
+  for (long x = 0; x < imageSizeX; x += 5)
+    {
+      ImageType::IndexType axisIndex = makeIndex(x, center, center);
+      ImageType::IndexType backgroundIndex = makeIndex(x, 2, 2);
+      if (x < imageSizeX/2)
+        {
+          if (std::fabs(maskedMetricImage->GetPixel(axisIndex) - metricImage->GetPixel(axisIndex)) > 1e-2
+              || std::fabs(maskedMetricImage->GetPixel(backgroundIndex) - metricImage->GetPixel(backgroundIndex)) > 1e-2)
+            {
+              std::cerr<<"the metric inside of the mask changed at x = "<<x<<"\n";
+              status = EXIT_FAILURE;
+            }
+        }
+      else if (maskedMetricImage->GetPixel(axisIndex) < highestMetric
+               || maskedMetricImage->GetPixel(backgroundIndex) < highestMetric)
+        {
+          std::cerr<<"the metric outside of the mask is not maximal at x = "<<x<<"\n";
+          status = EXIT_FAILURE;
+        }
+    }
+
+  //--------------------------------------------------------------------------------
+  // tiled output, up to the Gaussian tail cut by the padding of the tiles
+  const float tileTolerance = 5e-2;
+  const FloatPixelType* metricBufferPointer = metricImage->GetBufferPointer();
+  const FloatPixelType* tiledMetricBufferPointer = tiledMetricImage->GetBufferPointer();
+  long np = metricImage->GetLargestPossibleRegion().GetNumberOfPixels();
+  long largestDifferenceIndex = 0;
+  float largestDifference = 0;
+  for (long it = 0; it < np; ++it)
+    {
+      float difference = std::fabs(tiledMetricBufferPointer[it] - metricBufferPointer[it]);
+      if (difference > largestDifference)
+        {
+          largestDifference = difference;
+          largestDifferenceIndex = it;
+        }
+    }
+  if (largestDifference > tileTolerance)
+    {
+      std::cerr<<"the tiled metric differs by "<<largestDifference<<" at "
+               <<metricImage->ComputeIndex(largestDifferenceIndex)<<"\n";
+      status = EXIT_FAILURE;
+    }
+
+  return status;
+}
@@ -318,10 +318,12 @@ void
 CSFLSRobustStatSegmentor3DLabelMap< TPixel >
 ::doSegmenation()
 {
-  double startingTime = clock();
+  double startingTime = omp_get_wtime();
 
   getThingsReady();
 
+  std::cout<<"robust statistics of the seeds computed in "<<omp_get_wtime() - startingTime<<" s\n"<<std::flush;
+
   /*============================================================
    * From the initial mask, generate: 1. SFLS, 2. mp_label and
    * 3. mp_phi.
@@ -337,13 +339,24 @@ CSFLSRobustStatSegmentor3DLabelMap< TPixel >
   typename TFloatImage::PixelType* m_probabilityImagePtr = m_probabilityImage->GetBufferPointer();
   long n = m_probabilityImage->GetLargestPossibleRegion().GetNumberOfPixels();
 
-  for (long idx = 0; idx < n; ++idx)
-    {
-      std::vector<double> featureHere(m_numberOfFeature);
-      computeFeatureAt(idx, featureHere);
+  double probabilityStartingTime = omp_get_wtime();
 
-      m_probabilityImagePtr[idx] = kernelEvaluationUsingPDF(featureHere);
-    }
+  // computeFeatureAt only writes the feature images at idx, so the
+  // voxels can be processed in parallel
+#pragma omp parallel
+  {
+    std::vector<double> featureHere(m_numberOfFeature);
+
+#pragma omp for schedule(dynamic, 4096)
+    for (long idx = 0; idx < n; ++idx)
+      {
+        computeFeatureAt(idx, featureHere);
+
+        m_probabilityImagePtr[idx] = kernelEvaluationUsingPDF(featureHere);
+      }
+  }
+
+  std::cout<<"probability image computed in "<<omp_get_wtime() - probabilityStartingTime<<" s\n"<<std::flush;
 
   this->m_done = true;
 
@@ -565,6 +578,7 @@ CSFLSRobustStatSegmentor3DLabelMap< TPixel >
   short ay = 0;
   short az = 0;
 
+  std::vector<long> sampleIndexList;
   for (long i = 0; i < n; ++i)
     {
       long idx = m_seeds[i];
@@ -584,18 +598,39 @@ CSFLSRobustStatSegmentor3DLabelMap< TPixel >
                     {
                       //TIndex idx = {{iix, iiy, iiz}};
 
-                      long idxx = this->sub2ind(iix, iiy, iiz);
-
-                      std::vector<double> featureHere(m_numberOfFeature);
-                      computeFeatureAt(idxx, featureHere);
-
-                      m_featureAtTheSeeds.push_back(featureHere);
+                      sampleIndexList.push_back(this->sub2ind(iix, iiy, iiz));
                     }
                 }
             }
         }
     }
 
+  /* The same voxel may be around several seeds, so the features are
+     computed in parallel only once per voxel, then gathered. */
+  std::vector<long> uniqueSampleIndexList(sampleIndexList);
+  std::sort(uniqueSampleIndexList.begin(), uniqueSampleIndexList.end());
+  uniqueSampleIndexList.erase(std::unique(uniqueSampleIndexList.begin(), uniqueSampleIndexList.end()), uniqueSampleIndexList.end());
+
+  long nSample = uniqueSampleIndexList.size();
+#pragma omp parallel
+  {
+    std::vector<double> featureHere(m_numberOfFeature);
+
+#pragma omp for schedule(dynamic, 64)
+    for (long i = 0; i < nSample; ++i)
+      {
+        computeFeatureAt(uniqueSampleIndexList[i], featureHere);
+      }
+  }
+
+  for (std::size_t i = 0; i < sampleIndexList.size(); ++i)
+    {
+      std::vector<double> featureHere(m_numberOfFeature);
+      computeFeatureAt(sampleIndexList[i], featureHere);
+
+      m_featureAtTheSeeds.push_back(featureHere);
+    }
+
 
   return;
 }
@@ -1,5 +1,6 @@
 #include <algorithm>
 #include <set>
+#include <sstream>
 
 #include "ShortCutFilter3D.h"
 
@@ -19,6 +20,7 @@
 #include "itkBinaryBallStructuringElement.h"
 
 #include "itkImageRegionIterator.h"
+#include "itkRealTimeClock.h"
 
 #include "itkLaplacianSegmentationLevelSetImageFilter.h"
 #include "itkSmoothingRecursiveGaussianImageFilter.h"
@@ -70,7 +72,13 @@ namespace
 
 
   // upsample images to 0.1mm isotropic
-  LabelImageType::Pointer superResolutionSegmentation(ImageType::Pointer ctImage, LabelImageType::Pointer lumenSegmentationLabelImageInNativeResolution);
+  // the level set iterations are reported as the [progressStart, progressEnd] range of the module progress
+  LabelImageType::Pointer superResolutionSegmentation(ImageType::Pointer ctImage, LabelImageType::Pointer lumenSegmentationLabelImageInNativeResolution, double progressStart, double progressEnd);
+
+  // Copy the label image of a region of the reference image (as
+  // extracted by gth818n::extractROI) into a label image of the size
+  // of the reference image, which is 0 outside of the region.
+  LabelImageType::Pointer pasteLabelImageInRegion(LabelImageType::Pointer regionLabelImage, ImageType::Pointer referenceImage, const ImageType::RegionType& region);
 
 
   // template< typename TImageType >
@@ -87,6 +95,74 @@ namespace
 
 namespace gth818n
 {
+  // Report the progress of the module, and what it is doing, to Slicer
+  void reportProgress(double fraction, const std::string& comment)
+  {
+    std::cout<<"<filter-comment>"<<comment<<"</filter-comment>\n";
+    std::cout<<"<filter-progress>"<<fraction<<"</filter-progress>\n"<<std::flush;
+  }
+
+  // Observer of the level set iterations that reports the time taken
+  // by each iteration, mapping the iterations to the
+  // [progressStart, progressEnd] range of the module progress.
+  template<typename TFilter>
+  class LevelSetIterationReporter : public itk::Command
+  {
+  public:
+    typedef LevelSetIterationReporter Self;
+    typedef itk::Command Superclass;
+    typedef itk::SmartPointer<Self> Pointer;
+    itkNewMacro(Self);
+
+    void SetProgressRange(double progressStart, double progressEnd)
+    {
+      m_progressStart = progressStart;
+      m_progressEnd = progressEnd;
+      m_lastTime = m_clock->GetTimeInSeconds();
+    }
+
+    virtual void Execute(itk::Object* caller, const itk::EventObject& event)
+    {
+      Execute(const_cast<const itk::Object*>(caller), event);
+    }
+
+    virtual void Execute(const itk::Object* caller, const itk::EventObject& event)
+    {
+      if (!itk::IterationEvent().CheckEvent(&event))
+        {
+          return;
+        }
+
+      const TFilter* filter = static_cast<const TFilter*>(caller);
+
+      double now = m_clock->GetTimeInSeconds();
+      double numberOfIterations = std::max(static_cast<double>(filter->GetNumberOfIterations()), 1.0);
+      double iteration = static_cast<double>(filter->GetElapsedIterations());
+
+      std::ostringstream comment;
+      comment<<"level set iteration "<<iteration<<" of "<<numberOfIterations<<": "<<now - m_lastTime<<" s, RMS change "<<filter->GetRMSChange();
+      reportProgress(m_progressStart + (m_progressEnd - m_progressStart)*std::min(iteration, numberOfIterations)/numberOfIterations, comment.str());
+
+      m_lastTime = now;
+    }
+
+  protected:
+    LevelSetIterationReporter()
+    {
+      m_clock = itk::RealTimeClock::New();
+      m_progressStart = 0;
+      m_progressEnd = 1;
+      m_lastTime = m_clock->GetTimeInSeconds();
+    }
+
+  private:
+    itk::RealTimeClock::Pointer m_clock;
+    double m_progressStart;
+    double m_progressEnd;
+    double m_lastTime;
+  };
+
+
   template<typename image_t>
   typename image_t::RegionType
   computeNonZeroRegion(typename image_t::Pointer img)
@@ -154,9 +230,9 @@ namespace gth818n
         startIdx[2] = minZ;
 
         imageSize_t size;
-        size[0] = maxX - minX;
-        size[1] = maxY - minY;
-        size[2] = maxZ - minZ;
+        size[0] = maxX - minX + 1;
+        size[1] = maxY - minY + 1;
+        size[2] = maxZ - minZ + 1;
 
         nonZeroRegion.SetSize( size );
         nonZeroRegion.SetIndex( startIdx );
@@ -353,7 +429,9 @@ namespace gth818n
   typename TLabelImageType::Pointer
   laplaceLevelsetSegmentationAtHighResolution(typename TImageType::Pointer img, \
                                               typename TLabelImageType::Pointer initialBinaryLabelImage, \
-                                              int numiter)
+                                              int numiter, \
+                                              double progressStart = 0.0, \
+                                              double progressEnd = 1.0)
   {
     typedef itk::LaplacianSegmentationLevelSetImageFilter< TLabelImageType, TImageType > LaplacianSegmentationLevelSetImageFilterType;
     typename LaplacianSegmentationLevelSetImageFilterType::Pointer laplacianSegmentation = LaplacianSegmentationLevelSetImageFilterType::New();
@@ -367,6 +445,11 @@ namespace gth818n
 
     laplacianSegmentation->SetFeatureImage( img );
 
+    typedef LevelSetIterationReporter<LaplacianSegmentationLevelSetImageFilterType> ReporterType;
+    typename ReporterType::Pointer reporter = ReporterType::New();
+    reporter->SetProgressRange(progressStart, progressEnd);
+    laplacianSegmentation->AddObserver(itk::IterationEvent(), reporter);
+
     laplacianSegmentation->Update();
 
 
@@ -410,11 +493,60 @@ int main( int argc, char * argv[] )
   readerL->Update();
   LabelImageType::Pointer caAxiaLabelImage = readerL->GetOutput();
 
+  // The axis may have several labels, e.g. the tree output of
+  // ComputeBranchAxis labels the axis 1 and the branches 2, 3... The
+  // dilation around the axis and the seeds use label 1, so all the
+  // labels are merged into it.
+  LabelImageType::PixelType* caAxiaLabelImageBufferPointer = caAxiaLabelImage->GetBufferPointer();
+  long numberOfAxisLabelPixels = static_cast<long>(caAxiaLabelImage->GetLargestPossibleRegion().GetNumberOfPixels());
+  for (long it = 0; it < numberOfAxisLabelPixels; ++it)
+    {
+      caAxiaLabelImageBufferPointer[it] = caAxiaLabelImageBufferPointer[it] > 0 ? 1 : 0;
+    }
+
+  std::cout<<"<filter-start>\n";
+  std::cout<<"<filter-name>SegmentLumenFromAxis</filter-name>\n";
+  std::cout<<"<filter-comment>Segmenting the lumen</filter-comment>\n";
+  std::cout<<"</filter-start>\n"<<std::flush;
+
+  itk::RealTimeClock::Pointer clock = itk::RealTimeClock::New();
+  double startTime = clock->GetTimeInSeconds();
+
+  //--------------------------------------------------------------------------------
+  // Crop the images to the bounding box of the axis dilated by the
+  // margin: the lumen is searched only around the axis, so
+  // everything, including the upsampling of the super-resolution,
+  // only needs that region.
+  ImageType::RegionType fullRegion = image->GetLargestPossibleRegion();
+  ImageType::Pointer fullImage = image;
+  ImageType::RegionType workRegion = fullRegion;
+  if (cropMargin > 0)
+    {
+      workRegion = gth818n::computeNonZeroRegion<LabelImageType>(caAxiaLabelImage);
+      ImageType::SizeType padding;
+      padding.Fill(cropMargin);
+      workRegion.PadByRadius(padding);
+      workRegion.Crop(fullRegion);
+
+      image = gth818n::extractROI<ImageType>(image, workRegion);
+      caAxiaLabelImage = gth818n::extractROI<LabelImageType>(caAxiaLabelImage, workRegion);
+
+      std::ostringstream comment;
+      comment<<"cropped to "<<workRegion.GetSize()<<" voxels around the axis";
+      gth818n::reportProgress(0.05, comment.str());
+    }
+
   std::cout<<"Segment vessle lumen from axis label image.\n"<<std::flush;
   //ImageType::Pointer imageWithOutCalcification = removeCalcifiedRegion(image);
   LabelImageType::Pointer vesselLabelImage = segmentVesselFromAxisLabelImage(image, caAxiaLabelImage);
   //LabelImageType::Pointer vesselLabelImage = segmentVesselFromAxisLabelImageOutputProb(image, caAxiaLabelImage);
 
+  {
+    std::ostringstream comment;
+    comment<<"lumen segmented in "<<clock->GetTimeInSeconds() - startTime<<" s";
+    gth818n::reportProgress(superResolution ? 0.3 : 0.8, comment.str());
+  }
+
   // remove pixel whose intenstiy is below this value
   LabelImageType::PixelType* vesselLabelImagePtr = vesselLabelImage->GetBufferPointer();
   const ImageType::PixelType* imagePtr = image->GetBufferPointer();
@@ -473,9 +605,19 @@ int main( int argc, char * argv[] )
   if (superResolution)
     {
       std::cout<<"I'm in ********************************************************************************\n"<<std::flush;
-      finalMask = superResolutionSegmentation(image, finalMask);
+      finalMask = superResolutionSegmentation(image, finalMask, 0.4, 0.95);
       std::cout<<"I'm done ********************************************************************************\n"<<std::flush;
     }
+  else if (workRegion != fullRegion)
+    {
+      finalMask = pasteLabelImageInRegion(finalMask, fullImage, workRegion);
+    }
+
+  {
+    std::ostringstream comment;
+    comment<<"done in "<<clock->GetTimeInSeconds() - startTime<<" s";
+    gth818n::reportProgress(1.0, comment.str());
+  }
 
   //--------------------------------------------------------------------------------
   // write output
@@ -487,6 +629,9 @@ int main( int argc, char * argv[] )
   writer->SetUseCompression(1);
   writer->Update();
 
+  std::cout<<"<filter-end>\n";
+  std::cout<<"<filter-name>SegmentLumenFromAxis</filter-name>\n";
+  std::cout<<"</filter-end>\n"<<std::flush;
 
   return EXIT_SUCCESS;
 }
@@ -753,7 +898,7 @@ namespace
     return labelImageWithOutCalcification;
   }
 
-  LabelImageType::Pointer superResolutionSegmentation(ImageType::Pointer ctImage, LabelImageType::Pointer lumenSegmentationLabelImageInNativeResolution)
+  LabelImageType::Pointer superResolutionSegmentation(ImageType::Pointer ctImage, LabelImageType::Pointer lumenSegmentationLabelImageInNativeResolution, double progressStart, double progressEnd)
   {
     //--------------------------------------------------------------------------------
     // Check inpute label image is 0/1
@@ -824,12 +969,27 @@ namespace
     //typename LabelImageType::Pointer initMaskHighResolution = binarilizeImage<RealImageType, LabelImageType>(highResolutioinSubProbabilityImageInRegion, 0.7); // not bad
     typename LabelImageType::Pointer initMaskHighResolution = gth818n::binarilizeImage<RealImageType, LabelImageType>(highResolutioinSubProbabilityImageInRegion, 0.3, 1); // 0.1 over seg, 0.5 under seg
     unsigned long numberOfLevelSetIterations = 10;
-    typename LabelImageType::Pointer finalMask = gth818n::laplaceLevelsetSegmentationAtHighResolution< ImageType, LabelImageType >(highResolutioinSubImageInRegion, initMaskHighResolution, numberOfLevelSetIterations);
+    typename LabelImageType::Pointer finalMask = gth818n::laplaceLevelsetSegmentationAtHighResolution< ImageType, LabelImageType >(highResolutioinSubImageInRegion, initMaskHighResolution, numberOfLevelSetIterations, progressStart, progressEnd);
 
     return finalMask;
   }
 
+  LabelImageType::Pointer pasteLabelImageInRegion(LabelImageType::Pointer regionLabelImage, ImageType::Pointer referenceImage, const ImageType::RegionType& region)
+  {
+    LabelImageType::Pointer labelImage = LabelImageType::New();
+    labelImage->SetRegions(referenceImage->GetLargestPossibleRegion());
+    labelImage->Allocate();
+    labelImage->CopyInformation(referenceImage);
+    labelImage->FillBuffer(0);
+
+    // the region label image starts at index 0
+    itk::ImageRegionConstIterator<LabelImageType> regionIt(regionLabelImage, regionLabelImage->GetLargestPossibleRegion());
+    itk::ImageRegionIterator<LabelImageType> labelIt(labelImage, region);
+    for (regionIt.GoToBegin(), labelIt.GoToBegin(); !labelIt.IsAtEnd(); ++regionIt, ++labelIt)
+      {
+        labelIt.Set(regionIt.Get());
+      }
 
-
-
+    return labelImage;
+  }
 }
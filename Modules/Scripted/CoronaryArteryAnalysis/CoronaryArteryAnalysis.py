@@ -4,6 +4,7 @@ import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
 import numpy as np
+from Endoscopy import EndoscopyComputePath, EndoscopyPathModel, EndoscopyCameraTrack
 
 #
 # CoronaryArteryAnalysis
@@ -18,7 +19,7 @@ class CoronaryArteryAnalysis(ScriptedLoadableModule):
     ScriptedLoadableModule.__init__(self, parent)
     self.parent.title = "CoronaryArteryAnalysis" # TODO make this more human readable by adding spaces
     self.parent.categories = ["CoronaryArtery"]
-    self.parent.dependencies = []
+    self.parent.dependencies = ["Endoscopy"]
     self.parent.contributors = ["Yi Gao"] # replace with "Firstname Lastname (Organization)"
     self.parent.helpText = """
     This is an extension for coronary artery analysis.
@@ -44,6 +45,11 @@ class CoronaryArteryAnalysisWidget(ScriptedLoadableModuleWidget):
     # self.vesselnessVolumeNode = None
     # self.axisLabelVolumeNode = None
     # self.mainAndBranchAxisLabelImageNode = None
+
+    # distance from the axis computed by the first branch extraction,
+    # reused while the vesselness and axis volumes are unchanged
+    self.branchDistanceMapNode = None
+    self.branchDistanceMapKey = None
   
 
     
@@ -61,6 +67,15 @@ class CoronaryArteryAnalysisWidget(ScriptedLoadableModuleWidget):
     self.timer = qt.QTimer()
     self.timer.setInterval(20)
     self.timer.connect('timeout()', self.flyToNext)
+    self.cameraTrack = None
+    self.transformMatrix = vtk.vtkMatrix4x4()
+    # Frame rate held during playback by skipping frames (0 = play every frame)
+    self.targetFrameRate = 0
+    self.playbackStartTime = None
+    self.playbackStartFrame = 0
+    self.playbackFrame = 0
+
+    self.stageCache = None
 
     #================================================================================
 
@@ -163,6 +178,18 @@ class CoronaryArteryAnalysisWidget(ScriptedLoadableModuleWidget):
     frameDelaySlider.value = 20
     flythroughFormLayout.addRow("Frame delay:", frameDelaySlider)
 
+    # Target frame rate slider
+    targetFrameRateSlider = ctk.ctkSliderWidget()
+    targetFrameRateSlider.toolTip = "Play the path at this many frames per second, skipping frames if rendering is slower."
+    targetFrameRateSlider.connect('valueChanged(double)', self.targetFrameRateSliderValueChanged)
+    targetFrameRateSlider.decimals = 0
+    targetFrameRateSlider.minimum = 0
+    targetFrameRateSlider.maximum = 200
+    targetFrameRateSlider.suffix = " fps"
+    targetFrameRateSlider.specialValueText = "Off"
+    targetFrameRateSlider.value = 0
+    flythroughFormLayout.addRow("Target frame rate:", targetFrameRateSlider)
+
     # View angle slider
     viewAngleSlider = ctk.ctkSliderWidget()
     viewAngleSlider.connect('valueChanged(double)', self.viewAngleSliderValueChanged)
@@ -309,6 +336,11 @@ class CoronaryArteryAnalysisWidget(ScriptedLoadableModuleWidget):
     self.superResolutionCheckBox.setToolTip("Perform super-resolution segmentation?")
     wholeProcessFormLayout.addRow("Perform super-resolution segmentation?", self.superResolutionCheckBox)
 
+    self.useStageCacheCheckBox = qt.QCheckBox()
+    self.useStageCacheCheckBox.checked = True
+    self.useStageCacheCheckBox.setToolTip("Reuse the results of the stages whose input and parameters did not change since a previous run.")
+    wholeProcessFormLayout.addRow("Reuse cached stage results?", self.useStageCacheCheckBox)
+
     #
     # Apply Button
     #
@@ -329,141 +361,21 @@ class CoronaryArteryAnalysisWidget(ScriptedLoadableModuleWidget):
 
 
   def onWholeProcessButton(self):
-    #--------------------------------------------------------------------------------
-    # Run the ComputeVesselness CLI to get the vesselness
-    parameters = {}
-    parameters['inputVolume'] = self.inputOriginalImageSelector.currentNode().GetID()
-    parameters['vesselIsBrighter'] = self.vesselBrighterCheckBox.checked
-    vesselNessImageNode = slicer.vtkMRMLScalarVolumeNode()
-    vesselNessImageNode.SetName("vesselNessImage")
-    slicer.mrmlScene.AddNode( vesselNessImageNode )
-    parameters['outputVesselnessVolume'] = vesselNessImageNode.GetID()
-    parameters['sigma'] = 1.0
-    parameters['alpha1'] = 2.0
-    parameters['alpha2'] = 2.0
-    parameters['calcificationThreshold'] = self.calcificationSlicerWidget.value
-    slicer.cli.run( slicer.modules.computevesselness, None, parameters, wait_for_completion=True )
-    # Run the ComputeVesselness CLI to get the vesselness
-    #================================================================================
-
-
-    #--------------------------------------------------------------------------------
-    # Compute axis tree
-    parameters = {}
-    parameters['inputVesselnessVolume'] = vesselNessImageNode.GetID()
-    parameters['fiducialsAlongCA'] = self.treeFiducialsNodeSelector.currentNode()
-
-    axisTreeLabelImageNode = slicer.vtkMRMLLabelMapVolumeNode()
-    axisTreeLabelImageNode.SetName("axisTreeLabelImage")
-    slicer.mrmlScene.AddNode( axisTreeLabelImageNode )
-    parameters['outputAxisMaskVolume'] = axisTreeLabelImageNode.GetID()
-
-    ################################################################################
-    # This CLI module "computetree" treat the 1st fiducial point as
-    #the root and trace every other fiducial points back to the root
-    #slicer.cli.run( slicer.modules.computetree, None, parameters, wait_for_completion=True )
-
-    ################################################################################
-    # This CLI module "ComputeAxisFromVesselness" treat the (i-1)-th
-    #fiducial point as the root and trace from the i-th point to the
-    #(i-1)-th one. Then from (i+1) to i, and on. So this module gives
-    #a SINGEL axis.
-    #slicer.cli.run( slicer.modules.ComputeAxisFromVesselness, None, parameters, wait_for_completion=True )
-    slicer.cli.run( slicer.modules.computeaxisfromvesselness, None, parameters, wait_for_completion=True )
-    #================================================================================
-
-    #--------------------------------------------------------------------------------
-    # Run the SegmentLumenFromAxis CLI to get the vesselness
-    parameters = {}
-    parameters['inputVolume'] = self.inputOriginalImageSelector.currentNode().GetID()
-    parameters['inputAxisLabelVolume'] = axisTreeLabelImageNode.GetID()
-    parameters['lowerThreshold'] = self.thresholdSliderWidget.value
-    parameters['calcificationThreshold'] = self.calcificationSlicerWidget.value
-    parameters['outputLumenMaskVolume'] = self.outputLumenLabelImageSelector.currentNode()
-    parameters['superResolution'] = self.superResolutionCheckBox.checked
-
-    slicer.cli.run( slicer.modules.segmentlumenfromaxis, None, parameters, wait_for_completion=True )
-    # Run the SegmentLumenFromAxis CLI to get the vesselness
-    #================================================================================
-
-    d = vesselNessImageNode.GetDisplayNode()
-    d.SetVisibility(0) # do not show the vesselness image
-
-
-
-
-
-    
-    #--------------------------------------------------------------------------------
-    # Run the model maker to genreate surface
-    parameters = {}
-    parameters['InputVolume'] = self.outputLumenLabelImageSelector.currentNode().GetID()
-    lumenModelHierarchy = slicer.vtkMRMLModelHierarchyNode()
-    lumenModelHierarchy.SetName("theLumenModelHierarchy")
-    slicer.mrmlScene.AddNode( lumenModelHierarchy )
-    parameters['ModelSceneFile'] = lumenModelHierarchy.GetID()
-    slicer.cli.run( slicer.modules.modelmaker, None, parameters, wait_for_completion=True )
-    # Run the model maker to genreate surface
-    #================================================================================
-
-
-
-    #--------------------------------------------------------------------------------
-    # Backface To Frontface 
-    e = slicer.util.getNode('Model_1_jake')
-    f = e.GetDisplayNode()
-    f.SetBackfaceCulling(0)
-    f.SetFrontfaceCulling(1)
-    # Backface To Frontface 
-    #================================================================================
-
-
-
-    #--------------------------------------------------------------------------------
-    # To get the central coordinates of pancreatic duct and insert fiducials on them
-    inputvalues = slicer.util.getNode('axisTreeLabelImage')
-    # print 'ehhhhh.'
-    # print inputvalues
-    inputdata = slicer.util.arrayFromVolume(inputvalues)
-    coordinates = np.where(inputdata != 0)
-    I = coordinates[2][3::3]
-    # print 'I:'
-    # print I
-    J = coordinates[1][3::3]
-    # print 'J:'
-    # print J
-    K = coordinates[0][3::3]
-    # print 'K:'
-    # print K
-    RasCoordinates = []
-    N = 0
-    
-    # IJK TO RAS
-    ijkToRasMatrix = vtk.vtkMatrix4x4()
-    inputvalues.GetIJKToRASMatrix(ijkToRasMatrix)	
-    for N in range(len(I)):
-      c_Ijk = [I[N],J[N],K[N],1]
-      c_Ras = ijkToRasMatrix.MultiplyFloatPoint(c_Ijk)
-      RasCoordinates.append(c_Ras)
-    # print 'RasCoordinates:'
-    # print RasCoordinates
-
-    # Change the bottom fiducial point to the second point
-    fidNode = slicer.util.getNode('F')
-    ras = [0,0,0]
-    fidNode.GetNthFiducialPosition(1,ras)
-    # print(ras)
-    RasCoordinates.append(ras)
-    fidNode.SetNthFiducialPosition(1,RasCoordinates[0][0],RasCoordinates[0][1],RasCoordinates[0][2])
-    RasCoordinates.pop(0)
-    for c in RasCoordinates:
-      slicer.modules.markups.logic().AddFiducial(c[0],c[1],c[2])
-    # To get the central coordinates of pancreatic duct and insert fiducials on them
-    #================================================================================
-   
-
-
+    params = {}
+    params['vesselIsBrighter'] = self.vesselBrighterCheckBox.checked
+    params['calcificationThreshold'] = self.calcificationSlicerWidget.value
+    params['lowerThreshold'] = self.thresholdSliderWidget.value
+    params['superResolution'] = self.superResolutionCheckBox.checked
 
+    logic = CoronaryArteryAnalysisLogic()
+    if self.useStageCacheCheckBox.checked:
+      if not self.stageCache:
+        self.stageCache = CoronaryArteryAnalysisStageCache()
+      logic.setStageCache(self.stageCache)
+    logic.runPipeline(self.inputOriginalImageSelector.currentNode(),
+                      self.treeFiducialsNodeSelector.currentNode(),
+                      params,
+                      outputLumenVolume=self.outputLumenLabelImageSelector.currentNode())
 
     # TODO
     # parameters = {}
@@ -540,8 +452,25 @@ class CoronaryArteryAnalysisWidget(ScriptedLoadableModuleWidget):
     parameters['fiducialsOnBranches'] = branchFiducialsNode.GetID()
     parameters['inputAxisLabelVolume'] = inputAxisLabelNode.GetID()
     parameters['outputAxisAndBranchMaskVolume'] = mainAndBranchAxisLabelImageNode.GetID()
+    # the axis is labeled 1 and the branches 2, 3... SegmentLumenFromAxis
+    # treats all the labels above 0 as the axis
+    parameters['branchMode'] = 'Tree'
+
+    # only trace the new branches back if the distance from this axis is known
+    distanceMapKey = (vesselnessVolumeNode.GetID(), vesselnessVolumeNode.GetImageData().GetMTime(),
+                      inputAxisLabelNode.GetID(), inputAxisLabelNode.GetImageData().GetMTime())
+    if self.branchDistanceMapNode and self.branchDistanceMapKey == distanceMapKey \
+       and slicer.mrmlScene.GetNodeByID(self.branchDistanceMapNode.GetID()):
+      parameters['inputDistanceMapVolume'] = self.branchDistanceMapNode.GetID()
+    else:
+      if not (self.branchDistanceMapNode and slicer.mrmlScene.GetNodeByID(self.branchDistanceMapNode.GetID())):
+        self.branchDistanceMapNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'branchDistanceMap')
+        self.branchDistanceMapNode.HideFromEditorsOn()
+      parameters['outputDistanceMapVolume'] = self.branchDistanceMapNode.GetID()
 
-    slicer.cli.run( slicer.modules.computebranchaxis, None, parameters, wait_for_completion=True )
+    cliNode = slicer.cli.run( slicer.modules.computebranchaxis, None, parameters, wait_for_completion=True )
+    if cliNode.GetStatusString() == 'Completed' and 'outputDistanceMapVolume' in parameters:
+      self.branchDistanceMapKey = distanceMapKey
 
   def onPreProcessImageButton(self):
     originalVolumeNode = self.inputOriginalImageSelector.currentNode()
@@ -690,6 +619,7 @@ class CoronaryArteryAnalysisWidget(ScriptedLoadableModuleWidget):
     self.transform = model.transform
     self.pathPlaneNormal = model.planeNormal
     self.path = result.path
+    self.cameraTrack = EndoscopyCameraTrack(result.path, model.planeNormal)
 
     # Enable / Disable flythrough button
     self.flythroughCollapsibleButton.enabled = len(result.path) > 0
@@ -706,6 +636,10 @@ class CoronaryArteryAnalysisWidget(ScriptedLoadableModuleWidget):
     #print "frameDelaySliderValueChanged:", newValue
     self.timer.interval = newValue
 
+  def targetFrameRateSliderValueChanged(self, newValue):
+    self.targetFrameRate = newValue
+    self.playbackStartTime = None
+
   def viewAngleSliderValueChanged(self, newValue):
     if not self.cameraNode:
       return
@@ -714,6 +648,7 @@ class CoronaryArteryAnalysisWidget(ScriptedLoadableModuleWidget):
 
   def onPlayButtonToggled(self, checked):
     if checked:
+      self.playbackStartTime = None
       self.timer.start()
       self.playButton.text = "Stop"
     else:
@@ -722,46 +657,45 @@ class CoronaryArteryAnalysisWidget(ScriptedLoadableModuleWidget):
 
   def flyToNext(self):
     currentStep = self.frameSlider.value
-    nextStep = currentStep + self.skip + 1
-    if nextStep > len(self.path) - 2:
-      nextStep = 0
+    if self.targetFrameRate > 0:
+      # advance by the number of frames due since playback started (or the
+      # user moved the slider), so slow rendering skips frames instead of
+      # slowing down the flythrough
+      import time
+      now = time.time()
+      if self.playbackStartTime is None or currentStep != self.playbackFrame:
+        self.playbackStartTime = now
+        self.playbackStartFrame = currentStep
+      nextStep = self.playbackStartFrame + int((now - self.playbackStartTime) * self.targetFrameRate)
+      if nextStep > len(self.path) - 2:
+        nextStep = 0
+        self.playbackStartTime = now
+        self.playbackStartFrame = 0
+      self.playbackFrame = nextStep
+      if nextStep == currentStep:
+        return
+    else:
+      nextStep = currentStep + self.skip + 1
+      if nextStep > len(self.path) - 2:
+        nextStep = 0
     self.frameSlider.value = nextStep
 
   def flyTo(self, f):
     """ Apply the fth step in the path to the global camera"""
     if self.path:
       f = int(f)
-      p = self.path[f]
-      self.camera.SetPosition(*p)
-      foc = self.path[f+1]
-      self.camera.SetFocalPoint(*foc)
-
-      toParent = vtk.vtkMatrix4x4()
-      self.transform.GetMatrixTransformToParent(toParent)
-      toParent.SetElement(0 ,3, p[0])
-      toParent.SetElement(1, 3, p[1])
-      toParent.SetElement(2, 3, p[2])
-
-      # Set up transform orientation component so that
-      # Z axis is aligned with view direction and
-      # Y vector is aligned with the curve's plane normal.
-      # This can be used for example to show a reformatted slice
+      # The camera track holds the pose of each frame: Z axis is aligned with
+      # the view direction and Y axis is a rotation-minimizing normal of the path.
+      # The transform can be used for example to show a reformatted slice
       # using with SlicerIGT extension's VolumeResliceDriver module.
-      import numpy as np
-      zVec = (foc-p)/np.linalg.norm(foc-p)
-      yVec = self.pathPlaneNormal
-      xVec = np.cross(yVec, zVec)
-      toParent.SetElement(0, 0, xVec[0])
-      toParent.SetElement(1, 0, xVec[1])
-      toParent.SetElement(2, 0, xVec[2])
-      toParent.SetElement(0, 1, yVec[0])
-      toParent.SetElement(1, 1, yVec[1])
-      toParent.SetElement(2, 1, yVec[2])
-      toParent.SetElement(0, 2, zVec[0])
-      toParent.SetElement(1, 2, zVec[1])
-      toParent.SetElement(2, 2, zVec[2])
-
-      self.transform.SetMatrixTransformToParent(toParent)
+      pose = self.cameraTrack.poses[f]
+      if self.cameraNode:
+        with slicer.util.NodeModify(self.cameraNode):
+          self.camera.SetPosition(pose[0, 3], pose[1, 3], pose[2, 3])
+          self.camera.SetFocalPoint(*self.cameraTrack.focalPoints[f])
+          self.camera.SetViewUp(pose[0, 1], pose[1, 1], pose[2, 1])
+      self.transformMatrix.DeepCopy(pose.ravel())
+      self.transform.SetMatrixTransformToParent(self.transformMatrix)
   
 #
 # Copy Endoscopy
@@ -867,6 +801,504 @@ class CoronaryArteryAnalysisLogic(ScriptedLoadableModuleLogic):
 
     return True
 
+  #--------------------------------------------------------------------------------
+  # The whole process pipeline
+  #
+  # Each stage takes its input nodes and the pipeline parameters and returns the
+  # node(s) it produced, so that the pipeline can be run (and re-run stage by
+  # stage) without the module GUI, e.g. from
+  #   Slicer --no-main-window --python-script batch.py
+
+  # Default parameters of the whole process pipeline. Keys that are missing
+  # from the params dictionary given to runPipeline are taken from here.
+  pipelineDefaults = {
+    'vesselIsBrighter': False,
+    'sigma': 1.0,
+    'sigmaList': '', # comma separated sigmas of a multiscale vesselness, used instead of sigma if not empty
+    'alpha1': 2.0,
+    'alpha2': 2.0,
+    'calcificationThreshold': 800.0,
+    'tileSize': 0,
+    'lowerThreshold': 0.0,
+    'superResolution': False,
+    'cropMargin': 20, # voxels around the axis the lumen is segmented in, 0 for the whole volume
+    'centerlineFiducialStep': 3,
+    }
+
+  # Pipeline parameters each cached stage depends on
+  stageParameterNames = {
+    'vesselness': ['vesselIsBrighter', 'sigma', 'sigmaList', 'alpha1', 'alpha2', 'calcificationThreshold', 'tileSize'],
+    'axis': [],
+    'lumen': ['lowerThreshold', 'calcificationThreshold', 'superResolution', 'cropMargin'],
+    }
+
+  def __init__(self, parent = None):
+    ScriptedLoadableModuleLogic.__init__(self, parent)
+    # Optional CoronaryArteryAnalysisStageCache used by runPipeline
+    self.stageCache = None
+
+  def setStageCache(self, stageCache):
+    """Set the cache used to reuse stage results across pipeline runs.
+    Set to None to always recompute every stage.
+    """
+    self.stageCache = stageCache
+
+  def runCachedStage(self, stageName, inputKeys, params, outputVolume, computeStage):
+    """Run computeStage() unless the result of the same stage computed from the
+    same inputs and parameters is in the stage cache.
+    Returns the output volume (or None if the stage failed) and the cache key
+    of the result, which identifies it as an input of downstream stages.
+    """
+    if not self.stageCache:
+      return computeStage(), None
+    stageParams = dict((name, params[name]) for name in self.stageParameterNames[stageName])
+    key = self.stageCache.stageKey(stageName, inputKeys, stageParams)
+    if self.stageCache.load(key, outputVolume):
+      logging.info('%s: using cached result %s' % (stageName, key))
+      if not outputVolume.GetDisplayNode():
+        outputVolume.CreateDefaultDisplayNodes()
+      return outputVolume, key
+    outputVolume = computeStage()
+    if outputVolume:
+      self.stageCache.store(key, outputVolume)
+    return outputVolume, key
+
+  def createOutputNode(self, className, name):
+    node = slicer.mrmlScene.AddNewNodeByClass(className)
+    node.SetName(slicer.mrmlScene.GenerateUniqueName(name))
+    return node
+
+  def pipelineParameters(self, params=None):
+    """Return a copy of the default pipeline parameters updated with params"""
+    pipelineParams = dict(self.pipelineDefaults)
+    if params:
+      unknownKeys = set(params.keys()) - set(pipelineParams.keys())
+      if unknownKeys:
+        logging.warning('Ignoring unknown pipeline parameters: %s' % ', '.join(sorted(unknownKeys)))
+      pipelineParams.update(params)
+    return pipelineParams
+
+  def runCLI(self, module, parameters):
+    """Run a CLI module and return its node, or None if the execution did not
+    complete. The application keeps processing events while the CLI runs.
+    """
+    future = slicer.cli.runAsync(module, None, parameters)
+    if future is None:
+      logging.error('%s failed: not started' % module.name)
+      return None
+    try:
+      return future.result()
+    except slicer.cli.CLIError as e:
+      logging.error('%s failed: %s' % (module.name, e))
+      return None
+
+  def computeVesselness(self, inputVolume, params, vesselnessVolume=None, roiMaskVolume=None):
+    """Run the ComputeVesselness CLI on inputVolume.
+    If roiMaskVolume is given, the vesselness is only computed inside it.
+    Returns the vesselness volume node.
+    """
+    if not vesselnessVolume:
+      vesselnessVolume = slicer.vtkMRMLScalarVolumeNode()
+      vesselnessVolume.SetName(slicer.mrmlScene.GenerateUniqueName("vesselNessImage"))
+      slicer.mrmlScene.AddNode(vesselnessVolume)
+
+    parameters = {}
+    parameters['inputVolume'] = inputVolume.GetID()
+    parameters['vesselIsBrighter'] = bool(params['vesselIsBrighter'])
+    parameters['outputVesselnessVolume'] = vesselnessVolume.GetID()
+    parameters['sigma'] = float(params['sigma'])
+    parameters['alpha1'] = float(params['alpha1'])
+    parameters['alpha2'] = float(params['alpha2'])
+    parameters['calcificationThreshold'] = float(params['calcificationThreshold'])
+    if params['sigmaList']:
+      parameters['sigmaList'] = params['sigmaList']
+    parameters['tileSize'] = int(params['tileSize'])
+    if roiMaskVolume:
+      parameters['roiMaskVolume'] = roiMaskVolume.GetID()
+    if not self.runCLI(slicer.modules.computevesselness, parameters):
+      return None
+
+    displayNode = vesselnessVolume.GetDisplayNode()
+    if displayNode:
+      displayNode.SetVisibility(0) # do not show the vesselness image
+    return vesselnessVolume
+
+  def computeAxis(self, vesselnessVolume, seeds, params, axisLabelVolume=None):
+    """Run the ComputeAxisFromVesselness CLI.
+    The (i-1)-th seed is treated as the root and the i-th seed is traced back
+    to it, so this gives a SINGLE axis through all the seeds.
+    Returns the axis label map volume node.
+    """
+    if not axisLabelVolume:
+      axisLabelVolume = slicer.vtkMRMLLabelMapVolumeNode()
+      axisLabelVolume.SetName(slicer.mrmlScene.GenerateUniqueName("axisTreeLabelImage"))
+      slicer.mrmlScene.AddNode(axisLabelVolume)
+
+    parameters = {}
+    parameters['inputVesselnessVolume'] = vesselnessVolume.GetID()
+    parameters['fiducialsAlongCA'] = seeds
+    parameters['outputAxisMaskVolume'] = axisLabelVolume.GetID()
+    if not self.runCLI(slicer.modules.computeaxisfromvesselness, parameters):
+      return None
+    return axisLabelVolume
+
+  def segmentLumen(self, inputVolume, axisLabelVolume, params, lumenLabelVolume=None):
+    """Run the SegmentLumenFromAxis CLI.
+    Returns the lumen label map volume node.
+    """
+    if not lumenLabelVolume:
+      lumenLabelVolume = slicer.vtkMRMLLabelMapVolumeNode()
+      lumenLabelVolume.SetName(slicer.mrmlScene.GenerateUniqueName("lumenLabelVolume"))
+      slicer.mrmlScene.AddNode(lumenLabelVolume)
+
+    parameters = {}
+    parameters['inputVolume'] = inputVolume.GetID()
+    parameters['inputAxisLabelVolume'] = axisLabelVolume.GetID()
+    parameters['lowerThreshold'] = float(params['lowerThreshold'])
+    parameters['calcificationThreshold'] = float(params['calcificationThreshold'])
+    parameters['outputLumenMaskVolume'] = lumenLabelVolume.GetID()
+    parameters['superResolution'] = bool(params['superResolution'])
+    parameters['cropMargin'] = int(params['cropMargin'])
+    if not self.runCLI(slicer.modules.segmentlumenfromaxis, parameters):
+      return None
+    return lumenLabelVolume
+
+  def makeLumenModel(self, lumenLabelVolume):
+    """Run the ModelMaker CLI on the lumen label map.
+    The models are shown from the inside (front faces culled) so that the
+    camera can fly through the lumen.
+    Returns the model hierarchy node and the list of generated model nodes.
+    """
+    lumenModelHierarchy = slicer.vtkMRMLModelHierarchyNode()
+    lumenModelHierarchy.SetName(slicer.mrmlScene.GenerateUniqueName("theLumenModelHierarchy"))
+    slicer.mrmlScene.AddNode(lumenModelHierarchy)
+
+    parameters = {}
+    parameters['InputVolume'] = lumenLabelVolume.GetID()
+    parameters['ModelSceneFile'] = lumenModelHierarchy.GetID()
+    if not self.runCLI(slicer.modules.modelmaker, parameters):
+      return None, []
+
+    models = []
+    collection = vtk.vtkCollection()
+    lumenModelHierarchy.GetChildrenModelNodes(collection)
+    for index in xrange(collection.GetNumberOfItems()):
+      model = collection.GetItemAsObject(index)
+      displayNode = model.GetDisplayNode()
+      if displayNode:
+        # Backface To Frontface
+        displayNode.SetBackfaceCulling(0)
+        displayNode.SetFrontfaceCulling(1)
+      models.append(model)
+    return lumenModelHierarchy, models
+
+  def orderAlongAxis(self, kji, startIndex=0):
+    """Return the indices of the axis voxels kji (an (N,3) array of voxel
+    coordinates) sorted by their 26-connected geodesic distance from the
+    voxel startIndex, i.e. ordered along the axis instead of in raster order.
+    Voxels not connected to the start voxel are put at the end.
+    """
+    numberOfVoxels = len(kji)
+    # flat voxel index within the padded bounding box of the axis, so that
+    # neighbor offsets never wrap around
+    origin = kji.min(axis=0) - 1
+    boxSize = kji.max(axis=0) - origin + 2
+    strides = np.array([boxSize[1]*boxSize[2], boxSize[2], 1], dtype=np.int64)
+    flatIndices = (kji - origin).astype(np.int64).dot(strides)
+    sortOrder = np.argsort(flatIndices)
+    sortedFlatIndices = flatIndices[sortOrder]
+
+    offsets = np.array([[k, j, i] for k in (-1, 0, 1) for j in (-1, 0, 1) for i in (-1, 0, 1)
+      if (k, j, i) != (0, 0, 0)], dtype=np.int64).dot(strides)
+
+    distance = np.full(numberOfVoxels, -1, dtype=np.int64)
+    distance[startIndex] = 0
+    frontier = np.array([startIndex])
+    currentDistance = 0
+    while len(frontier):
+      currentDistance += 1
+      candidates = (flatIndices[frontier][:, np.newaxis] + offsets[np.newaxis, :]).ravel()
+      positions = np.searchsorted(sortedFlatIndices, candidates).clip(0, numberOfVoxels-1)
+      isAxisVoxel = sortedFlatIndices[positions] == candidates
+      neighbors = np.unique(sortOrder[positions[isAxisVoxel]])
+      frontier = neighbors[distance[neighbors] < 0]
+      distance[frontier] = currentDistance
+    distance[distance < 0] = currentDistance + 1
+    return np.argsort(distance, kind='mergesort')
+
+  def centerlinePoints(self, axisLabelVolume, startPoint=None):
+    """Return the RAS coordinates ((N,3) array) of the nonzero voxels of the
+    axis label map, ordered along the axis starting at the voxel closest to
+    startPoint (RAS).
+    """
+    kji = np.argwhere(slicer.util.arrayFromVolume(axisLabelVolume) != 0)
+    if len(kji) == 0:
+      return np.zeros((0, 3))
+
+    # IJK TO RAS
+    ijkToRasMatrix = vtk.vtkMatrix4x4()
+    axisLabelVolume.GetIJKToRASMatrix(ijkToRasMatrix)
+    ijkToRas = np.array([[ijkToRasMatrix.GetElement(row, column) for column in xrange(4)] for row in xrange(4)])
+    ijk1 = np.hstack((kji[:, ::-1], np.ones((len(kji), 1))))
+    ras = ijk1.dot(ijkToRas.T)[:, :3]
+
+    startIndex = 0
+    if startPoint is not None:
+      startIndex = np.argmin(((ras - np.asarray(startPoint)) ** 2).sum(axis=1))
+    return ras[self.orderAlongAxis(kji, startIndex)]
+
+  def addCenterlineFiducials(self, axisLabelVolume, seeds, params, centerlineFiducials):
+    """Write the seeds with fiducials on the central coordinates of the duct
+    inserted into centerlineFiducials. Every centerlineFiducialStep-th voxel
+    along the axis, starting from the first seed, is used. The second seed is
+    moved to the first centerline point and its original position is appended
+    after the centerline points. The seeds node itself is not changed, so
+    that a later run with the same seeds can reuse the cached axis.
+    All the points are added within a single modification of centerlineFiducials.
+    Returns the number of centerline points that were added.
+    """
+    with slicer.util.NodeModify(centerlineFiducials):
+      centerlineFiducials.RemoveAllMarkups()
+      for index in xrange(seeds.GetNumberOfFiducials()):
+        position = [0.0, 0.0, 0.0]
+        seeds.GetNthFiducialPosition(index, position)
+        centerlineFiducials.AddFiducial(position[0], position[1], position[2])
+    if seeds.GetNumberOfFiducials() < 2:
+      return 0
+    step = max(1, int(params['centerlineFiducialStep']))
+    firstSeed = [0.0, 0.0, 0.0]
+    seeds.GetNthFiducialPosition(0, firstSeed)
+    points = self.centerlinePoints(axisLabelVolume, firstSeed)[step::step]
+    if len(points) == 0:
+      return 0
+
+    # Change the bottom fiducial point to the second point
+    secondSeed = [0.0, 0.0, 0.0]
+    seeds.GetNthFiducialPosition(1, secondSeed)
+    with slicer.util.NodeModify(centerlineFiducials):
+      centerlineFiducials.SetNthFiducialPosition(1, points[0][0], points[0][1], points[0][2])
+      for point in points[1:]:
+        centerlineFiducials.AddFiducial(point[0], point[1], point[2])
+      centerlineFiducials.AddFiducial(secondSeed[0], secondSeed[1], secondSeed[2])
+    return len(points)
+
+  def runPipeline(self, inputVolume, seeds, params=None, outputLumenVolume=None, roiMaskVolume=None,
+                  outputCenterlineFiducials=None):
+    """Run the whole virtual pancreatoscopy pipeline without a GUI:
+    ComputeVesselness -> ComputeAxisFromVesselness -> SegmentLumenFromAxis ->
+    ModelMaker -> centerline fiducial insertion.
+
+    inputVolume: the CT scalar volume node
+    seeds: markups fiducial node with the points along the duct
+    params: dictionary overriding pipelineDefaults
+    outputLumenVolume: optional label map node for the lumen segmentation
+    roiMaskVolume: optional label map node of the organ, e.g. the pancreas, the
+      vesselness is computed in
+    outputCenterlineFiducials: optional markups fiducial node the seeds and the
+      centerline points are written to, the seeds node is left unchanged
+
+    Returns a dictionary with the nodes produced by each stage ('vesselness',
+    'axis', 'lumen', 'modelHierarchy', 'models', 'seeds', 'centerline'), or
+    None if the input is invalid or a stage fails.
+
+    Example:
+      logic = CoronaryArteryAnalysisLogic()
+      result = logic.runPipeline(ctNode, fiducialNode, {'lowerThreshold': 50})
+      slicer.util.saveNode(result['lumen'], '/tmp/lumen.nrrd')
+    """
+    if not self.hasImageData(inputVolume):
+      logging.error('runPipeline failed: no input volume')
+      return None
+    if not seeds or seeds.GetNumberOfFiducials() < 2:
+      logging.error('runPipeline failed: at least two seed fiducials are required')
+      return None
+
+    params = self.pipelineParameters(params)
+    logging.info('Processing started')
+
+    result = {'seeds': seeds}
+    inputKey = self.stageCache.volumeKey(inputVolume) if self.stageCache else None
+    vesselnessInputKeys = [inputKey]
+    if roiMaskVolume and self.stageCache:
+      vesselnessInputKeys.append(self.stageCache.volumeKey(roiMaskVolume))
+
+    vesselnessVolume = self.createOutputNode('vtkMRMLScalarVolumeNode', 'vesselNessImage')
+    result['vesselness'], vesselnessKey = self.runCachedStage('vesselness', vesselnessInputKeys, params, vesselnessVolume,
+      lambda: self.computeVesselness(inputVolume, params, vesselnessVolume, roiMaskVolume))
+    if not result['vesselness']:
+      return None
+    if vesselnessVolume.GetDisplayNode():
+      vesselnessVolume.GetDisplayNode().SetVisibility(0) # do not show the vesselness image
+
+    axisLabelVolume = self.createOutputNode('vtkMRMLLabelMapVolumeNode', 'axisTreeLabelImage')
+    seedsKey = self.stageCache.fiducialsKey(seeds) if self.stageCache else None
+    result['axis'], axisKey = self.runCachedStage('axis', [vesselnessKey, seedsKey], params, axisLabelVolume,
+      lambda: self.computeAxis(vesselnessVolume, seeds, params, axisLabelVolume))
+    if not result['axis']:
+      return None
+
+    if not outputLumenVolume:
+      outputLumenVolume = self.createOutputNode('vtkMRMLLabelMapVolumeNode', 'lumenLabelVolume')
+    result['lumen'], lumenKey = self.runCachedStage('lumen', [inputKey, axisKey], params, outputLumenVolume,
+      lambda: self.segmentLumen(inputVolume, axisLabelVolume, params, outputLumenVolume))
+    if not result['lumen']:
+      return None
+
+    result['modelHierarchy'], result['models'] = self.makeLumenModel(result['lumen'])
+    if not result['modelHierarchy']:
+      return None
+    if not outputCenterlineFiducials:
+      outputCenterlineFiducials = self.createOutputNode('vtkMRMLMarkupsFiducialNode', 'CenterlineFiducials')
+    self.addCenterlineFiducials(result['axis'], seeds, params, outputCenterlineFiducials)
+    result['centerline'] = outputCenterlineFiducials
+
+    logging.info('Processing completed')
+    return result
+
+
+class CoronaryArteryAnalysisStageCache:
+  """On-disk, content-addressed cache of pipeline stage results.
+
+  A stage result is stored under a key computed from the stage name, the keys
+  of its inputs (voxel hash and geometry of input volumes, positions of input
+  fiducials or the key of an upstream stage result) and the CLI parameters of
+  the stage. Changing a downstream parameter (e.g. lowerThreshold) therefore
+  only invalidates the downstream stages.
+
+  Results are stored as uncompressed numpy archives with the voxels and the
+  IJK to RAS matrix. When the total size exceeds maximumSize (in bytes) the
+  least recently used entries are removed.
+
+  Example:
+    logic = CoronaryArteryAnalysisLogic()
+    logic.setStageCache(CoronaryArteryAnalysisStageCache())
+    logic.runPipeline(ctNode, fiducialNode, {'lowerThreshold': 50})
+  """
+
+  fileExtension = '.npz'
+
+  def __init__(self, cacheDirectory=None, maximumSize=2*1024*1024*1024):
+    if not cacheDirectory:
+      cacheDirectory = os.path.join(slicer.app.temporaryPath, 'CoronaryArteryAnalysisCache')
+    if not os.path.exists(cacheDirectory):
+      os.makedirs(cacheDirectory)
+    self.cacheDirectory = cacheDirectory
+    self.maximumSize = maximumSize
+
+  def volumeKey(self, volumeNode):
+    """Hash of the voxels and geometry of a volume node"""
+    import hashlib
+    narray = slicer.util.arrayFromVolume(volumeNode)
+    ijkToRas = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRas)
+    md5 = hashlib.md5()
+    md5.update(str(narray.dtype) + str(narray.shape))
+    md5.update(str([ijkToRas.GetElement(row, column) for row in xrange(4) for column in xrange(4)]))
+    md5.update(np.ascontiguousarray(narray).tostring())
+    return md5.hexdigest()
+
+  def fiducialsKey(self, fiducialsNode):
+    """Hash of the fiducial positions of a markups fiducial node"""
+    import hashlib
+    positions = []
+    for index in xrange(fiducialsNode.GetNumberOfFiducials()):
+      position = [0.0, 0.0, 0.0]
+      fiducialsNode.GetNthFiducialPosition(index, position)
+      positions.append(position)
+    return hashlib.md5(repr(positions)).hexdigest()
+
+  def stageKey(self, stageName, inputKeys, stageParameters):
+    """Key of a stage result given the keys of its inputs and its parameters"""
+    import hashlib
+    parameters = sorted(stageParameters.items())
+    return hashlib.md5(repr((stageName, list(inputKeys), parameters))).hexdigest()
+
+  def filePath(self, key):
+    return os.path.join(self.cacheDirectory, key + self.fileExtension)
+
+  def load(self, key, volumeNode):
+    """Set the voxels and geometry of volumeNode from the cached result.
+    Returns False if the key is not in the cache.
+    """
+    filePath = self.filePath(key)
+    if not os.path.exists(filePath):
+      return False
+    try:
+      with open(filePath, 'rb') as cacheFile:
+        archive = np.load(cacheFile)
+        narray = archive['voxels']
+        ijkToRasArray = archive['ijkToRas']
+    except (IOError, KeyError, ValueError) as e:
+      logging.warning('Removing unreadable cache entry %s: %s' % (filePath, e))
+      self.remove(key)
+      return False
+    ijkToRas = vtk.vtkMatrix4x4()
+    for row in xrange(4):
+      for column in xrange(4):
+        ijkToRas.SetElement(row, column, ijkToRasArray[row, column])
+    volumeNode.SetIJKToRASMatrix(ijkToRas)
+    slicer.util.updateVolumeFromArray(volumeNode, narray)
+    # mark the entry as recently used
+    os.utime(filePath, None)
+    return True
+
+  def store(self, key, volumeNode):
+    """Store the voxels and geometry of volumeNode under key"""
+    narray = slicer.util.arrayFromVolume(volumeNode)
+    ijkToRas = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRas)
+    ijkToRasArray = np.array([[ijkToRas.GetElement(row, column) for column in xrange(4)] for row in xrange(4)])
+    filePath = self.filePath(key)
+    # write to a temporary file first so that an interrupted write does not
+    # leave a truncated entry behind
+    temporaryFilePath = filePath + '.tmp'
+    try:
+      with open(temporaryFilePath, 'wb') as cacheFile:
+        np.savez(cacheFile, voxels=narray, ijkToRas=ijkToRasArray)
+      if os.path.exists(filePath):
+        os.remove(filePath)
+      os.rename(temporaryFilePath, filePath)
+    except (IOError, OSError) as e:
+      logging.warning('Failed to write cache entry %s: %s' % (filePath, e))
+      if os.path.exists(temporaryFilePath):
+        os.remove(temporaryFilePath)
+      return
+    self.evict()
+
+  def remove(self, key):
+    filePath = self.filePath(key)
+    if os.path.exists(filePath):
+      os.remove(filePath)
+
+  def entries(self):
+    """Return (modification time, size, path) of all entries, least recently used first"""
+    entries = []
+    for fileName in os.listdir(self.cacheDirectory):
+      if not fileName.endswith(self.fileExtension):
+        continue
+      filePath = os.path.join(self.cacheDirectory, fileName)
+      fileStat = os.stat(filePath)
+      entries.append((fileStat.st_mtime, fileStat.st_size, filePath))
+    entries.sort()
+    return entries
+
+  def size(self):
+    return sum([entry[1] for entry in self.entries()])
+
+  def evict(self):
+    """Remove least recently used entries until the cache fits in maximumSize"""
+    entries = self.entries()
+    totalSize = sum([entry[1] for entry in entries])
+    for mtime, fileSize, filePath in entries:
+      if totalSize <= self.maximumSize:
+        break
+      os.remove(filePath)
+      totalSize -= fileSize
+
+  def clear(self):
+    for mtime, fileSize, filePath in self.entries():
+      os.remove(filePath)
+
 
 class CoronaryArteryAnalysisTest(ScriptedLoadableModuleTest):
   """
@@ -885,6 +1317,10 @@ class CoronaryArteryAnalysisTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_CoronaryArteryAnalysis1()
+    self.setUp()
+    self.test_StageCache()
+    self.setUp()
+    self.test_PipelineStageCache()
 
   def test_CoronaryArteryAnalysis1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -922,255 +1358,99 @@ class CoronaryArteryAnalysisTest(ScriptedLoadableModuleTest):
     self.assertIsNotNone( logic.hasImageData(volumeNode) )
     self.delayDisplay('Test passed!')
 
+  def test_StageCache(self):
+    """Store and reload a stage result and check LRU eviction"""
+    self.delayDisplay("Starting the stage cache test")
+    import tempfile, shutil
+    cacheDirectory = tempfile.mkdtemp(prefix="CoronaryArteryAnalysisCacheTest-", dir=slicer.app.temporaryPath)
+    try:
+      cache = CoronaryArteryAnalysisStageCache(cacheDirectory)
+
+      volumeNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLabelMapVolumeNode')
+      volumeNode.SetSpacing(0.5, 0.5, 2.0)
+      voxels = np.zeros((4, 5, 6), dtype=np.int16)
+      voxels[1:3, 2, 3] = 1
+      slicer.util.updateVolumeFromArray(volumeNode, voxels)
+
+      inputKey = cache.volumeKey(volumeNode)
+      key = cache.stageKey('lumen', [inputKey], {'lowerThreshold': 0.0})
+      self.assertNotEqual(key, cache.stageKey('lumen', [inputKey], {'lowerThreshold': 1.0}))
+      self.assertFalse(cache.load(key, volumeNode))
+      cache.store(key, volumeNode)
+
+      loadedNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLabelMapVolumeNode')
+      self.assertTrue(cache.load(key, loadedNode))
+      self.assertTrue((slicer.util.arrayFromVolume(loadedNode) == voxels).all())
+      self.assertEqual(loadedNode.GetSpacing(), volumeNode.GetSpacing())
+      self.assertEqual(cache.volumeKey(loadedNode), inputKey)
+
+      # a cache that can hold only one entry keeps the most recently stored one
+      cache.maximumSize = cache.size()
+      otherKey = cache.stageKey('lumen', [inputKey], {'lowerThreshold': 1.0})
+      cache.store(otherKey, volumeNode)
+      self.assertFalse(os.path.exists(cache.filePath(key)))
+      self.assertTrue(os.path.exists(cache.filePath(otherKey)))
+    finally:
+      shutil.rmtree(cacheDirectory)
+    self.delayDisplay('Test passed!')
 
+  def test_PipelineStageCache(self):
+    """Run the pipeline again with the same seeds: the stages whose inputs and
+    parameters did not change are read from the stage cache"""
+    self.delayDisplay("Starting the pipeline stage cache test")
+    import tempfile, shutil
+    cacheDirectory = tempfile.mkdtemp(prefix="CoronaryArteryAnalysisCacheTest-", dir=slicer.app.temporaryPath)
+    try:
+      # bright tube along the K axis
+      voxels = np.zeros((40, 24, 24), dtype=np.int16)
+      j, i = np.ogrid[0:24, 0:24]
+      voxels[:, (j - 12) ** 2 + (i - 12) ** 2 <= 9] = 300
+      inputVolume = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+      slicer.util.updateVolumeFromArray(inputVolume, voxels)
+      ijkToRas = vtk.vtkMatrix4x4()
+      inputVolume.GetIJKToRASMatrix(ijkToRas)
+      seeds = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode')
+      for seedK in (5, 34):
+        ras = ijkToRas.MultiplyPoint((12, 12, seedK, 1))
+        seeds.AddFiducial(ras[0], ras[1], ras[2])
+
+      logic = CoronaryArteryAnalysisLogic()
+      logic.setStageCache(CoronaryArteryAnalysisStageCache(cacheDirectory))
+      computedStages = []
+      def countStage(stageName, computeStage):
+        def computeAndCount(*args, **kwargs):
+          computedStages.append(stageName)
+          return computeStage(*args, **kwargs)
+        return computeAndCount
+      logic.computeVesselness = countStage('vesselness', logic.computeVesselness)
+      logic.computeAxis = countStage('axis', logic.computeAxis)
+      logic.segmentLumen = countStage('lumen', logic.segmentLumen)
+
+      params = {'vesselIsBrighter': True, 'lowerThreshold': 100.0}
+      result = logic.runPipeline(inputVolume, seeds, params)
+      self.assertIsNotNone(result)
+      self.assertEqual(computedStages, ['vesselness', 'axis', 'lumen'])
+      # the centerline points do not go into the seeds
+      self.assertEqual(seeds.GetNumberOfFiducials(), 2)
+      self.assertNotEqual(result['centerline'].GetID(), seeds.GetID())
+      self.assertGreaterEqual(result['centerline'].GetNumberOfFiducials(), 2)
+
+      # changing a lumen parameter only recomputes the lumen
+      del computedStages[:]
+      params['lowerThreshold'] = 150.0
+      self.assertIsNotNone(logic.runPipeline(inputVolume, seeds, params))
+      self.assertEqual(computedStages, ['lumen'])
+
+      # and running again with the same parameters recomputes nothing
+      del computedStages[:]
+      self.assertIsNotNone(logic.runPipeline(inputVolume, seeds, params))
+      self.assertEqual(computedStages, [])
+      self.assertEqual(seeds.GetNumberOfFiducials(), 2)
+    finally:
+      shutil.rmtree(cacheDirectory)
+    self.delayDisplay('Test passed!')
 
 
-  
-#--------------------------------------------------------------------------------
-#
-# Copy Endoscopy
-#
-class EndoscopyComputePath:
-  """Compute path given a list of fiducials.
-  A Hermite spline interpolation is used. See http://en.wikipedia.org/wiki/Cubic_Hermite_spline
-
-  Example:
-    result = EndoscopyComputePath(fiducialListNode)
-    print "computer path has %d elements" % len(result.path)
-
-  """
-
-  def __init__(self, fiducialListNode, dl = 0.5):
-    import numpy
-    self.dl = dl # desired world space step size (in mm)
-    self.dt = dl # current guess of parametric stepsize
-    self.fids = fiducialListNode
-
-    # hermite interpolation functions
-    self.h00 = lambda t: 2*t**3 - 3*t**2     + 1
-    self.h10 = lambda t:   t**3 - 2*t**2 + t
-    self.h01 = lambda t:-2*t**3 + 3*t**2
-    self.h11 = lambda t:   t**3 -   t**2
-
-    # n is the number of control points in the piecewise curve
-
-    if self.fids.GetClassName() == "vtkMRMLAnnotationHierarchyNode":
-      # slicer4 style hierarchy nodes
-      collection = vtk.vtkCollection()
-      self.fids.GetChildrenDisplayableNodes(collection)
-      self.n = collection.GetNumberOfItems()
-      if self.n == 0:
-        return
-      self.p = numpy.zeros((self.n,3))
-      for i in xrange(self.n):
-        f = collection.GetItemAsObject(i)
-        coords = [0,0,0]
-        f.GetFiducialCoordinates(coords)
-        self.p[i] = coords
-    elif self.fids.GetClassName() == "vtkMRMLMarkupsFiducialNode":
-      # slicer4 Markups node
-      self.n = self.fids.GetNumberOfFiducials()
-      n = self.n
-      if n == 0:
-        return
-      # get fiducial positions
-      # sets self.p
-      self.p = numpy.zeros((n,3))
-      for i in xrange(n):
-        coord = [0.0, 0.0, 0.0]
-        self.fids.GetNthFiducialPosition(i, coord)
-        self.p[i] = coord
-    else:
-      # slicer3 style fiducial lists
-      self.n = self.fids.GetNumberOfFiducials()
-      n = self.n
-      if n == 0:
-        return
-      # get control point data
-      # sets self.p
-      self.p = numpy.zeros((n,3))
-      for i in xrange(n):
-        self.p[i] = self.fids.GetNthFiducialXYZ(i)
-
-    # calculate the tangent vectors
-    # - fm is forward difference
-    # - m is average of in and out vectors
-    # - first tangent is out vector, last is in vector
-    # - sets self.m
-    n = self.n
-    fm = numpy.zeros((n,3))
-    for i in xrange(0,n-1):
-      fm[i] = self.p[i+1] - self.p[i]
-    self.m = numpy.zeros((n,3))
-    for i in xrange(1,n-1):
-      self.m[i] = (fm[i-1] + fm[i]) / 2.
-    self.m[0] = fm[0]
-    self.m[n-1] = fm[n-2]
-
-    self.path = [self.p[0]]
-    self.calculatePath()
-
-  def calculatePath(self):
-    """ Generate a flight path for of steps of length dl """
-    #
-    # calculate the actual path
-    # - take steps of self.dl in world space
-    # -- if dl steps into next segment, take a step of size "remainder" in the new segment
-    # - put resulting points into self.path
-    #
-    n = self.n
-    segment = 0 # which first point of current segment
-    t = 0 # parametric current parametric increment
-    remainder = 0 # how much of dl isn't included in current step
-    while segment < n-1:
-      t, p, remainder = self.step(segment, t, self.dl)
-      if remainder != 0 or t == 1.:
-        segment += 1
-        t = 0
-        if segment < n-1:
-          t, p, remainder = self.step(segment, t, remainder)
-      self.path.append(p)
-
-  def point(self,segment,t):
-    return (self.h00(t)*self.p[segment] +
-              self.h10(t)*self.m[segment] +
-              self.h01(t)*self.p[segment+1] +
-              self.h11(t)*self.m[segment+1])
-
-  def step(self,segment,t,dl):
-    """ Take a step of dl and return the path point and new t
-      return:
-      t = new parametric coordinate after step
-      p = point after step
-      remainder = if step results in parametic coordinate > 1.0, then
-        this is the amount of world space not covered by step
-    """
-    import numpy.linalg
-    p0 = self.path[self.path.__len__() - 1] # last element in path
-    remainder = 0
-    ratio = 100
-    count = 0
-    while abs(1. - ratio) > 0.05:
-      t1 = t + self.dt
-      pguess = self.point(segment,t1)
-      dist = numpy.linalg.norm(pguess - p0)
-      ratio = self.dl / dist
-      self.dt *= ratio
-      if self.dt < 0.00000001:
-        return
-      count += 1
-      if count > 500:
-        return (t1, pguess, 0)
-    if t1 > 1.:
-      t1 = 1.
-      p1 = self.point(segment, t1)
-      remainder = numpy.linalg.norm(p1 - pguess)
-      pguess = p1
-    return (t1, pguess, remainder)
-
-
-class EndoscopyPathModel:
-  """Create a vtkPolyData for a polyline:
-       - Add one point per path point.
-       - Add a single polyline
-  """
-  def __init__(self, path, fiducialListNode):
-
-    fids = fiducialListNode
-    scene = slicer.mrmlScene
-
-    points = vtk.vtkPoints()
-    polyData = vtk.vtkPolyData()
-    polyData.SetPoints(points)
-
-    lines = vtk.vtkCellArray()
-    polyData.SetLines(lines)
-    linesIDArray = lines.GetData()
-    linesIDArray.Reset()
-    linesIDArray.InsertNextTuple1(0)
-
-    polygons = vtk.vtkCellArray()
-    polyData.SetPolys( polygons )
-    idArray = polygons.GetData()
-    idArray.Reset()
-    idArray.InsertNextTuple1(0)
-
-    for point in path:
-      pointIndex = points.InsertNextPoint(*point)
-      linesIDArray.InsertNextTuple1(pointIndex)
-      linesIDArray.SetTuple1( 0, linesIDArray.GetNumberOfTuples() - 1 )
-      lines.SetNumberOfCells(1)
-
-    import vtk.util.numpy_support as VN
-    pointsArray = VN.vtk_to_numpy(points.GetData())
-    self.planePosition, self.planeNormal = self.planeFit(pointsArray.T)
-
-    # Create model node
-    model = slicer.vtkMRMLModelNode()
-    model.SetScene(scene)
-    model.SetName(scene.GenerateUniqueName("Path-%s" % fids.GetName()))
-    model.SetAndObservePolyData(polyData)
-
-    # Create display node
-    modelDisplay = slicer.vtkMRMLModelDisplayNode()
-    modelDisplay.SetColor(1,1,0) # yellow
-    modelDisplay.SetScene(scene)
-    scene.AddNode(modelDisplay)
-    model.SetAndObserveDisplayNodeID(modelDisplay.GetID())
-
-    # Add to scene
-    scene.AddNode(model)
-
-    # Camera cursor
-    sphere = vtk.vtkSphereSource()
-    sphere.Update()
-
-    # Create model node
-    cursor = slicer.vtkMRMLModelNode()
-    cursor.SetScene(scene)
-    cursor.SetName(scene.GenerateUniqueName("Cursor-%s" % fids.GetName()))
-    cursor.SetPolyDataConnection(sphere.GetOutputPort())
-
-    # Create display node
-    cursorModelDisplay = slicer.vtkMRMLModelDisplayNode()
-    cursorModelDisplay.SetColor(1,0,0) # red
-    cursorModelDisplay.SetScene(scene)
-    scene.AddNode(cursorModelDisplay)
-    cursor.SetAndObserveDisplayNodeID(cursorModelDisplay.GetID())
-
-    # Add to scene
-    scene.AddNode(cursor)
-
-    # Create transform node
-    transform = slicer.vtkMRMLLinearTransformNode()
-    transform.SetName(scene.GenerateUniqueName("Transform-%s" % fids.GetName()))
-    scene.AddNode(transform)
-    cursor.SetAndObserveTransformNodeID(transform.GetID())
-
-    self.transform = transform
-
-  # source: http://stackoverflow.com/questions/12299540/plane-fitting-to-4-or-more-xyz-points
-  def planeFit(self, points):
-    """
-    p, n = planeFit(points)
-
-    Given an array, points, of shape (d,...)
-    representing points in d-dimensional space,
-    fit an d-dimensional plane to the points.
-    Return a point, p, on the plane (the point-cloud centroid),
-    and the normal, n.
-    """
-    import numpy as np
-    from numpy.linalg import svd
-    points = np.reshape(points, (np.shape(points)[0], -1)) # Collapse trialing dimensions
-    assert points.shape[0] <= points.shape[1], "There are only {} points in {} dimensions.".format(points.shape[1], points.shape[0])
-    ctr = points.mean(axis=1)
-    x = points - ctr[:,np.newaxis]
-    M = np.dot(x, x.T) # Could also use np.cov(x) here.
-    return ctr, svd(M)[0][:,-1]
 
 
-#
-# Copy Endoscopy
-#
-#================================================================================
+  
@@ -410,12 +410,14 @@ class DICOMWidget:
     """
 
   def onListenerAddedFile(self):
-    """Called after the listener has added a file.
+    """Called after the listener has added a batch of files.
     Restore and refresh the app model
     """
-    newFile = slicer.dicomListener.lastFileAdded
-    if newFile:
-      slicer.util.showStatusMessage("Loaded: %s" % newFile, 1000)
+    newFiles = slicer.dicomListener.lastFilesAdded
+    if newFiles:
+      statistics = slicer.dicomListener.statistics()
+      slicer.util.showStatusMessage("Loaded %d files (%.1f files/s, %d waiting), last: %s"
+        % (len(newFiles), statistics['filesPerSecond'], statistics['queueDepth'], newFiles[-1]), 1000)
 
   def onToggleServer(self):
     if self.testingServer and self.testingServer.qrRunning():
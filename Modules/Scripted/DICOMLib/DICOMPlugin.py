@@ -1,3 +1,4 @@
+import os
 import slicer
 import logging
 
@@ -52,6 +53,276 @@ class DICOMLoadable(object):
     self.confidence = 0.5
 
 
+#
+# DICOMLoadableCache
+#
+
+class DICOMLoadableCache(object):
+  """Cache of the loadables found by examining lists of files.
+  Entries are kept in memory and written as JSON to the LoadableCache folder
+  next to the DICOM database, so they are available in later sessions.
+  Only the attributes of DICOMLoadable instances are written, and only
+  if they are strings, numbers, lists or dicts: the folder may be shared
+  with other users, so nothing that is read back can run code. Other
+  loadables are only cached in memory.
+  When the folder grows over maximumSize bytes, the least recently used
+  entries are removed.
+  """
+
+  # folder next to the database and file name extension of the persistent entries
+  directoryName = "LoadableCache"
+  fileExtension = ".json"
+
+  @classmethod
+  def sharedCache(cls):
+    """Return the cache instance used by all DICOM plugins"""
+    if cls.__dict__.get('_sharedCache') is None:
+      cls._sharedCache = cls()
+    return cls._sharedCache
+
+  def __init__(self, cacheDirectory=None, maximumSize=200*1024*1024, maximumNumberOfMemoryEntries=500):
+    import collections
+    import threading
+    # if not set, the cache directory follows the currently opened database
+    self.cacheDirectory = cacheDirectory
+    self.maximumSize = maximumSize
+    self.maximumNumberOfMemoryEntries = maximumNumberOfMemoryEntries
+    self.memoryEntries = collections.OrderedDict()
+    # plugins may use the cache from several threads
+    self.lock = threading.RLock()
+
+  def directory(self):
+    """Return the folder of the persistent cache, or None if there is no database to put it next to"""
+    if self.cacheDirectory:
+      return self.cacheDirectory
+    databaseFilename = getattr(slicer.dicomDatabase, 'databaseFilename', "")
+    if not databaseFilename or databaseFilename == ":memory:":
+      return None
+    return os.path.join(os.path.dirname(databaseFilename), self.directoryName)
+
+  def filePath(self, key):
+    directory = self.directory()
+    return os.path.join(directory, key + self.fileExtension) if directory else None
+
+  @staticmethod
+  def encodeValue(value):
+    """Convert an attribute made of strings, numbers, lists and dicts to JSON
+    values. Byte strings are decoded as Latin-1, so that any value read from
+    a DICOM file is restored unchanged by decodeValue.
+    """
+    if isinstance(value, str):
+      return value.decode('latin-1')
+    if isinstance(value, dict):
+      return dict([(DICOMLoadableCache.encodeValue(key), DICOMLoadableCache.encodeValue(item))
+        for key, item in value.iteritems()])
+    if isinstance(value, (list, tuple)):
+      return [DICOMLoadableCache.encodeValue(item) for item in value]
+    return value
+
+  @staticmethod
+  def decodeValue(value):
+    """Restore an attribute converted by encodeValue"""
+    if isinstance(value, unicode):
+      try:
+        return value.encode('latin-1')
+      except UnicodeEncodeError:
+        return value
+    if isinstance(value, dict):
+      return dict([(DICOMLoadableCache.decodeValue(key), DICOMLoadableCache.decodeValue(item))
+        for key, item in value.iteritems()])
+    if isinstance(value, list):
+      return [DICOMLoadableCache.decodeValue(item) for item in value]
+    return value
+
+  def serialize(self, loadables):
+    """Return loadables as JSON, or None if they cannot be written safely"""
+    import json
+    if not all([type(loadable) is DICOMLoadable for loadable in loadables]):
+      return None
+    try:
+      return json.dumps([self.encodeValue(vars(loadable)) for loadable in loadables])
+    except (TypeError, ValueError):
+      return None
+
+  def deserialize(self, data):
+    """Create the DICOMLoadable instances written by serialize"""
+    import json
+    loadables = []
+    for attributes in json.loads(data):
+      if not isinstance(attributes, dict):
+        raise ValueError("loadable attributes are not a dictionary")
+      loadable = DICOMLoadable()
+      for name, value in self.decodeValue(attributes).iteritems():
+        setattr(loadable, str(name), value)
+      loadables.append(loadable)
+    return loadables
+
+  def get(self, key):
+    """Return the cached loadables for key or None"""
+    with self.lock:
+      if key in self.memoryEntries:
+        loadables = self.memoryEntries.pop(key)
+        self.memoryEntries[key] = loadables
+        self.touch(key)
+        return loadables
+      path = self.filePath(key)
+      if not path or not os.path.exists(path):
+        return None
+      try:
+        with open(path, 'rb') as f:
+          loadables = self.deserialize(f.read())
+      except Exception as e:
+        logging.debug("Discarding unreadable loadable cache entry %s: %s" % (path, e))
+        self.remove(key)
+        return None
+      self.touch(key)
+      self.storeInMemory(key, loadables)
+      return loadables
+
+  def store(self, key, loadables):
+    """Add loadables to the cache"""
+    with self.lock:
+      self.storeInMemory(key, loadables)
+      path = self.filePath(key)
+      if not path:
+        return
+      data = self.serialize(loadables)
+      if data is None:
+        logging.debug("Loadables are only cached in memory, they cannot be written as JSON")
+        return
+      try:
+        if not os.path.isdir(os.path.dirname(path)):
+          os.makedirs(os.path.dirname(path))
+        # write to a temporary file first so that readers never see partial entries
+        with open(path + ".tmp", 'wb') as f:
+          f.write(data)
+        if os.path.exists(path):
+          os.remove(path)
+        os.rename(path + ".tmp", path)
+      except (IOError, OSError) as e:
+        logging.warning("Failed to write loadable cache entry %s: %s" % (path, e))
+        return
+      self.evict()
+
+  def storeInMemory(self, key, loadables):
+    with self.lock:
+      self.memoryEntries.pop(key, None)
+      self.memoryEntries[key] = loadables
+      while len(self.memoryEntries) > self.maximumNumberOfMemoryEntries:
+        self.memoryEntries.popitem(last=False)
+
+  def touch(self, key):
+    """Mark an entry as recently used"""
+    path = self.filePath(key)
+    if path and os.path.exists(path):
+      try:
+        os.utime(path, None)
+      except OSError:
+        pass
+
+  def remove(self, key):
+    with self.lock:
+      self.memoryEntries.pop(key, None)
+      path = self.filePath(key)
+      if path and os.path.exists(path):
+        self.removeFile(path)
+
+  def removeFile(self, path):
+    """Remove the file of a persistent entry"""
+    os.remove(path)
+
+  def entries(self):
+    """Return (modification time, size, path) of the persistent entries, least recently used first"""
+    directory = self.directory()
+    if not directory or not os.path.isdir(directory):
+      return []
+    entries = []
+    for name in os.listdir(directory):
+      if not name.endswith(self.fileExtension):
+        continue
+      path = os.path.join(directory, name)
+      try:
+        fileStat = os.stat(path)
+      except OSError:
+        continue
+      entries.append((fileStat.st_mtime, fileStat.st_size, path))
+    entries.sort()
+    return entries
+
+  def evict(self):
+    """Remove least recently used entries until the persistent cache fits in maximumSize"""
+    entries = self.entries()
+    totalSize = sum([size for mtime, size, path in entries])
+    for mtime, size, path in entries:
+      if totalSize <= self.maximumSize:
+        break
+      try:
+        self.removeFile(path)
+      except OSError:
+        continue
+      totalSize -= size
+
+  def clear(self):
+    """Remove all entries from memory and disk"""
+    with self.lock:
+      self.memoryEntries.clear()
+      for mtime, size, path in self.entries():
+        self.removeFile(path)
+
+#
+# DICOMTagSnapshot
+#
+
+class DICOMTagSnapshot(object):
+  """Read only copy of the tag values of some files and of the
+  file lists of some series, with the same fileValue and filesForSeries
+  methods as slicer.dicomDatabase.
+  The database can only be used from the thread that opened it, so
+  plugins that examine files on worker threads read from a snapshot
+  taken on the main thread instead.
+  """
+
+  def __init__(self):
+    self.values = {}
+    self.seriesFiles = {}
+
+  def addFiles(self, database, files, tags):
+    """Copy the values of tags for files from database"""
+    for file in files:
+      fileValues = self.values.setdefault(file, {})
+      for tag in tags:
+        if not fileValues.has_key(tag.upper()):
+          fileValues[tag.upper()] = database.fileValue(file, tag)
+
+  def addSeries(self, database, seriesUID):
+    """Copy the list of files of a series from database"""
+    if not self.seriesFiles.has_key(seriesUID):
+      self.seriesFiles[seriesUID] = list(database.filesForSeries(seriesUID))
+    return self.seriesFiles[seriesUID]
+
+  def update(self, snapshot):
+    """Add the entries of another snapshot. The values of a file are added
+    at once, so tasks reading the values of other files are not disturbed."""
+    for file, fileValues in snapshot.values.iteritems():
+      if self.values.has_key(file):
+        self.values[file].update(fileValues)
+      else:
+        self.values[file] = dict(fileValues)
+    for seriesUID, files in snapshot.seriesFiles.iteritems():
+      self.seriesFiles.setdefault(seriesUID, files)
+
+  def fileValue(self, file, tag):
+    try:
+      return self.values[file][tag.upper()]
+    except KeyError:
+      raise KeyError("Tag %s of %s is not in the snapshot" % (tag, file))
+
+  def filesForSeries(self, seriesUID):
+    try:
+      return self.seriesFiles[seriesUID]
+    except KeyError:
+      raise KeyError("Series %s is not in the snapshot" % seriesUID)
+
 #
 # DICOMPlugin
 #
@@ -63,10 +334,19 @@ class DICOMPlugin(object):
   def __init__(self):
     # displayed for the user as the plugin handling the load
     self.loadType = "Generic DICOM"
-    # a dictionary that maps a list of files to a list of loadables
-    # (so that subsequent requests for the same info can be
-    #  serviced quickly)
-    self.loadableCache = {}
+    # maps a list of files to a list of loadables (so that subsequent
+    # requests for the same info can be serviced quickly). The cache is
+    # shared by all plugins and persists across sessions.
+    self.loadableCache = DICOMLoadableCache.sharedCache()
+    # part of the loadable cache key, see codeVersion
+    self.loadableCacheVersion = 1
+    # set to True if examineFiles only reads the tags returned by prefetchTags,
+    # through database(), and keeps no state between calls, so that each file
+    # list can be examined separately on a worker thread (the results are
+    # combined by mergeLoadables)
+    self.canExamineConcurrently = False
+    # snapshot used instead of slicer.dicomDatabase while examining on worker threads
+    self.prefetchedDatabase = None
     # tags is a dictionary of symbolic name keys mapping to
     # hex tag number values (as in {'pixelData': '7fe0,0010'}).
     # Each subclass should define the tags it will be using in
@@ -76,6 +356,48 @@ class DICOMPlugin(object):
     self.tags['seriesDescription'] = "0008,103E"
     self.tags['seriesNumber'] = "0020,0011"
 
+  def database(self):
+    """Return the prefetched tag snapshot while examining concurrently,
+    slicer.dicomDatabase otherwise"""
+    if self.prefetchedDatabase is not None:
+      return self.prefetchedDatabase
+    return slicer.dicomDatabase
+
+  def prefetchTags(self,files):
+    """Read all the tags declared in self.tags for files from the database
+    and return them as a DICOMTagSnapshot. Called on the main thread before
+    files are examined concurrently. Subclasses that read anything else in
+    examineFiles should override this and add it to the snapshot.
+    """
+    snapshot = DICOMTagSnapshot()
+    snapshot.addFiles(slicer.dicomDatabase, files, self.tags.values())
+    return snapshot
+
+  def fileValues(self,files,tagNames=None):
+    """Fetch the values of several tags declared in self.tags for a list of files.
+    Returns a dictionary that maps each file to a dictionary of {tagName: value}.
+    All the declared tags are fetched if tagNames is not specified.
+    Each distinct tag is read from the database only once per file, even if
+    it is declared under several names.
+    Note: this is not a bulk query. ctkDICOMDatabase only exposes a per file,
+    per tag lookup, so this still makes one fileValue call for each file and
+    each distinct tag. It only removes the calls for duplicate tag names and
+    gives the callers a single place to switch to a batch lookup.
+    """
+    if tagNames is None:
+      tagNames = self.tags.keys()
+    tagsByName = [(name, self.tags[name]) for name in tagNames]
+    # tags are queried with their declared spelling, which is the one used to precache them
+    uniqueTags = {}
+    for name, tag in tagsByName:
+      uniqueTags.setdefault(tag.upper(), tag)
+    fileValue = self.database().fileValue
+    values = {}
+    for file in files:
+      tagValues = dict([(key, fileValue(file, tag)) for key, tag in uniqueTags.iteritems()])
+      values[file] = dict([(name, tagValues[tag.upper()]) for name, tag in tagsByName])
+    return values
+
   def hashFiles(self,files):
     """Create a hash key for a list of files"""
     try:
@@ -88,19 +410,51 @@ class DICOMPlugin(object):
       m.update(f.encode('UTF-8', 'ignore'))
     return(m.digest())
 
+  def codeVersion(self):
+    """Return a string that changes when the code of the plugin changes:
+    the modification time of the module of each plugin class, and
+    loadableCacheVersion, which subclasses can increment to invalidate
+    the loadables they cached"""
+    import sys
+    versions = [str(self.loadableCacheVersion)]
+    for cls in self.__class__.__mro__:
+      module = sys.modules.get(cls.__module__)
+      moduleFile = getattr(module, '__file__', None)
+      if not moduleFile:
+        continue
+      try:
+        versions.append("%s:%r" % (cls.__name__, os.stat(moduleFile).st_mtime))
+      except OSError:
+        versions.append(cls.__name__)
+    return "|".join(versions)
+
+  def loadableCacheKey(self,files):
+    """Create a key for the loadable cache from the plugin type and code
+    version and the path, modification time and size of each file, so that
+    cached loadables are not used after the files or the plugin changed"""
+    import hashlib
+    m = hashlib.md5()
+    m.update(self.__class__.__name__)
+    m.update(self.codeVersion())
+    for f in files:
+      # Unicode-objects must be encoded before hashing
+      m.update(f.encode('UTF-8', 'ignore'))
+      try:
+        fileStat = os.stat(f)
+        m.update("|%r|%d" % (fileStat.st_mtime, fileStat.st_size))
+      except OSError:
+        m.update("|missing")
+    return m.hexdigest()
+
   def getCachedLoadables(self,files):
     """ Helper method to access the results of a previous
     examination of a list of files"""
-    key = self.hashFiles(files)
-    if self.loadableCache.has_key(key):
-      return self.loadableCache[key]
-    return None
+    return self.loadableCache.get(self.loadableCacheKey(files))
 
   def cacheLoadables(self,files,loadables):
     """ Helper method to store the results of examining a list
     of files for later quick access"""
-    key = self.hashFiles(files)
-    self.loadableCache[key] = loadables
+    self.loadableCache.store(self.loadableCacheKey(files), loadables)
 
   def examineForImport(self,fileList):
     """Look at the list of lists of filenames and return
@@ -109,6 +463,16 @@ class DICOMPlugin(object):
     """
     return []
 
+  def mergeLoadables(self,loadablesByFileList):
+    """Combine the results of examining file lists separately into
+    the list that examineForImport would return for all of them.
+    Subclasses that sort their loadables should override this.
+    """
+    loadables = []
+    for loadablesForFileList in loadablesByFileList:
+      loadables += loadablesForFileList
+    return loadables
+
   def examine(self,fileList):
     """Backwards compatibility function for examineForImport
     (renamed on introducing examineForExport to avoid confusion)
@@ -140,11 +504,12 @@ class DICOMPlugin(object):
   def defaultSeriesNodeName(self,seriesUID):
     """Generate a name suitable for use as a mrml node name based
     on the series level data in the database"""
-    instanceFilePaths = slicer.dicomDatabase.filesForSeries(seriesUID)
+    database = self.database()
+    instanceFilePaths = database.filesForSeries(seriesUID)
     if len(instanceFilePaths) == 0:
       return "Unnamed Series"
-    seriesDescription = slicer.dicomDatabase.fileValue(instanceFilePaths[0],self.tags['seriesDescription'])
-    seriesNumber = slicer.dicomDatabase.fileValue(instanceFilePaths[0],self.tags['seriesNumber'])
+    seriesDescription = database.fileValue(instanceFilePaths[0],self.tags['seriesDescription'])
+    seriesNumber = database.fileValue(instanceFilePaths[0],self.tags['seriesNumber'])
     name = seriesDescription
     if seriesDescription == "":
       name = "Unnamed Series"
@@ -1,4 +1,6 @@
 import os, subprocess
+import logging
+import time
 import slicer
 import qt
 import ctk
@@ -234,6 +236,24 @@ class DICOMListener(DICOMStoreSCPProcess):
     self.fileToBeAddedCallback = fileToBeAddedCallback
     self.fileAddedCallback = fileAddedCallback
     self.lastFileAdded = None
+    self.lastFilesAdded = []
+
+    # received files are queued and added to the database in batches,
+    # when the queue has maximumBatchSize files or maximumBatchDelay milliseconds
+    # after the first file was queued, whichever comes first
+    self.maximumBatchSize = 200
+    self.maximumBatchDelay = 1000
+    self.pendingFiles = []
+    self.batchTimer = qt.QTimer()
+    self.batchTimer.singleShot = True
+    self.batchTimer.connect('timeout()', self.addPendingFiles)
+
+    # ingestion statistics, see statistics()
+    self.receivedFileCount = 0
+    self.addedFileCount = 0
+    self.addedBatchCount = 0
+    self.indexingTime = 0.0
+    self.firstFileReceivedTime = None
 
     settings = qt.QSettings()
     databaseDirectory = settings.value('DatabaseDirectory')
@@ -247,6 +267,17 @@ class DICOMListener(DICOMStoreSCPProcess):
   def __del__(self):
     super(DICOMListener, self).__del__()
 
+  def stop(self):
+    # do not lose files that were received but not added yet
+    if hasattr(self, 'pendingFiles'):
+      self.addPendingFiles()
+    super(DICOMListener, self).stop()
+
+  def onStateChanged(self, newState):
+    if newState == 0:
+      self.addPendingFiles()
+    return super(DICOMListener, self).onStateChanged(newState)
+
   def readFromStandardOutput(self):
     super(DICOMListener,self).readFromStandardOutput(readLineCallback=self.processStdoutLine)
 
@@ -255,22 +286,56 @@ class DICOMListener(DICOMStoreSCPProcess):
     tagStart = line.find(searchTag)
     if tagStart != -1:
       dicomFilePath = line[tagStart + len(searchTag):].strip()
-      destinationDir = os.path.dirname(self.dicomDatabase.databaseFilename)
-      print()
-      print()
-      print()
-      print ("indexing: %s into %s " % (dicomFilePath, destinationDir) )
-      if self.fileToBeAddedCallback:
-        self.fileToBeAddedCallback()
-      self.indexer.addFile( self.dicomDatabase, dicomFilePath, destinationDir )
-      print ("done indexing")
-      self.lastFileAdded = dicomFilePath
-      if self.fileAddedCallback:
-        print ("calling callback...")
-        self.fileAddedCallback()
-        print ("callback done")
-      else:
-        print ("no callback")
+      self.queueFile(dicomFilePath)
+
+  def queueFile(self, dicomFilePath):
+    """Add a received file to the queue of files to add to the database"""
+    if self.firstFileReceivedTime is None:
+      self.firstFileReceivedTime = time.time()
+    self.receivedFileCount += 1
+    self.pendingFiles.append(dicomFilePath)
+    if len(self.pendingFiles) >= self.maximumBatchSize:
+      self.addPendingFiles()
+    elif not self.batchTimer.isActive():
+      self.batchTimer.start(self.maximumBatchDelay)
+
+  def addPendingFiles(self):
+    """Add all queued files to the database in one batch"""
+    self.batchTimer.stop()
+    if not self.pendingFiles:
+      return
+    files = self.pendingFiles
+    self.pendingFiles = []
+    destinationDir = os.path.dirname(self.dicomDatabase.databaseFilename)
+    logging.debug("indexing %d files into %s" % (len(files), destinationDir))
+    if self.fileToBeAddedCallback:
+      self.fileToBeAddedCallback()
+    startTime = time.time()
+    self.indexer.addListOfFiles(self.dicomDatabase, files, destinationDir)
+    self.indexingTime += time.time() - startTime
+    self.addedFileCount += len(files)
+    self.addedBatchCount += 1
+    self.lastFilesAdded = files
+    self.lastFileAdded = files[-1]
+    if self.fileAddedCallback:
+      self.fileAddedCallback()
+
+  def statistics(self):
+    """Return a dictionary of ingestion metrics:
+    queueDepth: number of received files waiting to be added
+    receivedFiles, addedFiles, addedBatches: counts since the listener was created
+    filesPerSecond: files added per second since the first file was received
+    indexingFilesPerSecond: files added per second of database indexing
+    """
+    elapsedTime = time.time() - self.firstFileReceivedTime if self.firstFileReceivedTime else 0
+    return {
+      'queueDepth': len(self.pendingFiles),
+      'receivedFiles': self.receivedFileCount,
+      'addedFiles': self.addedFileCount,
+      'addedBatches': self.addedBatchCount,
+      'filesPerSecond': self.addedFileCount / elapsedTime if elapsedTime > 0 else 0.,
+      'indexingFilesPerSecond': self.addedFileCount / self.indexingTime if self.indexingTime > 0 else 0.,
+      }
 
 
 class DICOMSender(DICOMProcess):
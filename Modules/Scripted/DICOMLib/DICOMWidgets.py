@@ -88,6 +88,8 @@ class DICOMDetailsBase(VTKObservationMixin, SizePositionSettingsMixin):
     self.tableDensity = settingsValue('DICOM/tableDensity', 'Compact')
     self.advancedView = settingsValue('DICOM/advancedView', 0, converter=int)
     self.horizontalTables = settingsValue('DICOM/horizontalTables', 0, converter=int)
+    # examine file lists on worker threads with the plugins that support it
+    self.examineConcurrently = settingsValue('DICOM/ExamineConcurrently', True, converter=toBool)
 
     self.pluginInstances = {}
     self.fileLists = []
@@ -686,13 +688,42 @@ class DICOMDetailsBase(VTKObservationMixin, SizePositionSettingsMixin):
       return
 
     plugins = self.pluginSelector.selectedPlugins()
+    for pluginClass in plugins:
+      if not self.pluginInstances.has_key(pluginClass):
+        self.pluginInstances[pluginClass] = slicer.modules.dicomPlugins[pluginClass]()
+
+    if self.examineConcurrently:
+      loadablesByPlugin = self.examinePluginsConcurrently(plugins, fileLists)
+    else:
+      loadablesByPlugin = self.examinePlugins(plugins, fileLists)
 
     loadEnabled = False
+    for loadables in loadablesByPlugin.values():
+      loadEnabled = loadEnabled or loadables != []
+
+    return loadablesByPlugin, loadEnabled
+
+  @staticmethod
+  def examineWithPlugin(plugin, fileLists):
+    """Return the loadables that plugin finds in fileLists"""
+    loadables = plugin.examineForImport(fileLists)
+    # If regular method is not overridden (so returns empty list), try old function
+    # Ensuring backwards compatibility: examineForImport used to be called examine
+    if not loadables:
+      loadables = plugin.examine(fileLists)
+    return loadables
+
+  def reportPluginFailure(self, pluginClass, exceptionText):
+    print exceptionText
+    slicer.util.warningDisplay("Warning: Plugin failed: %s\n\nSee python console for error message." % pluginClass,
+                               windowTitle="DICOM", parent=self)
+
+  def examinePlugins(self, plugins, fileLists):
+    """Examine fileLists with each plugin in turn"""
+    loadablesByPlugin = {}
     progress = slicer.util.createProgressDialog(parent=self, value=0, maximum=len(plugins))
 
     for step, pluginClass in enumerate(plugins):
-      if not self.pluginInstances.has_key(pluginClass):
-        self.pluginInstances[pluginClass] = slicer.modules.dicomPlugins[pluginClass]()
       plugin = self.pluginInstances[pluginClass]
       if progress.wasCanceled:
         break
@@ -701,22 +732,151 @@ class DICOMDetailsBase(VTKObservationMixin, SizePositionSettingsMixin):
       progress.setValue(step)
       slicer.app.processEvents()
       try:
-        loadablesByPlugin[plugin] = plugin.examineForImport(fileLists)
-        # If regular method is not overridden (so returns empty list), try old function
-        # Ensuring backwards compatibility: examineForImport used to be called examine
-        if not loadablesByPlugin[plugin]:
-          loadablesByPlugin[plugin] = plugin.examine(fileLists)
-        loadEnabled = loadEnabled or loadablesByPlugin[plugin] != []
-      except Exception, e:
+        loadablesByPlugin[plugin] = self.examineWithPlugin(plugin, fileLists)
+      except Exception:
         import traceback
-        traceback.print_exc()
-        slicer.util.warningDisplay("Warning: Plugin failed: %s\n\nSee python console for error message." % pluginClass,
-                                   windowTitle="DICOM", parent=self)
-        print "DICOM Plugin failed: %s" % str(e)
+        self.reportPluginFailure(pluginClass, traceback.format_exc())
 
     progress.close()
 
-    return loadablesByPlugin, loadEnabled
+    return loadablesByPlugin
+
+  def examinePluginsConcurrently(self, plugins, fileLists):
+    """Examine fileLists with all plugins at once.
+    Plugins that declare canExamineConcurrently examine each file list that
+    is not in the loadable cache as a separate task on a thread pool. The
+    DICOM database and the loadable cache are only used from the main
+    thread: the tags of each file list are added to the snapshot of the
+    plugin just before its task is queued, so the first tasks do not wait
+    for the tags of all the file lists. The other plugins run on the main
+    thread once all the tasks are queued, while the pool is busy.
+    The tasks are Python code sharing the interpreter lock, so they only
+    run in parallel with each other and with the main thread where the lock
+    is released (e.g. file I/O, large numpy operations): the total time is
+    still close to the sum of the time of all plugins. What changes is the
+    order of the work, and the application keeps processing events.
+    The results are merged in plugin and file list order, so they do not
+    depend on which task finished first.
+    """
+    import multiprocessing.pool
+    import time
+    import traceback
+
+    def examineTask(examine, *args):
+      try:
+        return examine(*args), None
+      except Exception:
+        return [], traceback.format_exc()
+
+    concurrentPlugins = []
+    mainThreadPlugins = []
+    for pluginClass in plugins:
+      plugin = self.pluginInstances[pluginClass]
+      if getattr(plugin, 'canExamineConcurrently', False):
+        concurrentPlugins.append((pluginClass, plugin))
+      else:
+        mainThreadPlugins.append((pluginClass, plugin))
+
+    # (pluginClass, plugin, results) with, for each file list, either the
+    # cached loadables, the result of the task examining it, or None until
+    # the task is queued
+    tasks = []
+    # (pluginClass, plugin, results, index) of the file lists to queue
+    pendingTasks = []
+    for pluginClass, plugin in concurrentPlugins:
+      results = [plugin.getCachedLoadables(files) for files in fileLists]
+      for index, loadables in enumerate(results):
+        if not loadables:
+          results[index] = None
+          pendingTasks.append((pluginClass, plugin, results, index))
+      plugin.prefetchedDatabase = DICOMLib.DICOMTagSnapshot()
+      tasks.append((pluginClass, plugin, results))
+
+    def isFinished(result):
+      return isinstance(result, list) or (result is not None and result.ready())
+
+    taskCount = len(concurrentPlugins) * len(fileLists) + len(mainThreadPlugins)
+    progress = slicer.util.createProgressDialog(parent=self, value=0, maximum=taskCount)
+
+    mainThreadResults = {}
+    canceled = False
+    # only created if a task is queued
+    pool = None
+    try:
+      while True:
+        finishedCount = len(mainThreadResults)
+        for pluginClass, plugin, results in tasks:
+          finishedCount += len([result for result in results if isFinished(result)])
+        progress.setValue(finishedCount)
+        slicer.app.processEvents()
+        if progress.wasCanceled:
+          canceled = True
+          break
+        if pendingTasks:
+          pluginClass, plugin, results, index = pendingTasks.pop(0)
+          progress.labelText = '\nReading tags for %s' % pluginClass
+          slicer.app.processEvents()
+          try:
+            plugin.prefetchedDatabase.update(plugin.prefetchTags(fileLists[index]))
+          except Exception:
+            self.reportPluginFailure(pluginClass, traceback.format_exc())
+            pendingTasks = [task for task in pendingTasks if task[0] != pluginClass]
+            tasks = [task for task in tasks if task[0] != pluginClass]
+            continue
+          if pool is None:
+            pool = multiprocessing.pool.ThreadPool(multiprocessing.cpu_count())
+          results[index] = pool.apply_async(examineTask, (plugin.examineFiles, fileLists[index]))
+        elif len(mainThreadResults) < len(mainThreadPlugins):
+          pluginClass, plugin = mainThreadPlugins[len(mainThreadResults)]
+          progress.labelText = '\nChecking %s' % pluginClass
+          slicer.app.processEvents()
+          mainThreadResults[pluginClass] = examineTask(self.examineWithPlugin, plugin, fileLists)
+        elif all([isFinished(result) for pluginClass, plugin, results in tasks for result in results]):
+          break
+        else:
+          progress.labelText = '\nChecking series'
+          time.sleep(0.05)
+    finally:
+      if pool is not None:
+        if canceled:
+          # drop the tasks that did not start, the running ones cannot be interrupted
+          pool.terminate()
+        else:
+          pool.close()
+        # wait for all tasks before the snapshots are released
+        pool.join()
+      for pluginClass, plugin in concurrentPlugins:
+        plugin.prefetchedDatabase = None
+      progress.close()
+
+    if canceled:
+      return {}
+
+    loadablesByPlugin = {}
+    for pluginClass in plugins:
+      plugin = self.pluginInstances[pluginClass]
+      if mainThreadResults.has_key(pluginClass):
+        loadables, exceptionText = mainThreadResults[pluginClass]
+        if exceptionText:
+          self.reportPluginFailure(pluginClass, exceptionText)
+          continue
+        loadablesByPlugin[plugin] = loadables
+    for pluginClass, plugin, results in tasks:
+      loadablesByFileList = []
+      for files, result in zip(fileLists, results):
+        if isinstance(result, list):
+          loadablesByFileList.append(result)
+          continue
+        loadables, exceptionText = result.get()
+        if exceptionText:
+          self.reportPluginFailure(pluginClass, exceptionText)
+          break
+        plugin.cacheLoadables(files, loadables)
+        loadablesByFileList.append(loadables)
+      else:
+        loadablesByPlugin[plugin] = plugin.mergeLoadables(loadablesByFileList)
+
+    return loadablesByPlugin
 
   def isFileListInCheckedLoadables(self, fileList):
     for plugin in self.loadablesByPlugin:
@@ -1,4 +1,9 @@
 import os
+import collections
+import json
+import shutil
+import sys
+import time
 import unittest
 from __main__ import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
@@ -187,6 +192,11 @@ class DICOMPatcherWidget(ScriptedLoadableModuleWidget):
 class DICOMPatcherRule(object):
   def __init__(self):
     self.logCallback = None
+  def __getstate__(self):
+    # the state is saved in the manifest to allow resuming patching, callbacks cannot be saved
+    state = self.__dict__.copy()
+    state.pop('logCallback', None)
+    return state
   def addLog(self, text):
     logging.info(text)
     if self.logCallback:
@@ -221,7 +231,7 @@ class ForceSamePatientNameIdInEachDirectory(DICOMPatcherRule):
       # Get patient name and ID and save it
       self.firstFileInDirectory = False
       if ds.PatientName == '':
-        ds.PatientName = "Unspecified Patient " + str(patientIndex)
+        ds.PatientName = "Unspecified Patient " + str(self.patientIndex)
       if ds.PatientID == '':
         ds.PatientID = dicom.UID.generate_uid(None)
       self.patientName = ds.PatientName
@@ -469,6 +479,136 @@ class NormalizeFileNames(DICOMPatcherRule):
     filePath = self.outputRootDir + "/" + folderName + "/" + self.getNextItemName(prefix, folderName)+".dcm"
     return filePath
 
+#
+# DICOMPatcherManifest
+#
+
+class DICOMPatcherManifest(object):
+  """Journal of a patching run, stored in the output directory so that an
+  interrupted run can be resumed.
+  Each line is a JSON object. The first line describes the run. Output files
+  are recorded before they are written. When all files of an input directory
+  are written, the directory is recorded with the state of the patching rules.
+  """
+
+  fileName = 'DICOMPatcherManifest.txt'
+
+  def __init__(self, inputDirPath, outputDirPath, patchingRules):
+    self.filePath = os.path.join(outputDirPath, self.fileName)
+    self.run = {
+      'inputDirPath': os.path.abspath(inputDirPath),
+      'rules': [rule.__class__.__name__ for rule in patchingRules]}
+    self.entries = []
+    self.file = None
+
+  def resume(self, patchingRules):
+    """Restore the state of the rules after the last completed directory of
+    an interrupted run and remove the files written after that directory.
+    Returns the set of input directories that are completed.
+    """
+    if not os.path.exists(self.filePath):
+      return set()
+    entries = []
+    with open(self.filePath) as manifestFile:
+      for line in manifestFile:
+        try:
+          entries.append(json.loads(line))
+        except ValueError:
+          # the last line may be incomplete if the run was interrupted while writing it
+          break
+    if not entries or entries[0] != self.run:
+      # previous run had a different input or rules, start from scratch
+      return set()
+
+    completedDirectories = set()
+    rulesState = None
+    completedEntryCount = 1
+    incompleteFiles = []
+    for entryIndex, entry in enumerate(entries[1:]):
+      if 'file' in entry:
+        incompleteFiles.append(entry['file'])
+      else:
+        completedDirectories.add(entry['directory'])
+        rulesState = entry['rulesState']
+        completedEntryCount = entryIndex + 2
+        incompleteFiles = []
+
+    for filePath in incompleteFiles:
+      if os.path.exists(filePath):
+        os.remove(filePath)
+    if rulesState is not None:
+      for rule, ruleState in zip(patchingRules, self.decodeState(rulesState)):
+        rule.__dict__.update(ruleState)
+
+    # only keep the entries up to the last completed directory
+    self.entries = entries[1:completedEntryCount]
+    return completedDirectories
+
+  @staticmethod
+  def rulesState(patchingRules):
+    """Return the state of the rules in a form that can be written to the manifest"""
+    return DICOMPatcherManifest.encodeState([rule.__getstate__() for rule in patchingRules])
+
+  @staticmethod
+  def encodeState(value):
+    """Convert a rule state made of strings, numbers, lists and dicts to JSON
+    values. Byte strings are decoded as Latin-1, so that any value read from
+    a DICOM file is restored unchanged by decodeState.
+    """
+    if isinstance(value, str):
+      return value.decode('latin-1')
+    if isinstance(value, dict):
+      return dict([(DICOMPatcherManifest.encodeState(key), DICOMPatcherManifest.encodeState(item))
+        for key, item in value.iteritems()])
+    if isinstance(value, (list, tuple)):
+      return [DICOMPatcherManifest.encodeState(item) for item in value]
+    return value
+
+  @staticmethod
+  def decodeState(value):
+    """Restore a rule state converted by encodeState"""
+    if isinstance(value, unicode):
+      try:
+        return value.encode('latin-1')
+      except UnicodeEncodeError:
+        return value
+    if isinstance(value, dict):
+      return dict([(DICOMPatcherManifest.decodeState(key), DICOMPatcherManifest.decodeState(item))
+        for key, item in value.iteritems()])
+    if isinstance(value, list):
+      return [DICOMPatcherManifest.decodeState(item) for item in value]
+    return value
+
+  def open(self):
+    if not os.path.exists(os.path.dirname(self.filePath)):
+      os.makedirs(os.path.dirname(self.filePath))
+    self.file = open(self.filePath, 'w')
+    for entry in [self.run] + self.entries:
+      self.file.write(json.dumps(entry) + '\n')
+    self.file.flush()
+
+  def addEntry(self, entry):
+    self.entries.append(entry)
+    self.file.write(json.dumps(entry) + '\n')
+    self.file.flush()
+
+  def recordFile(self, filePath):
+    self.addEntry({'file': filePath})
+
+  def recordCompletedDirectory(self, directory, rulesState):
+    self.addEntry({'directory': directory, 'rulesState': rulesState})
+
+  def close(self):
+    if self.file:
+      self.file.close()
+      self.file = None
+
+  def remove(self):
+    """Remove the manifest after the run is completed"""
+    self.close()
+    if os.path.exists(self.filePath):
+      os.remove(self.filePath)
+
 #
 # DICOMPatcherLogic
 #
@@ -487,6 +627,12 @@ class DICOMPatcherLogic(ScriptedLoadableModuleLogic):
     ScriptedLoadableModuleLogic.__init__(self)
     self.logCallback = None
     self.patchingRules = []
+    # messages are passed to logCallback in batches, at most this often (in seconds)
+    self.logFlushInterval = 0.5
+    self.logMessages = []
+    self.lastLogFlushTime = 0
+    # number of threads that copy pixel data into the patched files
+    self.numberOfCopyThreads = 4
 
   def clearRules(self):
     self.patchingRules = []
@@ -499,11 +645,74 @@ class DICOMPatcherLogic(ScriptedLoadableModuleLogic):
     self.patchingRules.append(ruleInstance)
 
   def addLog(self, text):
+    self.logMessages.append(text)
+    if time.time() - self.lastLogFlushTime >= self.logFlushInterval:
+      self.flushLog()
+
+  def flushLog(self):
+    """Pass all pending log messages to logCallback"""
+    if not self.logMessages:
+      return
+    text = '\n'.join(self.logMessages)
+    self.logMessages = []
+    self.lastLogFlushTime = time.time()
     logging.info(text)
     if self.logCallback:
       self.logCallback(text)
 
-  def patchDicomDir(self, inputDirPath, outputDirPath):
+  @staticmethod
+  def readDataSetHeader(filePath):
+    """Read a DICOM file up to its pixel data.
+    Returns the data set and the position of the pixel data element in the file.
+    The position is None if the whole file had to be read.
+    """
+    import dicom
+    with open(filePath, 'rb') as dicomFile:
+      ds = dicom.read_file(dicomFile, stop_before_pixels=True)
+      pixelDataPosition = dicomFile.tell()
+    DeflatedExplicitVRLittleEndian = '1.2.840.10008.1.2.1.99'
+    if getattr(ds.file_meta, 'TransferSyntaxUID', None) == DeflatedExplicitVRLittleEndian:
+      # the position refers to the inflated stream, not to the file
+      return dicom.read_file(filePath), None
+    return ds, pixelDataPosition
+
+  @staticmethod
+  def readRemainingDataElements(ds, filePath):
+    """Add pixel data and all other data elements that follow it from the file to ds"""
+    import dicom
+    fullDataSet = dicom.read_file(filePath)
+    for dataElement in fullDataSet:
+      if dataElement.tag >= dicom.tag.Tag(0x7fe0,0x0010) and dataElement.tag not in ds:
+        ds.add(dataElement)
+
+  @staticmethod
+  def copyFileTail(inputFilePath, position, outputFilePath):
+    """Append the content of the input file starting at position to the output file"""
+    with open(inputFilePath, 'rb') as inputFile:
+      inputFile.seek(position)
+      with open(outputFilePath, 'ab') as outputFile:
+        shutil.copyfileobj(inputFile, outputFile, 16*1024*1024)
+
+  def recordCompletedFiles(self, manifest, pendingEntries, maximumNumberOfPendingEntries=0):
+    """Process entries of files and directories in the order they were started
+    as their pixel data copies finish. Waits until there are no more than
+    maximumNumberOfPendingEntries entries.
+    """
+    while pendingEntries:
+      entry = pendingEntries[0]
+      if entry[0] == 'file':
+        copyResult = entry[2]
+        if copyResult:
+          if not copyResult.ready() and len(pendingEntries) <= maximumNumberOfPendingEntries:
+            break
+          # raises the error of the copy, if there was one
+          copyResult.get()
+        self.addLog('  Created DICOM file: %s' % entry[1])
+      else:
+        manifest.recordCompletedDirectory(entry[1], entry[2])
+      pendingEntries.popleft()
+
+  def patchDicomDir(self, inputDirPath, outputDirPath, resume=True):
     """
     Since CTK (rightly) requires certain basic information [1] before it can import
     data files that purport to be dicom, this code patches the files in a directory
@@ -516,10 +725,17 @@ class DICOMPatcherLogic(ScriptedLoadableModuleLogic):
     same study of the same patient.  Also that each instance (file) is an
     independent (multiframe) series.
 
+    Only the data elements before the pixel data are parsed and patched, the pixel data
+    is copied unchanged from the input files by numberOfCopyThreads threads.
+    Progress is recorded in a manifest in the output directory. If patching is interrupted,
+    calling this function again with the same input directory and rules continues after
+    the last completed input directory (unless resume is False).
+
     [1] https://github.com/commontk/CTK/blob/16aa09540dcb59c6eafde4d9a88dfee1f0948edc/Libs/DICOM/Core/ctkDICOMDatabase.cpp#L1283-L1287
     """
 
     import dicom
+    import multiprocessing.pool
 
     self.addLog('DICOM patching started...')
     logging.debug('DICOM patch input directory: '+inputDirPath)
@@ -529,55 +745,101 @@ class DICOMPatcherLogic(ScriptedLoadableModuleLogic):
       rule.logCallback = self.addLog
       rule.processStart(inputDirPath, outputDirPath)
 
-    for root, subFolders, files in os.walk(inputDirPath):
+    manifest = DICOMPatcherManifest(inputDirPath, outputDirPath, self.patchingRules)
+    completedDirectories = manifest.resume(self.patchingRules) if resume else set()
+    if completedDirectories:
+      self.addLog('Resuming interrupted patching, %d directories are already completed.' % len(completedDirectories))
+    manifest.open()
 
-      currentSubDir = os.path.relpath(root, inputDirPath)
-      rootOutput = os.path.join(outputDirPath, currentSubDir)
-
-      # Notify rules that processing of a new subdirectory started
-      for rule in self.patchingRules:
-        rule.processDirectory(currentSubDir)
+    copyPool = multiprocessing.pool.ThreadPool(self.numberOfCopyThreads)
+    # files with pixel data copy in progress and completed directories, in processing order
+    pendingEntries = collections.deque()
+    try:
+      for root, subFolders, files in os.walk(inputDirPath):
+        # process directories in a reproducible order, so that patching can be resumed
+        subFolders.sort()
 
-      for file in files:
-        filePath = os.path.join(root,file)
-        self.addLog('Examining %s...' % os.path.join(currentSubDir,file))
+        currentSubDir = os.path.relpath(root, inputDirPath)
+        rootOutput = os.path.join(outputDirPath, currentSubDir)
 
-        skipFileRequestingRule = None
-        for rule in self.patchingRules:
-          if rule.skipFile(currentSubDir):
-            skipFileRequestingRule = rule
-            break
-        if skipFileRequestingRule:
-          self.addLog('  Rule '+rule.__class__.__name__+' requested to skip this file.')
+        if currentSubDir in completedDirectories:
           continue
 
-        try:
-          ds = dicom.read_file(filePath)
-        except (IOError, dicom.filereader.InvalidDicomError):
-          self.addLog('  Not DICOM file. Skipped.')
-          continue
-
-        self.addLog('  Patching...')
-
+        # Notify rules that processing of a new subdirectory started
         for rule in self.patchingRules:
-          rule.processDataSet(ds)
-
-        patchedFilePath = os.path.abspath(os.path.join(rootOutput,file))
-        for rule in self.patchingRules:
-          patchedFilePath = rule.generateOutputFilePath(patchedFilePath, ds)
-
-        ######################################################
-        # Write
-
-        dirName = os.path.dirname(patchedFilePath)
-        if not os.path.exists(dirName):
-          os.makedirs(dirName)
-
-        self.addLog('  Writing DICOM...')
-        dicom.write_file(patchedFilePath, ds)
-        self.addLog('  Created DICOM file: %s' % patchedFilePath)
+          rule.processDirectory(currentSubDir)
+
+        for file in sorted(files):
+          filePath = os.path.join(root,file)
+          self.addLog('Examining %s...' % os.path.join(currentSubDir,file))
+
+          skipFileRequestingRule = None
+          for rule in self.patchingRules:
+            if rule.skipFile(filePath):
+              skipFileRequestingRule = rule
+              break
+          if skipFileRequestingRule:
+            self.addLog('  Rule '+skipFileRequestingRule.__class__.__name__+' requested to skip this file.')
+            continue
+
+          try:
+            ds, pixelDataPosition = self.readDataSetHeader(filePath)
+          except (IOError, dicom.filereader.InvalidDicomError):
+            self.addLog('  Not DICOM file. Skipped.')
+            continue
+
+          for rule in self.patchingRules:
+            rule.processDataSet(ds)
+
+          patchedFilePath = os.path.abspath(os.path.join(rootOutput,file))
+          for rule in self.patchingRules:
+            patchedFilePath = rule.generateOutputFilePath(ds, patchedFilePath)
+
+          if pixelDataPosition is not None and [tag for tag in ds.keys() if tag >= dicom.tag.Tag(0x7fe0,0x0010)]:
+            # a rule added data elements that must be written after the pixel data
+            self.readRemainingDataElements(ds, filePath)
+            pixelDataPosition = None
+
+          ######################################################
+          # Write
+
+          dirName = os.path.dirname(patchedFilePath)
+          if not os.path.exists(dirName):
+            os.makedirs(dirName)
+
+          manifest.recordFile(patchedFilePath)
+          dicom.write_file(patchedFilePath, ds)
+          copyResult = None
+          if pixelDataPosition is not None:
+            copyResult = copyPool.apply_async(self.copyFileTail, (filePath, pixelDataPosition, patchedFilePath))
+          pendingEntries.append(('file', patchedFilePath, copyResult))
+          self.recordCompletedFiles(manifest, pendingEntries, 4*self.numberOfCopyThreads)
+
+        rulesState = manifest.rulesState(self.patchingRules)
+        pendingEntries.append(('directory', currentSubDir, rulesState))
+        self.recordCompletedFiles(manifest, pendingEntries, 4*self.numberOfCopyThreads)
+
+      self.recordCompletedFiles(manifest, pendingEntries)
+    except Exception:
+      exceptionInfo = sys.exc_info()
+      # wait for the copies already started and record the directories they
+      # complete, so that resuming does not patch them again
+      copyPool.close()
+      copyPool.join()
+      try:
+        self.recordCompletedFiles(manifest, pendingEntries)
+      except Exception as e:
+        # entries after a failed copy stay incomplete
+        logging.debug('Pixel data copy failed while stopping: %s' % e)
+      manifest.close()
+      self.flushLog()
+      raise exceptionInfo[0], exceptionInfo[1], exceptionInfo[2]
+    copyPool.close()
+    copyPool.join()
+    manifest.remove()
 
     self.addLog('DICOM patching completed. Patched files are written to:\n{0}'.format(outputDirPath))
+    self.flushLog()
 
   def importDicomDir(self, outputDirPath):
     """
@@ -589,6 +851,7 @@ class DICOMPatcherLogic(ScriptedLoadableModuleLogic):
     indexer = ctk.ctkDICOMIndexer()
     indexer.addDirectory( slicer.dicomDatabase, outputDirPath )
     self.addLog('DICOM importing completed.')
+    self.flushLog()
 
 #
 # Test
@@ -611,6 +874,10 @@ class DICOMPatcherTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_DICOMPatcher1()
+    self.setUp()
+    self.test_DICOMPatcherResume()
+    self.setUp()
+    self.test_DICOMPatcherRulesState()
 
   def test_DICOMPatcher1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -684,3 +951,112 @@ class DICOMPatcherTest(ScriptedLoadableModuleTest):
 
     import shutil
     shutil.rmtree(testDir)
+
+  def test_DICOMPatcherResume(self):
+    """Interrupt patching in the second directory, then check that resuming
+    writes the remaining files and that pixel data is copied unchanged.
+    """
+
+    import tempfile
+    import dicom
+    testDir = tempfile.mkdtemp(prefix="DICOMPatcherTest-", dir=slicer.app.temporaryPath)
+    inputTestDir = testDir+"/input"
+    outputTestDir = testDir+"/output"
+
+    self.delayDisplay("Generate test files")
+    pixelData = "".join([chr(i % 256) for i in range(64*64*2)])
+    for subDir in ["a", "b"]:
+      os.makedirs(inputTestDir+"/"+subDir)
+      for fileIndex in range(2):
+        testFileDICOMFilename = inputTestDir+"/{0}/image{1}.dcm".format(subDir, fileIndex)
+        file_meta = dicom.dataset.Dataset()
+        file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.2'  # CT Image Storage
+        file_meta.MediaStorageSOPInstanceUID = "1.2.3.{0}{1}".format(ord(subDir), fileIndex)
+        file_meta.ImplementationClassUID = "1.2.3.4"
+        ds = dicom.dataset.FileDataset(testFileDICOMFilename, {}, file_meta=file_meta, preamble="\0" * 128)
+        ds.PatientName = "Test^Firstname"
+        ds.PatientID = "123456"
+        ds.Rows = 64
+        ds.Columns = 64
+        ds.BitsAllocated = 16
+        ds.PixelData = pixelData
+        ds.is_little_endian = True
+        ds.is_implicit_VR = True
+        ds.save_as(testFileDICOMFilename)
+
+    class InterruptPatching(DICOMPatcherRule):
+      interrupt = True
+      processedDirectories = []
+      def processDirectory(self, currentSubDir):
+        InterruptPatching.processedDirectories.append(currentSubDir)
+        if InterruptPatching.interrupt and currentSubDir == "b":
+          raise RuntimeError("Patching interrupted")
+
+    logic = DICOMPatcherLogic()
+    logic.addRule("GenerateMissingIDs")
+    logic.addRule("NormalizeFileNames")
+    logic.patchingRules.append(InterruptPatching())
+
+    self.delayDisplay("Patch input files, interrupted")
+    with self.assertRaises(RuntimeError):
+      logic.patchDicomDir(inputTestDir, outputTestDir)
+    manifestPath = os.path.join(outputTestDir, DICOMPatcherManifest.fileName)
+    self.assertTrue(os.path.exists(manifestPath))
+    # the copies of the first directory finished before patching stopped
+    with open(manifestPath) as manifestFile:
+      completedDirectories = [entry.get('directory') for entry in map(json.loads, manifestFile)]
+    self.assertTrue("a" in completedDirectories)
+
+    self.delayDisplay("Resume patching")
+    InterruptPatching.interrupt = False
+    InterruptPatching.processedDirectories = []
+    logic.patchDicomDir(inputTestDir, outputTestDir)
+    self.assertFalse(os.path.exists(manifestPath))
+    # the completed directory is not patched again
+    self.assertEqual(InterruptPatching.processedDirectories, ["b"])
+
+    patchedFiles = []
+    for root, subFolders, files in os.walk(outputTestDir):
+      patchedFiles += [os.path.join(root, file) for file in files]
+    self.assertEqual(len(patchedFiles), 4)
+    for patchedFile in patchedFiles:
+      ds = dicom.read_file(patchedFile)
+      self.assertEqual(ds.PixelData, pixelData)
+      self.assertNotEqual(ds.SeriesInstanceUID, '')
+
+    self.delayDisplay("Clean up")
+
+    import shutil
+    shutil.rmtree(testDir)
+
+  def test_DICOMPatcherRulesState(self):
+    """Check that the state of the rules is written to the manifest as JSON
+    and restored unchanged, including strings that are not ASCII.
+    """
+
+    import tempfile
+    testDir = tempfile.mkdtemp(prefix="DICOMPatcherTest-", dir=slicer.app.temporaryPath)
+
+    rule = GenerateMissingIDs()
+    rule.patientIDToRandomIDMap = {'Patient\xe9': '1.2.3'}
+    rule.numberOfSeriesInStudyMap = {'1.2.4': 3}
+    rule.randomPatientID = '1.2.5'
+
+    manifest = DICOMPatcherManifest(testDir, testDir, [rule])
+    manifest.open()
+    manifest.recordCompletedDirectory('a', manifest.rulesState([rule]))
+    manifest.close()
+    with open(manifest.filePath) as manifestFile:
+      lastEntry = json.loads(manifestFile.readlines()[-1])
+    self.assertEqual(lastEntry['directory'], 'a')
+
+    restoredRule = GenerateMissingIDs()
+    completedDirectories = DICOMPatcherManifest(testDir, testDir, [restoredRule]).resume([restoredRule])
+    self.assertEqual(completedDirectories, set(['a']))
+    self.assertEqual(restoredRule.patientIDToRandomIDMap, rule.patientIDToRandomIDMap)
+    self.assertEqual(restoredRule.numberOfSeriesInStudyMap, rule.numberOfSeriesInStudyMap)
+    self.assertEqual(restoredRule.randomPatientID, rule.randomPatientID)
+    self.assertTrue(isinstance(restoredRule.patientIDToRandomIDMap.keys()[0], str))
+
+    import shutil
+    shutil.rmtree(testDir)
@@ -1,8 +1,10 @@
+import json
 import numpy
 import os
 import vtk, qt, ctk, slicer, vtkITK
 from DICOMLib import DICOMPlugin
 from DICOMLib import DICOMLoadable
+from DICOMLib import DICOMLoadableCache
 from DICOMLib import DICOMExportScalarVolume
 import logging
 
@@ -12,6 +14,71 @@ import logging
 # plugin architecture.
 #
 
+class DICOMScalarVolumeCache(DICOMLoadableCache):
+  """Cache of decoded scalar volumes in memory-mappable files.
+  The voxels of a loaded series are saved as a .npy file in the VolumeCache
+  folder next to the DICOM database, with the volume geometry in a .json file.
+  Volume nodes use the memory-mapped file instead of voxels in memory, so the
+  operating system reads voxels from the file as views access them and can drop
+  them again when memory is needed. This allows opening several large volumes
+  without requiring memory for all of them at once, and loading the same
+  files again does not decode them.
+  """
+
+  directoryName = "VolumeCache"
+  fileExtension = ".npy"
+
+  def __init__(self, cacheDirectory=None, maximumSize=10*1024*1024*1024):
+    super(DICOMScalarVolumeCache,self).__init__(cacheDirectory, maximumSize, maximumNumberOfMemoryEntries=0)
+
+  def get(self, key):
+    """Return the memory-mapped voxel array and the geometry cached for key, or None"""
+    path = self.filePath(key)
+    if not path or not os.path.exists(path) or not os.path.exists(path + ".json"):
+      return None
+    try:
+      with open(path + ".json") as f:
+        geometry = json.load(f)
+      # copy on write, so that modifying the volume does not modify the cache
+      voxels = numpy.load(path, mmap_mode='c')
+    except (IOError, ValueError) as e:
+      logging.debug("Discarding unreadable volume cache entry %s: %s" % (path, e))
+      self.remove(key)
+      return None
+    self.touch(key)
+    return voxels, geometry
+
+  def store(self, key, voxels, geometry):
+    """Save voxels and geometry for key.
+    Returns the memory-mapped voxels, or None if they could not be cached.
+    """
+    path = self.filePath(key)
+    if not path:
+      return None
+    try:
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      # write to a temporary file first so that readers never see partial entries
+      with open(path + ".tmp", 'wb') as f:
+        numpy.save(f, voxels)
+      with open(path + ".json", 'w') as f:
+        json.dump(geometry, f)
+      if os.path.exists(path):
+        os.remove(path)
+      os.rename(path + ".tmp", path)
+    except (IOError, OSError) as e:
+      logging.warning("Failed to write volume cache entry %s: %s" % (path, e))
+      return None
+    with self.lock:
+      self.evict()
+    cached = self.get(key)
+    return cached[0] if cached else None
+
+  def removeFile(self, path):
+    os.remove(path)
+    if os.path.exists(path + ".json"):
+      os.remove(path + ".json")
+
 class DICOMScalarVolumePluginClass(DICOMPlugin):
   """ ScalarVolume specific interpretation code
   """
@@ -19,6 +86,7 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
   def __init__(self,epsilon=0.01):
     super(DICOMScalarVolumePluginClass,self).__init__()
     self.loadType = "Scalar Volume"
+    self.canExamineConcurrently = True
     self.epsilon = epsilon
     self.defaultStudyID = 'SLICER10001' #TODO: What should be the new study ID?
 
@@ -38,6 +106,8 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     self.tags['windowCenter'] = "0028,1050"
     self.tags['windowWidth'] = "0028,1051"
 
+    self.volumeCache = DICOMScalarVolumeCache.sharedCache()
+
   @staticmethod
   def readerApproaches():
     """Available reader implementations.  First entry is initial default.
@@ -66,6 +136,17 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
       "DICOM/ScalarVolume/ReaderApproach", readersComboBox,
       "currentIndex", qt.SIGNAL("currentIndexChanged(int)"))
 
+    memoryMappedCacheCheckBox = qt.QCheckBox()
+    memoryMappedCacheCheckBox.toolTip = ("Keep the voxels of loaded volumes in memory-mapped files next to the DICOM database."
+      " Voxels are read from the file as they are displayed, so several large volumes can be loaded without"
+      " requiring memory for all of them, and loading the same series again is faster. Not used by the Archetype reader.")
+
+    formLayout.addRow("Memory-mapped volume cache", memoryMappedCacheCheckBox)
+
+    panel.registerProperty(
+      "DICOM/ScalarVolume/MemoryMappedCache", memoryMappedCacheCheckBox,
+      "checked", qt.SIGNAL("toggled(bool)"))
+
   @staticmethod
   def compareVolumeNodes(volumeNode1,volumeNode2):
     """
@@ -91,19 +172,35 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     corresponding to ways of interpreting the
     fileLists parameter (list of file lists).
     """
-    loadables = []
+    loadablesByFileList = []
     for files in fileLists:
       cachedLoadables = self.getCachedLoadables(files)
       if cachedLoadables:
-        loadables += cachedLoadables
+        loadablesByFileList.append(cachedLoadables)
       else:
         loadablesForFiles = self.examineFiles(files)
-        loadables += loadablesForFiles
+        loadablesByFileList.append(loadablesForFiles)
         self.cacheLoadables(files,loadablesForFiles)
 
-    # sort the loadables by series number if possible
-    loadables.sort(lambda x,y: self.seriesSorter(x,y))
+    return self.mergeLoadables(loadablesByFileList)
 
+  def prefetchTags(self,files):
+    """ Returns the tags of the files and, for defaultSeriesNodeName,
+    the files of their series with the tags of the first one.
+    """
+    snapshot = super(DICOMScalarVolumePluginClass,self).prefetchTags(files)
+    seriesUIDs = set([snapshot.fileValue(file, self.tags['seriesUID']) for file in files])
+    for seriesUID in seriesUIDs:
+      seriesFiles = snapshot.addSeries(slicer.dicomDatabase, seriesUID)
+      snapshot.addFiles(slicer.dicomDatabase, seriesFiles[:1], self.tags.values())
+    return snapshot
+
+  def mergeLoadables(self,loadablesByFileList):
+    """ Returns the loadables of all the file lists
+    sorted by series number if possible.
+    """
+    loadables = super(DICOMScalarVolumePluginClass,self).mergeLoadables(loadablesByFileList)
+    loadables.sort(lambda x,y: self.seriesSorter(x,y))
     return loadables
 
   def examineFiles(self,files):
@@ -112,7 +209,19 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     files parameter.
     """
 
-    seriesUID = slicer.dicomDatabase.fileValue(files[0],self.tags['seriesUID'])
+    # make subseries volumes based on tag differences
+    subseriesTags = [
+        "seriesInstanceUID",
+        "contentTime",
+        "triggerTime",
+        "diffusionGradientOrientation",
+        "imageOrientationPatient",
+    ]
+
+    # fetch all the tags used for the examination in a single pass over the files
+    values = self.fileValues(files, ['seriesUID', 'position', 'orientation', 'pixelData'] + subseriesTags)
+
+    seriesUID = values[files[0]]['seriesUID']
     seriesName = self.defaultSeriesNodeName(seriesUID)
 
     # default loadable includes all files for series
@@ -123,20 +232,6 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     loadable.selected = True
     # add it to the list of loadables later, if pixel data is available in at least one file
 
-    # while looping through files, keep track of their
-    # position and orientation for later use
-    positions = {}
-    orientations = {}
-
-    # make subseries volumes based on tag differences
-    subseriesTags = [
-        "seriesInstanceUID",
-        "contentTime",
-        "triggerTime",
-        "diffusionGradientOrientation",
-        "imageOrientationPatient",
-    ]
-
     #
     # first, look for subseries within this series
     # - build a list of files for each unique value
@@ -144,25 +239,13 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     #
     subseriesFiles = {}
     subseriesValues = {}
+    for tag in subseriesTags:
+      subseriesValues[tag] = []
     for file in loadable.files:
-
-      # save position and orientation
-      positions[file] = slicer.dicomDatabase.fileValue(file,self.tags['position'])
-      if positions[file] == "":
-        positions[file] = None
-      orientations[file] = slicer.dicomDatabase.fileValue(file,self.tags['orientation'])
-      if orientations[file] == "":
-        orientations[file] = None
-
-      # check for subseries values
       for tag in subseriesTags:
-        value = slicer.dicomDatabase.fileValue(file,self.tags[tag])
-        value = value.replace(",","_") # remove commas so it can be used as an index
-        if not subseriesValues.has_key(tag):
-          subseriesValues[tag] = []
-        if not subseriesValues[tag].__contains__(value):
-          subseriesValues[tag].append(value)
+        value = values[file][tag].replace(",","_") # remove commas so it can be used as an index
         if not subseriesFiles.has_key((tag,value)):
+          subseriesValues[tag].append(value)
           subseriesFiles[tag,value] = []
         subseriesFiles[tag,value].append(file)
 
@@ -189,10 +272,7 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     # remove any files from loadables that don't have pixel data (no point sending them to ITK for reading)
     newLoadables = []
     for loadable in loadables:
-      newFiles = []
-      for file in loadable.files:
-        if slicer.dicomDatabase.fileValue(file,self.tags['pixelData'])!='':
-          newFiles.append(file)
+      newFiles = [file for file in loadable.files if values[file]['pixelData'] != '']
       if len(newFiles) > 0:
         loadable.files = newFiles
         newLoadables.append(loadable)
@@ -219,83 +299,53 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
       # series and calculate the scan direction (assumed to be perpendicular
       # to the acquisition plane)
       #
-      value = slicer.dicomDatabase.fileValue(loadable.files[0], self.tags['numberOfFrames'])
+      value = self.fileValues(loadable.files[:1], ['numberOfFrames'])[loadable.files[0]]['numberOfFrames']
       if value != "":
         loadable.warning += "Multi-frame image. If slice orientation or spacing is non-uniform then the image may be displayed incorrectly. Use with caution.  "
 
-      validGeometry = True
-      ref = {}
-      for tag in [self.tags['position'], self.tags['orientation']]:
-        value = slicer.dicomDatabase.fileValue(loadable.files[0], tag)
-        if not value or value == "":
-          loadable.warning += "Reference image in series does not contain geometry information.  Please use caution.  "
-          validGeometry = False
-          loadable.confidence = 0.2
-          break
-        ref[tag] = value
-
-      if not validGeometry:
+      referencePosition = values[loadable.files[0]]['position']
+      referenceOrientation = values[loadable.files[0]]['orientation']
+      if not referencePosition or not referenceOrientation:
+        loadable.warning += "Reference image in series does not contain geometry information.  Please use caution.  "
+        loadable.confidence = 0.2
         continue
 
       # get the geometry of the scan
       # with respect to an arbitrary slice
-      sliceAxes = [float(zz) for zz in ref[self.tags['orientation']].split('\\')]
-      x = sliceAxes[:3]
-      y = sliceAxes[3:]
-      scanAxis = self.cross(x,y)
-      scanOrigin = [float(zz) for zz in ref[self.tags['position']].split('\\')]
+      sliceAxes = numpy.array(referenceOrientation.split('\\')[:6], dtype=float)
+      scanAxis = numpy.cross(sliceAxes[:3], sliceAxes[3:])
+      scanOrigin = numpy.array(referencePosition.split('\\')[:3], dtype=float)
 
       #
       # for each file in series, calculate the distance along
       # the scan axis, sort files by this
       #
-      sortList = []
-      missingGeometry = False
-      for file in loadable.files:
-        if not positions[file]:
-          missingGeometry = True
-          break
-        position = [float(zz) for zz in positions[file].split('\\')]
-        vec = self.difference(position, scanOrigin)
-        dist = self.dot(vec, scanAxis)
-        sortList.append((file, dist))
-
-      if missingGeometry:
+      positionValues = [values[file]['position'] for file in loadable.files]
+      if not all(positionValues):
         loadable.warning += "One or more images is missing geometry information.  "
-      else:
-        sortedFiles = sorted(sortList, key=lambda x: x[1])
-        distances = {}
-        loadable.files = []
-        for file,dist in sortedFiles:
-          loadable.files.append(file)
-          distances[file] = dist
-
-        #
-        # confirm equal spacing between slices
-        # - use variable 'epsilon' to determine the tolerance
-        #
-        spaceWarnings = 0
-        if len(loadable.files) > 1:
-          file0 = loadable.files[0]
-          file1 = loadable.files[1]
-          dist0 = distances[file0]
-          dist1 = distances[file1]
-          spacing0 = dist1 - dist0
-          n = 1
-          for fileN in loadable.files[1:]:
-            fileNminus1 = loadable.files[n-1]
-            distN = distances[fileN]
-            distNminus1 = distances[fileNminus1]
-            spacingN = distN - distNminus1
-            spaceError = spacingN - spacing0
-            if abs(spaceError) > self.epsilon:
-              spaceWarnings += 1
-              loadable.warning += "Images are not equally spaced (a difference of %g in spacings was detected).  Slicer will load this series as if it had a spacing of %g.  Please use caution.  " % (spaceError, spacing0)
-              break
-            n += 1
-
-        if spaceWarnings != 0:
-          logging.warning("Geometric issues were found with %d of the series.  Please use caution." % spaceWarnings)
+        continue
+
+      positions = numpy.array([position.split('\\')[:3] for position in positionValues], dtype=float)
+      distances = numpy.dot(positions - scanOrigin, scanAxis)
+      # stable sort, so that files at the same position keep their order
+      sortedIndices = numpy.argsort(distances, kind='mergesort')
+      loadable.files = [loadable.files[index] for index in sortedIndices]
+
+      #
+      # confirm equal spacing between slices
+      # - use variable 'epsilon' to determine the tolerance
+      #
+      spaceWarnings = 0
+      if len(loadable.files) > 1:
+        spacings = numpy.diff(distances[sortedIndices])
+        spaceErrors = spacings - spacings[0]
+        unequalSpacings = numpy.flatnonzero(numpy.abs(spaceErrors) > self.epsilon)
+        if len(unequalSpacings) > 0:
+          spaceWarnings += 1
+          loadable.warning += "Images are not equally spaced (a difference of %g in spacings was detected).  Slicer will load this series as if it had a spacing of %g.  Please use caution.  " % (spaceErrors[unequalSpacings[0]], spacings[0])
+
+      if spaceWarnings != 0:
+        logging.warning("Geometric issues were found with %d of the series.  Please use caution." % spaceWarnings)
 
     return loadables
 
@@ -399,6 +449,56 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
 
     return(volumeNode)
 
+  @staticmethod
+  def setMemoryMappedImageData(volumeNode,voxels,geometry):
+    """Make volumeNode use the memory-mapped voxels ([k,j,i] or [k,j,i,component] array)
+    without copying them and set its geometry
+    """
+    import vtk.util.numpy_support
+    numberOfComponents = voxels.shape[3] if voxels.ndim == 4 else 1
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(voxels.shape[2], voxels.shape[1], voxels.shape[0])
+    # the vtk array keeps a reference to the mapped array, so the file stays mapped as long as it is used
+    scalars = vtk.util.numpy_support.numpy_to_vtk(voxels.reshape(-1, numberOfComponents))
+    imageData.GetPointData().SetScalars(scalars)
+    ijkToRAS = vtk.vtkMatrix4x4()
+    for index, value in enumerate(geometry['ijkToRAS']):
+      ijkToRAS.SetElement(index // 4, index % 4, value)
+    volumeNode.SetIJKToRASMatrix(ijkToRAS)
+    volumeNode.SetAndObserveImageData(imageData)
+
+  def loadFromVolumeCache(self,files,name):
+    """Create a volume node from the voxels cached for files
+    or return None if they are not cached
+    """
+    cached = self.volumeCache.get(self.loadableCacheKey(files))
+    if not cached:
+      return None
+    voxels, geometry = cached
+    logging.info("Loading %s from the volume cache" % name)
+    name = slicer.mrmlScene.GenerateUniqueName(slicer.util.toVTKString(name))
+    volumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", name)
+    self.setMemoryMappedImageData(volumeNode, voxels, geometry)
+    volumeNode.CreateDefaultDisplayNodes()
+    return volumeNode
+
+  def storeInVolumeCache(self,volumeNode,files):
+    """Save the voxels of a volume node loaded from files in the volume cache
+    and replace them in the node by the memory-mapped cache file
+    """
+    ijkToRAS = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRAS)
+    geometry = {'ijkToRAS': [ijkToRAS.GetElement(row, column) for row in range(4) for column in range(4)]}
+    voxels = self.volumeCache.store(self.loadableCacheKey(files), slicer.util.arrayFromVolume(volumeNode), geometry)
+    if voxels is None:
+      return
+    self.setMemoryMappedImageData(volumeNode, voxels, geometry)
+    # release the decoded voxels, the node only uses the mapped file now
+    instance = getattr(slicer.modules, 'DICOMInstance', None)
+    for pipelineObject in [getattr(instance, 'imageChangeInformation', None), getattr(instance, 'reader', None)]:
+      if pipelineObject:
+        pipelineObject.GetOutputDataObject(0).ReleaseData()
+
   def setVolumeNodeProperties(self,volumeNode,loadable):
     if volumeNode:
       #
@@ -466,15 +566,29 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     if not readerApproach:
       readerIndex = slicer.util.settingsValue('DICOM/ScalarVolume/ReaderApproach', 0, converter=int)
       readerApproach = DICOMScalarVolumePluginClass.readerApproaches()[readerIndex]
+    useVolumeCache = (readerApproach != "Archetype" and
+      slicer.util.settingsValue('DICOM/ScalarVolume/MemoryMappedCache', False, converter=slicer.util.toBool))
+    volumeNode = None
+    if useVolumeCache:
+      volumeNode = self.loadFromVolumeCache(loadable.files, loadable.name)
+    if not volumeNode:
+      volumeNode = self.loadFilesWithReaderApproach(readerApproach, loadable.files, loadable.name)
+      if useVolumeCache and volumeNode:
+        self.storeInVolumeCache(volumeNode, loadable.files)
+    self.setVolumeNodeProperties(volumeNode, loadable)
+    return volumeNode
+
+  def loadFilesWithReaderApproach(self,readerApproach,files,name):
+    """Decode files with one of the readerApproaches()
+    """
     if readerApproach == "Archetype":
-      volumeNode = self.loadFilesWithArchetype(loadable.files, loadable.name)
+      volumeNode = self.loadFilesWithArchetype(files, name)
     elif readerApproach == "GDCM with DCMTK fallback":
-      volumeNode = self.loadFilesWithSeriesReader("GDCM", loadable.files, loadable.name)
+      volumeNode = self.loadFilesWithSeriesReader("GDCM", files, name)
       if not volumeNode:
-        volumeNode = self.loadFilesWithSeriesReader("DCMTK", loadable.files, loadable.name)
+        volumeNode = self.loadFilesWithSeriesReader("DCMTK", files, name)
     else:
-      volumeNode = self.loadFilesWithSeriesReader(readerApproach, loadable.files, loadable.name)
-    self.setVolumeNodeProperties(volumeNode, loadable)
+      volumeNode = self.loadFilesWithSeriesReader(readerApproach, files, name)
     return volumeNode
 
   def examineForExport(self,subjectHierarchyItemID):
@@ -16,6 +16,7 @@ class DICOMSlicerDataBundlePluginClass(DICOMPlugin):
   def __init__(self):
     super(DICOMSlicerDataBundlePluginClass,self).__init__()
     self.loadType = "Slicer Data Bundle"
+    self.canExamineConcurrently = True
     self.tags['seriesDescription'] = "0008,103e"
     self.tags['candygram'] = "cadb,0010"
     self.tags['zipSize'] = "cadb,1008"
@@ -52,10 +53,10 @@ class DICOMSlicerDataBundlePluginClass(DICOMPlugin):
     if len(files) == 1:
       f = files[0]
       # get the series description to use as base for volume name
-      name = slicer.dicomDatabase.fileValue(f, self.tags['seriesDescription'])
+      name = self.database().fileValue(f, self.tags['seriesDescription'])
       if name == "":
         name = "Unknown"
-      candygramValue = slicer.dicomDatabase.fileValue(f, self.tags['candygram'])
+      candygramValue = self.database().fileValue(f, self.tags['candygram'])
 
       if candygramValue:
         # default loadable includes all files for series
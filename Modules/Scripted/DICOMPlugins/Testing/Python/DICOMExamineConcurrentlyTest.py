@@ -0,0 +1,107 @@
+import multiprocessing.pool
+import shutil
+import tempfile
+import time
+import unittest
+import qt
+import slicer
+from DICOMLib import DICOMDetailsBase, DICOMLoadable, DICOMLoadableCache, DICOMPlugin, DICOMTagSnapshot
+
+class ExamineWidget(DICOMDetailsBase, qt.QWidget):
+  """Only what examinePluginsConcurrently uses, without a DICOM browser"""
+
+  def __init__(self):
+    qt.QWidget.__init__(self)
+    self.pluginInstances = {}
+    self.failures = []
+
+  def reportPluginFailure(self, pluginClass, exceptionText):
+    self.failures.append(pluginClass)
+
+class RecordingPlugin(DICOMPlugin):
+  """Plugin that records when it reads tags and examines files"""
+
+  def __init__(self, name, events, cacheDirectory, canExamineConcurrently):
+    super(RecordingPlugin,self).__init__()
+    self.name = name
+    self.events = events
+    self.loadableCache = DICOMLoadableCache(cacheDirectory)
+    self.canExamineConcurrently = canExamineConcurrently
+
+  def prefetchTags(self, files):
+    self.events.append(('prefetch', self.name, files[0]))
+    time.sleep(0.1)
+    return DICOMTagSnapshot()
+
+  def examineFiles(self, files):
+    self.events.append(('examine start', self.name, files[0]))
+    time.sleep(0.2)
+    self.events.append(('examine end', self.name, files[0]))
+    loadable = DICOMLoadable()
+    loadable.name = "%s %s" % (self.name, files[0])
+    loadable.files = files
+    return [loadable]
+
+  def examineForImport(self, fileLists):
+    loadables = []
+    for files in fileLists:
+      loadables += self.examineFiles(files)
+    return loadables
+
+class DICOMExamineConcurrentlyTest(unittest.TestCase):
+
+  def setUp(self):
+    self.cacheDirectory = tempfile.mkdtemp()
+    self.fileLists = [['/synthetic/%s%d.dcm' % (series, index) for index in range(2)] for series in 'abc']
+    self.events = []
+    self.widget = ExamineWidget()
+    self.numberOfPools = 0
+    self.originalThreadPool = multiprocessing.pool.ThreadPool
+    def countingThreadPool(*args):
+      self.numberOfPools += 1
+      return self.originalThreadPool(*args)
+    multiprocessing.pool.ThreadPool = countingThreadPool
+
+  def tearDown(self):
+    multiprocessing.pool.ThreadPool = self.originalThreadPool
+    shutil.rmtree(self.cacheDirectory)
+
+  def addPlugin(self, name, canExamineConcurrently):
+    self.widget.pluginInstances[name] = RecordingPlugin(name, self.events, self.cacheDirectory, canExamineConcurrently)
+    return self.widget.pluginInstances[name]
+
+  def eventIndices(self, eventType, name):
+    return [index for index, event in enumerate(self.events) if event[:2] == (eventType, name)]
+
+  def test_TasksOverlapTagReading(self):
+    concurrentPlugin = self.addPlugin('concurrent', True)
+    mainThreadPlugin = self.addPlugin('mainThread', False)
+    loadablesByPlugin = self.widget.examinePluginsConcurrently(['concurrent', 'mainThread'], self.fileLists)
+    self.assertEqual(self.widget.failures, [])
+
+    # the first task starts before the tags of the last file list are read
+    self.assertLess(self.eventIndices('examine start', 'concurrent')[0],
+                    self.eventIndices('prefetch', 'concurrent')[-1])
+    # and the main thread plugin runs while tasks are still running
+    self.assertLess(self.eventIndices('examine start', 'mainThread')[0],
+                    self.eventIndices('examine end', 'concurrent')[-1])
+
+    # results are in file list order
+    expectedNames = ["concurrent %s" % files[0] for files in self.fileLists]
+    self.assertEqual([loadable.name for loadable in loadablesByPlugin[concurrentPlugin]], expectedNames)
+    self.assertEqual(len(loadablesByPlugin[mainThreadPlugin]), len(self.fileLists))
+    self.assertEqual(self.numberOfPools, 1)
+    self.assertEqual(concurrentPlugin.prefetchedDatabase, None)
+
+    # cached file lists are neither read nor queued
+    del self.events[:]
+    loadablesByPlugin = self.widget.examinePluginsConcurrently(['concurrent'], self.fileLists)
+    self.assertEqual([loadable.name for loadable in loadablesByPlugin[concurrentPlugin]], expectedNames)
+    self.assertEqual(self.events, [])
+    self.assertEqual(self.numberOfPools, 1)
+
+  def test_NoPoolWithoutConcurrentPlugins(self):
+    mainThreadPlugin = self.addPlugin('mainThread', False)
+    loadablesByPlugin = self.widget.examinePluginsConcurrently(['mainThread'], self.fileLists)
+    self.assertEqual(len(loadablesByPlugin[mainThreadPlugin]), len(self.fileLists))
+    self.assertEqual(self.numberOfPools, 0)
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import qt
+import slicer
+from DICOMLib import DICOMListener
+
+class StubDatabase(object):
+  """Only what DICOMListener uses of a ctkDICOMDatabase"""
+
+  def __init__(self, directory):
+    self.databaseFilename = os.path.join(directory, "ctkDICOM.sql")
+
+class StubIndexer(object):
+  """Record the batches instead of adding them to the database"""
+
+  def __init__(self):
+    self.batches = []
+
+  def addListOfFiles(self, database, files, destinationDir):
+    self.batches.append(list(files))
+
+class DICOMListenerBatchingTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempDirectory = tempfile.mkdtemp()
+    settings = qt.QSettings()
+    self.originalDatabaseDirectory = settings.value('DatabaseDirectory')
+    settings.setValue('DatabaseDirectory', self.tempDirectory)
+    self.addedCallbackCount = 0
+    self.listener = DICOMListener(StubDatabase(self.tempDirectory), fileAddedCallback=self.onFileAdded)
+    self.indexer = StubIndexer()
+    self.listener.indexer = self.indexer
+
+  def tearDown(self):
+    self.listener.batchTimer.stop()
+    self.listener.pendingFiles = []
+    qt.QSettings().setValue('DatabaseDirectory', self.originalDatabaseDirectory)
+    shutil.rmtree(self.tempDirectory)
+
+  def onFileAdded(self):
+    self.addedCallbackCount += 1
+
+  def receive(self, numberOfFiles, prefix):
+    """Pass the files to the listener the way the storescp output does"""
+    files = [os.path.join(self.tempDirectory, "incoming", "%s%d.dcm" % (prefix, index)) for index in range(numberOfFiles)]
+    for filePath in files:
+      self.listener.processStdoutLine("# dcmdump (1/1): %s\n" % filePath)
+    return files
+
+  def test_BatchSizeFlush(self):
+    files = self.receive(self.listener.maximumBatchSize - 1, "first")
+    self.assertEqual(self.indexer.batches, [])
+    self.assertTrue(self.listener.batchTimer.isActive())
+    self.assertEqual(self.listener.statistics()['queueDepth'], len(files))
+
+    # the file that fills the batch adds it at once
+    files += self.receive(1, "last")
+    self.assertEqual(self.indexer.batches, [files])
+    self.assertFalse(self.listener.batchTimer.isActive())
+    self.assertEqual(self.listener.lastFilesAdded, files)
+    self.assertEqual(self.listener.lastFileAdded, files[-1])
+    self.assertEqual(self.addedCallbackCount, 1)
+
+    statistics = self.listener.statistics()
+    self.assertEqual(statistics['queueDepth'], 0)
+    self.assertEqual(statistics['receivedFiles'], self.listener.maximumBatchSize)
+    self.assertEqual(statistics['addedFiles'], self.listener.maximumBatchSize)
+    self.assertEqual(statistics['addedBatches'], 1)
+    self.assertGreater(statistics['filesPerSecond'], 0)
+
+  def test_BatchDelayFlush(self):
+    startTime = time.time()
+    files = self.receive(3, "series")
+    self.assertEqual(self.listener.batchTimer.interval, self.listener.maximumBatchDelay)
+    slicer.app.processEvents()
+    self.assertEqual(self.indexer.batches, [])
+
+    while not self.indexer.batches and time.time() - startTime < 5 * self.listener.maximumBatchDelay / 1000.:
+      slicer.app.processEvents()
+      time.sleep(0.01)
+    self.assertEqual(self.indexer.batches, [files])
+    self.assertGreaterEqual(time.time() - startTime, 0.9 * self.listener.maximumBatchDelay / 1000.)
+    self.assertEqual(self.addedCallbackCount, 1)
+
+    statistics = self.listener.statistics()
+    self.assertEqual(statistics['queueDepth'], 0)
+    self.assertEqual(statistics['receivedFiles'], 3)
+    self.assertEqual(statistics['addedFiles'], 3)
+    self.assertEqual(statistics['addedBatches'], 1)
+
+    # files received later start a new batch, which stopping the listener adds
+    moreFiles = self.receive(2, "more")
+    self.assertEqual(self.listener.statistics()['queueDepth'], 2)
+    self.listener.stop()
+    self.assertEqual(self.indexer.batches, [files, moreFiles])
+    statistics = self.listener.statistics()
+    self.assertEqual(statistics['receivedFiles'], 5)
+    self.assertEqual(statistics['addedFiles'], 5)
+    self.assertEqual(statistics['addedBatches'], 2)
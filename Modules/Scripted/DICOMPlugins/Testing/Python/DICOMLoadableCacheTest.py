@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+import unittest
+import slicer
+from DICOMLib import DICOMLoadable, DICOMLoadableCache, DICOMPlugin
+from DICOMScalarVolumePlugin import DICOMScalarVolumeCache, DICOMScalarVolumePluginClass
+
+class DICOMLoadableCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempDirectory = tempfile.mkdtemp()
+    self.cacheDirectory = os.path.join(self.tempDirectory, "LoadableCache")
+    self.files = []
+    for index in range(3):
+      path = os.path.join(self.tempDirectory, "image%d.dcm" % index)
+      with open(path, 'w') as f:
+        f.write("image %d" % index)
+      self.files.append(path)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDirectory)
+
+  def makeLoadable(self, name):
+    loadable = DICOMLoadable()
+    loadable.files = self.files
+    loadable.name = name
+    return loadable
+
+  def test_PersistsAcrossInstances(self):
+    plugin = DICOMPlugin()
+    plugin.loadableCache = DICOMLoadableCache(self.cacheDirectory)
+    plugin.cacheLoadables(self.files, [self.makeLoadable("series")])
+
+    # a new cache reading the same folder, as in a new session
+    plugin.loadableCache = DICOMLoadableCache(self.cacheDirectory)
+    loadables = plugin.getCachedLoadables(self.files)
+    self.assertEqual(len(loadables), 1)
+    self.assertEqual(loadables[0].name, "series")
+    self.assertEqual(loadables[0].files, self.files)
+
+  def test_ModifiedFilesAreNotServed(self):
+    plugin = DICOMPlugin()
+    plugin.loadableCache = DICOMLoadableCache(self.cacheDirectory)
+    plugin.cacheLoadables(self.files, [self.makeLoadable("series")])
+    with open(self.files[1], 'a') as f:
+      f.write(" modified")
+    self.assertEqual(plugin.getCachedLoadables(self.files), None)
+
+  def test_EntriesAreWrittenAsJSON(self):
+    import json
+    cache = DICOMLoadableCache(self.cacheDirectory, maximumNumberOfMemoryEntries=0)
+    loadable = self.makeLoadable("series\xe9")
+    loadable.warning = "not equally spaced"
+    cache.store("series", [loadable])
+    with open(cache.filePath("series")) as f:
+      self.assertEqual(json.load(f)[0]["warning"], "not equally spaced")
+    cached = cache.get("series")[0]
+    self.assertEqual(type(cached), DICOMLoadable)
+    self.assertEqual(vars(cached), vars(loadable))
+
+    # loadables that cannot be written as JSON are only kept in memory
+    loadable.node = object()
+    cache.store("node", [loadable])
+    self.assertFalse(os.path.exists(cache.filePath("node")))
+
+    # an entry planted in the folder is not executed, only discarded
+    import cPickle
+    with open(cache.filePath("planted"), 'wb') as f:
+      cPickle.dump([loadable.name], f)
+    self.assertEqual(cache.get("planted"), None)
+    self.assertFalse(os.path.exists(cache.filePath("planted")))
+
+  def test_CodeChangesAreNotServed(self):
+    plugin = DICOMPlugin()
+    plugin.loadableCache = DICOMLoadableCache(self.cacheDirectory)
+    plugin.cacheLoadables(self.files, [self.makeLoadable("series")])
+    plugin.loadableCacheVersion += 1
+    self.assertEqual(plugin.getCachedLoadables(self.files), None)
+
+  def test_LeastRecentlyUsedEntriesAreEvicted(self):
+    cache = DICOMLoadableCache(self.cacheDirectory, maximumNumberOfMemoryEntries=0)
+    cache.store("first", [self.makeLoadable("first")])
+    os.utime(cache.filePath("first"), (1, 1))
+    cache.store("second", [self.makeLoadable("second")])
+    os.utime(cache.filePath("second"), (2, 2))
+    # room for two entries only
+    cache.maximumSize = os.path.getsize(cache.filePath("first")) + os.path.getsize(cache.filePath("second"))
+    # using the first entry makes the second one the least recently used
+    self.assertEqual(cache.get("first")[0].name, "first")
+    cache.store("third", [self.makeLoadable("third")])
+    self.assertEqual(cache.get("second"), None)
+    self.assertEqual(cache.get("first")[0].name, "first")
+    self.assertEqual(cache.get("third")[0].name, "third")
+
+    cache.clear()
+    self.assertEqual(cache.entries(), [])
+
+  def test_VolumeCacheMapsVoxels(self):
+    import numpy
+    import vtk
+    plugin = DICOMScalarVolumePluginClass()
+    plugin.volumeCache = DICOMScalarVolumeCache(os.path.join(self.tempDirectory, "VolumeCache"))
+
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(4, 5, len(self.files))
+    imageData.AllocateScalars(vtk.VTK_SHORT, 1)
+    volumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", "decoded")
+    volumeNode.SetAndObserveImageData(imageData)
+    voxels = slicer.util.arrayFromVolume(volumeNode)
+    voxels[:] = numpy.arange(voxels.size).reshape(voxels.shape)
+    volumeNode.SetSpacing(0.5, 0.5, 2.0)
+    volumeNode.SetOrigin(10, 20, 30)
+
+    plugin.storeInVolumeCache(volumeNode, self.files)
+    self.assertTrue(numpy.all(slicer.util.arrayFromVolume(volumeNode) == voxels))
+
+    cachedNode = plugin.loadFromVolumeCache(self.files, "cached")
+    self.assertTrue(numpy.all(slicer.util.arrayFromVolume(cachedNode) == voxels))
+    self.assertEqual(cachedNode.GetSpacing(), (0.5, 0.5, 2.0))
+    self.assertEqual(cachedNode.GetOrigin(), (10, 20, 30))
+
+    with open(self.files[0], 'a') as f:
+      f.write(" modified")
+    self.assertEqual(plugin.loadFromVolumeCache(self.files, "cached"), None)
+
+    slicer.mrmlScene.RemoveNode(volumeNode)
+    slicer.mrmlScene.RemoveNode(cachedNode)
@@ -0,0 +1,93 @@
+import random
+import unittest
+import slicer
+from DICOMLib import DICOMLoadableCache
+from DICOMScalarVolumePlugin import DICOMScalarVolumePluginClass
+
+class SyntheticDICOMDatabase(object):
+  """Stands in for slicer.dicomDatabase with the tag values of a synthetic axial series"""
+
+  def __init__(self, numberOfFiles, spacing=0.625, displacedFileIndex=None):
+    self.numberOfFileValueCalls = 0
+    self.files = ['/synthetic/slice%05d.dcm' % index for index in range(numberOfFiles)]
+    self.values = {}
+    for index, file in enumerate(self.files):
+      z = index * spacing
+      if index == displacedFileIndex:
+        z += spacing / 2.
+      self.values[file] = {
+        "0020,000E": "1.2.3.4",
+        "0008,103E": "Synthetic",
+        "0020,0011": "7",
+        "0020,0032": "-150.0\\-160.5\\%g" % z,
+        "0020,0037": "1\\0\\0\\0\\1\\0",
+        "7FE0,0010": "1",
+        }
+    random.Random(0).shuffle(self.files)
+
+  def filesForSeries(self, seriesUID):
+    return self.files
+
+  def fileValue(self, file, tag):
+    self.numberOfFileValueCalls += 1
+    return self.values[file].get(tag.upper(), "")
+
+class DICOMScalarVolumePluginExamineTest(unittest.TestCase):
+
+  def setUp(self):
+    self.originalDatabase = slicer.dicomDatabase
+
+  def tearDown(self):
+    slicer.dicomDatabase = self.originalDatabase
+
+  def examine(self, database):
+    slicer.dicomDatabase = database
+    plugin = DICOMScalarVolumePluginClass()
+    return plugin.examineFiles(database.files)
+
+  def test_SortedEquallySpacedSeries(self):
+    database = SyntheticDICOMDatabase(100)
+    loadables = self.examine(database)
+    self.assertEqual(len(loadables), 1)
+    self.assertEqual(loadables[0].name, "7: Synthetic")
+    sliceLocation = lambda file: float(database.values[file]["0020,0032"].split('\\')[2])
+    self.assertEqual(loadables[0].files, sorted(database.files, key=sliceLocation))
+    self.assertEqual(loadables[0].warning, "")
+
+  def test_UnequalSpacing(self):
+    database = SyntheticDICOMDatabase(100, displacedFileIndex=40)
+    loadables = self.examine(database)
+    self.assertTrue("Images are not equally spaced" in loadables[0].warning)
+
+  def test_MergeSeparatelyExaminedFileLists(self):
+    database = SyntheticDICOMDatabase(100)
+    slicer.dicomDatabase = database
+    fileLists = [database.files[:30], database.files[30:60], database.files[60:]]
+    plugin = DICOMScalarVolumePluginClass()
+    self.assertTrue(plugin.canExamineConcurrently)
+    plugin.loadableCache = DICOMLoadableCache()
+    combined = plugin.examineForImport(fileLists)
+    plugin.loadableCache = DICOMLoadableCache()
+    merged = plugin.mergeLoadables([plugin.examineForImport([fileList]) for fileList in fileLists])
+    self.assertEqual([(loadable.name, loadable.files) for loadable in merged],
+                     [(loadable.name, loadable.files) for loadable in combined])
+
+  def test_ExamineFromPrefetchedTags(self):
+    database = SyntheticDICOMDatabase(100, displacedFileIndex=40)
+    expected = self.examine(database)
+    plugin = DICOMScalarVolumePluginClass()
+    plugin.prefetchedDatabase = plugin.prefetchTags(database.files)
+    # worker threads must not use the database
+    slicer.dicomDatabase = None
+    loadables = plugin.examineFiles(database.files)
+    self.assertEqual([(loadable.name, loadable.files, loadable.warning) for loadable in loadables],
+                     [(loadable.name, loadable.files, loadable.warning) for loadable in expected])
+
+  def test_ExaminePerformance(self):
+    numberOfFiles = 5000
+    database = SyntheticDICOMDatabase(numberOfFiles)
+    loadables = self.examine(database)
+    self.assertEqual(len(loadables[0].files), numberOfFiles)
+    # each of the 7 distinct examination tags is queried once per file, and
+    # the series description, series number and number of frames once
+    self.assertEqual(database.numberOfFileValueCalls, 7 * numberOfFiles + 3)
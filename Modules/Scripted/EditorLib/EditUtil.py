@@ -304,6 +304,15 @@ class EditUtil(object):
     volumeNode.GetImageData().Modified()
     volumeNode.Modified()
 
+  @staticmethod
+  def volumeArray(volumeNode):
+    """numpy array sharing the voxels of the volume node"""
+    import vtk.util.numpy_support
+    imageData = volumeNode.GetImageData()
+    shape = list(imageData.GetDimensions())
+    shape.reverse()
+    return vtk.util.numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(shape)
+
   @staticmethod
   def structureVolume(masterNode, structureName, mergeVolumePostfix="-label"):
     """Return the per-structure volume associated with the master node for the given
@@ -332,75 +341,117 @@ class EditUtil(object):
 
     colorNode = mergeNode.GetDisplayNode().GetColorNode()
 
-    accum = vtk.vtkImageAccumulate()
-    accum.SetInputConnection(mergeNode.GetImageDataConnection())
-    accum.Update()
-    lo = int(accum.GetMin()[0])
-    hi = int(accum.GetMax()[0])
-
-    thresholder = vtk.vtkImageThreshold()
-    for index in xrange(lo,hi+1):
-      logging.info( "Splitting label %d..."%index )
-      thresholder.SetInputConnection( mergeNode.GetImageDataConnection() )
-      thresholder.SetInValue( index )
-      thresholder.SetOutValue( 0 )
-      thresholder.ReplaceInOn()
-      thresholder.ReplaceOutOn()
-      thresholder.ThresholdBetween( index, index )
-      thresholder.SetOutputScalarType( mergeNode.GetImageData().GetScalarType() )
-      thresholder.Update()
-      if thresholder.GetOutput().GetScalarRange() != (0.0, 0.0):
-        structureName = colorNode.GetColorName(index)
-        logging.info( "Creating structure volume %s..."%structureName )
-        structureVolume = EditUtil.structureVolume( masterNode, structureName )
-        if not structureVolume:
-          EditUtil.addStructure( masterNode, mergeNode, index )
-        structureVolume = EditUtil.structureVolume( masterNode, structureName )
-        structureVolume.GetImageData().DeepCopy( thresholder.GetOutput() )
-        EditUtil.markVolumeNodeAsModified(structureVolume)
+    mergeImage = mergeNode.GetImageData()
+    mergeArray = EditUtil.volumeArray(mergeNode)
+
+    for index, extent in EditUtil.labelExtents(mergeArray):
+      structureName = colorNode.GetColorName(index)
+      logging.info( "Creating structure volume %s..."%structureName )
+      structureVolume = EditUtil.structureVolume( masterNode, structureName )
+      if not structureVolume:
+        EditUtil.addStructure( masterNode, mergeNode, index )
+      structureVolume = EditUtil.structureVolume( masterNode, structureName )
+      # the structure volumes keep the geometry of the merge volume,
+      # but only the bounding box of the label has to be filled
+      structureImage = structureVolume.GetImageData()
+      structureImage.CopyStructure( mergeImage )
+      structureImage.AllocateScalars( mergeImage.GetScalarType(), 1 )
+      structureArray = EditUtil.volumeArray(structureVolume)
+      structureArray.fill(0)
+      structureArray[extent][mergeArray[extent] == index] = index
+      EditUtil.markVolumeNodeAsModified(structureVolume)
+
+  @staticmethod
+  def labelExtents(labelArray):
+    """Return a list of (label, extent) for the non zero labels of the
+    array, where extent is the bounding box of the label as a tuple of
+    slices, computed in a single pass over the array
+    """
+    import numpy
+    flatLabels = labelArray.ravel()
+    nonZero = numpy.flatnonzero(flatLabels)
+    if nonZero.size == 0:
+      return []
+    # group the voxels by label, keeping the first voxel of each label
+    labels = flatLabels[nonZero]
+    order = numpy.argsort(labels, kind='mergesort')
+    labels = labels[order]
+    starts = numpy.concatenate(([0], numpy.flatnonzero(labels[1:] != labels[:-1]) + 1))
+    coordinates = numpy.unravel_index(nonZero[order], labelArray.shape)
+    lows = [numpy.minimum.reduceat(c, starts) for c in coordinates]
+    highs = [numpy.maximum.reduceat(c, starts) for c in coordinates]
+    return [(int(labels[start]), tuple(slice(int(low[i]), int(high[i]) + 1) for low, high in zip(lows, highs)))
+            for i, start in enumerate(starts)]
 
 class UndoRedo(object):
-  """ Code to manage a list of undo/redo volumes
-  stored in a compressed format using the vtkImageStash
-  class to compress label maps in a thread
+  """ Code to manage a list of undo/redo check points.
+  Instead of a copy of the whole label volume, each check point
+  only stores the box of voxels that an edit changed, compressed
+  in a thread. The oldest check points are dropped when there are
+  more than undoSize of them or when they use more than memoryBudget
+  bytes.
+  To find the changed box, trackedArrays keeps one uncompressed full
+  copy of each volume that was edited, so the memory used is the size
+  of these volumes on top of the check points. These copies are not
+  counted in memoryBudget and are kept as long as this object is.
+  When the dimensions of a volume change (e.g. it was resampled), all
+  its check points are dropped, since their boxes no longer fit.
   """
 
   class checkPoint(object):
     """Internal class to store one checkpoint
-    step consisting of the stashed data
-    and the volumeNode it corresponds to
+    step consisting of the voxel values of a box of the
+    volumeNode it corresponds to. It is restored relative
+    to the state the volume had when the next check point
+    was taken. A check point without box (extent is None)
+    is the current state, until the next edit gives its box.
     """
-    def __init__(self,volumeNode):
+    def __init__(self,volumeNode,extent=None,values=None):
+      import threading
       self.volumeNode = volumeNode
-      self.stashImage = vtk.vtkImageData()
-      self.stash = slicer.vtkImageStash()
-      self.stashImage.DeepCopy( volumeNode.GetImageData() )
-      self.stash.SetStashImage( self.stashImage )
-      self.stash.ThreadedStash()
-
-    def restore(self):
-      """Unstash the volume but first check that the
-      stash operation is not still ongoing in the other thread.
-      TODO: the stash operation is determinisitic, so there's
-      no chance of a deadlock here, but it would still be better
-      to integrate the wait into the event queue to avoid locking
-      the interface.  In practice this would only happen if the user
-      clicks Undo while the thread is still executing, which is
-      unlikely.  And at worst this busy loop will consume two threads
-      (this one and the stashing one) for the time the stash takes to complete.
+      self.extent = extent
+      self.shape = None
+      self.dtype = None
+      self.data = None
+      self.nbytes = 0
+      self.compressed = threading.Event()
+      if values is None:
+        self.compressed.set()
+        return
+      self.shape = values.shape
+      self.dtype = values.dtype
+      self.data = values.tostring()
+      self.nbytes = len(self.data)
+      thread = threading.Thread(target=self.compress)
+      thread.daemon = True
+      thread.start()
+
+    def compress(self):
+      import zlib
+      self.data = zlib.compress(self.data, 1)
+      self.nbytes = len(self.data)
+      self.compressed.set()
+
+    def values(self):
+      """Uncompress the voxel values of the box, but first wait
+      for the compression thread if it is still running.
       """
-      while self.stash.GetStashing():
-        pass
-      self.stash.Unstash()
-      self.volumeNode.GetImageData().DeepCopy( self.stashImage )
-      EditUtil().markVolumeNodeAsModified(self.volumeNode)
+      import numpy, zlib
+      if self.extent is None:
+        return None
+      self.compressed.wait()
+      return numpy.frombuffer(zlib.decompress(self.data), dtype=self.dtype).reshape(self.shape)
 
 
-  def __init__(self,undoSize=100):
+  def __init__(self,undoSize=100,memoryBudget=512*1024*1024):
     self.enabled = True
     self.undoSize = undoSize
+    self.memoryBudget = memoryBudget
     self.undoList = []
     self.redoList = []
+    # volume node ID -> uncompressed full copy of the voxels as of the
+    # last check point of the volume, one for each edited volume
+    self.trackedArrays = {}
     self.stateChangedCallback = self.defaultStateChangedCallback
 
   def defaultStateChangedCallback(self):
@@ -417,19 +468,134 @@ class UndoRedo(object):
     """for managing undo/redo button state"""
     return self.enabled and self.redoList != []
 
+  @staticmethod
+  def changedExtent(array,otherArray):
+    """Smallest box, as a tuple of slices, containing the voxels
+    that differ between the two arrays, or None if they are equal
+    """
+    import numpy
+    changed = array != otherArray
+    extent = []
+    for axis in range(changed.ndim):
+      otherAxes = tuple(a for a in range(changed.ndim) if a != axis)
+      indices = numpy.flatnonzero(changed.any(axis=otherAxes))
+      if indices.size == 0:
+        return None
+      extent.append(slice(indices[0], indices[-1] + 1))
+      # look for the other axes only inside the box found so far
+      changed = changed[(slice(None),) * axis + (extent[axis],)]
+    return tuple(extent)
+
+  @staticmethod
+  def unionExtent(extent,otherExtent):
+    if extent is None:
+      return otherExtent
+    if otherExtent is None:
+      return extent
+    return tuple(slice(min(a.start, b.start), max(a.stop, b.stop)) for a, b in zip(extent, otherExtent))
+
+  def trackedArray(self,volumeNode,array):
+    """The copy of the voxels of the volume node as of its last
+    check point, or None if the volume got a new geometry since
+    then (and so its check points no longer apply).
+    """
+    trackedArray = self.trackedArrays.get(volumeNode.GetID())
+    if trackedArray is not None and trackedArray.shape == array.shape and trackedArray.dtype == array.dtype:
+      return trackedArray
+    self.trackedArrays[volumeNode.GetID()] = array.copy()
+    if trackedArray is None:
+      return self.trackedArrays[volumeNode.GetID()]
+    return None
+
   def storeVolume(self,checkPointList,volumeNode):
     """ Internal helper function
-    Save a stashed copy of the given volume node into
-    the passed list (could be undo or redo list)
+    Add a check point for the current state of the given volume
+    node at the end of the passed list (could be undo or redo list).
+    The previous check point of the same volume gets the box of
+    voxels changed since then.
     """
     if not self.enabled or not volumeNode or not volumeNode.GetImageData():
-      return
+      return checkPointList
+    array = EditUtil.volumeArray(volumeNode)
+    trackedArray = self.trackedArray(volumeNode,array)
+    if trackedArray is None:
+      logging.warning('UndoRedo: the geometry of %s changed, dropping its check points' % volumeNode.GetName())
+      checkPointList = self.dropCheckPoints(checkPointList,volumeNode)
+      trackedArray = self.trackedArrays[volumeNode.GetID()]
+    extent = self.changedExtent(array,trackedArray)
+    if extent is not None:
+      self.rebaseCheckPoint(checkPointList,volumeNode,trackedArray,extent)
+      trackedArray[extent] = array[extent]
     checkPointList.append( self.checkPoint(volumeNode) )
-    self.stateChangedCallback()
+    return self.evict(checkPointList)
+
+  def dropCheckPoints(self,checkPointList,volumeNode):
+    """ Internal helper function
+    Remove all the check points of the volume node from the undo
+    and redo lists and from the passed list, which is returned.
+    Their boxes refer to a previous geometry of the volume.
+    """
+    keep = lambda checkPoints: [c for c in checkPoints if c.volumeNode != volumeNode]
+    self.undoList = keep(self.undoList)
+    self.redoList = keep(self.redoList)
+    return keep(checkPointList)
+
+  def rebaseCheckPoint(self,checkPointList,volumeNode,trackedArray,extent):
+    """ Internal helper function
+    The last check point of the volume in the list is relative to
+    the tracked array. Make it relative to the current volume, which
+    differs from the tracked array in the given extent.
+    """
+    previous = [i for i, c in enumerate(checkPointList) if c.volumeNode == volumeNode]
+    if not previous:
+      return
+    # the check point state is the tracked array with its own box pasted
+    last = checkPointList[previous[-1]]
+    box = self.unionExtent(extent,last.extent)
+    values = trackedArray[box].copy()
+    if last.extent is not None:
+      values[tuple(slice(l.start - b.start, l.stop - b.start) for l, b in zip(last.extent, box))] = last.values()
+    checkPointList[previous[-1]] = self.checkPoint(volumeNode,box,values)
+
+  def evict(self,checkPointList):
+    """Drop the oldest check points beyond undoSize or the memory budget"""
     if len(checkPointList) >= self.undoSize:
-      return( checkPointList[1:] )
+      checkPointList = checkPointList[1:]
+    while len(checkPointList) > 1 and sum(c.nbytes for c in checkPointList) > self.memoryBudget:
+      checkPointList = checkPointList[1:]
+    return checkPointList
+
+  def restore(self,checkPoint,checkPointList):
+    """ Internal helper function
+    Set the volume of the check point back to its state, after
+    adding the current state at the end of the passed list (the
+    redo list for an undo, the undo list for a redo). The check
+    point must already be removed from its list.
+    """
+    volumeNode = checkPoint.volumeNode
+    if not volumeNode or not volumeNode.GetImageData():
+      return checkPointList
+    array = EditUtil.volumeArray(volumeNode)
+    trackedArray = self.trackedArray(volumeNode,array)
+    if trackedArray is None:
+      logging.warning('UndoRedo: the geometry of %s changed, dropping its check points' % volumeNode.GetName())
+      return self.dropCheckPoints(checkPointList,volumeNode)
+    # voxels changed since the last check point are reverted too
+    extent = self.changedExtent(array,trackedArray)
+    box = self.unionExtent(extent,checkPoint.extent)
+    if extent is not None:
+      self.rebaseCheckPoint(checkPointList,volumeNode,trackedArray,extent)
+    if box is not None:
+      checkPointList.append( self.checkPoint(volumeNode,box,array[box].copy()) )
+      if extent is not None:
+        array[extent] = trackedArray[extent]
+      if checkPoint.extent is not None:
+        array[checkPoint.extent] = checkPoint.values()
+      trackedArray[box] = array[box]
+      EditUtil().markVolumeNodeAsModified(volumeNode)
     else:
-      return( checkPointList )
+      checkPointList.append( self.checkPoint(volumeNode) )
+    return self.evict(checkPointList)
 
   def saveState(self):
     """Called by effects as they modify the label volume node
@@ -443,15 +609,14 @@ class UndoRedo(object):
     """Perform the operation when the user presses
     the undo button on the editor interface.
     This pushes the current state onto the redoList and
-    removes a volume from the undoList.
+    removes a check point from the undoList.
     """
     if self.undoList == []:
       return
-    # store current state onto redoList
-    self.redoList = self.storeVolume( self.redoList, EditUtil.getLabelVolume() )
-    # get the checkPoint to restore and remove it from the list
-    self.undoList[-1].restore()
+    # store current state onto redoList and restore the last checkPoint
+    checkPoint = self.undoList[-1]
     self.undoList = self.undoList[:-1]
+    self.redoList = self.restore( checkPoint, self.redoList )
     self.stateChangedCallback()
 
   def redo(self):
@@ -462,9 +627,8 @@ class UndoRedo(object):
     """
     if self.redoList == []:
       return
-    # store current state onto undoList
-    self.undoList = self.storeVolume( self.undoList, EditUtil.getLabelVolume() )
-    # get the checkPoint to restore and remove it from the list
-    self.redoList[-1].restore()
+    # store current state onto undoList and restore the last checkPoint
+    checkPoint = self.redoList[-1]
     self.redoList = self.redoList[:-1]
+    self.undoList = self.restore( checkPoint, self.undoList )
     self.stateChangedCallback()
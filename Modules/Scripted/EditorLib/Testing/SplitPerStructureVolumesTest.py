@@ -0,0 +1,126 @@
+import unittest
+import numpy
+import vtk
+import slicer
+from EditorLib.EditUtil import EditUtil
+
+class SplitPerStructureVolumesTesting(unittest.TestCase):
+  def setUp(self):
+    slicer.mrmlScene.Clear(0)
+
+  def runTest(self):
+    self.setUp()
+    self.test_LabelExtents()
+    self.setUp()
+    self.test_SplitPerStructureVolumes()
+
+  def createMergeVolume(self, dimensions):
+    """Return a master volume and its merge label volume, with the given dimensions"""
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(dimensions)
+    imageData.AllocateScalars(vtk.VTK_SHORT, 1)
+    imageData.GetPointData().GetScalars().Fill(0)
+    masterNode = slicer.vtkMRMLScalarVolumeNode()
+    masterNode.SetName('master')
+    masterNode.SetAndObserveImageData(imageData)
+    slicer.mrmlScene.AddNode(masterNode)
+    volumesLogic = slicer.modules.volumes.logic()
+    mergeNode = volumesLogic.CreateAndAddLabelVolume(slicer.mrmlScene, masterNode, 'master-label')
+    return masterNode, mergeNode
+
+  def fillMergeArray(self, mergeArray):
+    """Labels of several shapes, one of them in two separate pieces
+    whose bounding box holds voxels of another label"""
+    mergeArray[2:5, 3:9, 1:4] = 1
+    mergeArray[6:8, 0:2, 5:11] = 2
+    mergeArray[0, 0, 0] = 2
+    mergeArray[4:7, 5:7, 8:10] = 5
+    mergeArray[3, 1, 3] = 5
+    mergeArray[9, 11, 10] = 7
+
+  def test_LabelExtents(self):
+    """The extent of each label is the bounding box of its voxels"""
+    mergeArray = numpy.zeros((10, 12, 11), dtype=numpy.int16)
+    self.assertEqual(EditUtil.labelExtents(mergeArray), [])
+    self.fillMergeArray(mergeArray)
+
+    extents = EditUtil.labelExtents(mergeArray)
+    self.assertEqual([label for label, extent in extents], [1, 2, 5, 7])
+    for label, extent in extents:
+      coordinates = numpy.nonzero(mergeArray == label)
+      self.assertEqual(extent, tuple(slice(c.min(), c.max() + 1) for c in coordinates))
+
+  def test_SplitPerStructureVolumes(self):
+    """Each structure volume has the voxels of its label in the merge volume"""
+    masterNode, mergeNode = self.createMergeVolume((11, 12, 10))
+    mergeArray = EditUtil.volumeArray(mergeNode)
+    self.fillMergeArray(mergeArray)
+    EditUtil.markVolumeNodeAsModified(mergeNode)
+
+    # splitting again reuses the structure volumes
+    for split in range(2):
+      EditUtil.splitPerStructureVolumes(masterNode, mergeNode)
+
+      colorNode = mergeNode.GetDisplayNode().GetColorNode()
+      structureVolumes = slicer.util.getNodes('master-*-label').values()
+      self.assertEqual(len(structureVolumes), 4)
+      for label in (1, 2, 5, 7):
+        structureVolume = EditUtil.structureVolume(masterNode, colorNode.GetColorName(label))
+        self.assertTrue(structureVolume)
+        self.assertEqual(structureVolume.GetImageData().GetDimensions(), mergeNode.GetImageData().GetDimensions())
+        structureArray = EditUtil.volumeArray(structureVolume)
+        self.assertEqual(structureArray.shape, mergeArray.shape)
+        self.assertTrue((structureArray == numpy.where(mergeArray == label, label, 0)).all())
+
+#
+# SplitPerStructureVolumesTest
+#
+
+class SplitPerStructureVolumesTest:
+  """
+  This class is the 'hook' for slicer to detect and recognize the test
+  as a loadable scripted module (with a hidden interface)
+  """
+  def __init__(self, parent):
+    parent.title = "SplitPerStructureVolumesTest"
+    parent.categories = ["Testing"]
+    parent.contributors = ["Steve Pieper (Isomics Inc.)"]
+    parent.helpText = """
+    Test of the split of a merge volume into per-structure volumes.
+    No module interface here, only used in SelfTests module
+    """
+    parent.acknowledgementText = """
+    """
+
+    # don't show this module
+    parent.hidden = True
+
+    try:
+      slicer.selfTests
+    except AttributeError:
+      slicer.selfTests = {}
+    slicer.selfTests['SplitPerStructureVolumesTest'] = self.runTest
+
+  def runTest(self):
+    tester = SplitPerStructureVolumesTesting()
+    tester.setUp()
+    tester.runTest()
+
+
+#
+# SplitPerStructureVolumesTestWidget
+#
+
+class SplitPerStructureVolumesTestWidget:
+  def __init__(self, parent = None):
+    self.parent = parent
+
+  def setup(self):
+    # don't display anything for this widget - it will be hidden anyway
+    pass
+
+  def enter(self):
+    pass
+
+  def exit(self):
+    pass
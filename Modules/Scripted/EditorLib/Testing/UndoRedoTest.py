@@ -0,0 +1,278 @@
+import unittest
+import numpy
+import vtk
+import slicer
+from EditorLib.EditUtil import EditUtil
+from EditorLib.EditUtil import UndoRedo
+
+class UndoRedoTesting(unittest.TestCase):
+  def setUp(self):
+    slicer.mrmlScene.Clear(0)
+    numpy.random.seed(0)
+
+  def runTest(self):
+    self.setUp()
+    self.test_UndoRedoTwoVolumes()
+    self.setUp()
+    self.test_UndoRedoUnsavedEdits()
+    self.setUp()
+    self.test_UndoRedoUndoSizeEviction()
+    self.setUp()
+    self.test_UndoRedoMemoryBudgetEviction()
+    self.setUp()
+    self.test_UndoRedoGeometryChange()
+
+  def createLabelVolume(self, name, dimensions):
+    volumeNode = slicer.vtkMRMLLabelMapVolumeNode()
+    volumeNode.SetName(name)
+    slicer.mrmlScene.AddNode(volumeNode)
+    self.setDimensions(volumeNode, dimensions)
+    return volumeNode
+
+  def setDimensions(self, volumeNode, dimensions):
+    """Replace the voxels of the volume by zeros of the given dimensions,
+    as resampling the label volume would"""
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(dimensions)
+    imageData.AllocateScalars(vtk.VTK_SHORT, 1)
+    imageData.GetPointData().GetScalars().Fill(0)
+    volumeNode.SetAndObserveImageData(imageData)
+
+  def saveState(self, undoRedo, volumeNode):
+    """Save a check point the way the effects do, with volumeNode as the label volume"""
+    EditUtil.getCompositeNode().SetLabelVolumeID(volumeNode.GetID())
+    undoRedo.saveState()
+
+  def edit(self, volumeNode, box, value):
+    """Set the voxels of box to value and return a copy of the edited voxels"""
+    EditUtil.volumeArray(volumeNode)[box] = value
+    EditUtil.markVolumeNodeAsModified(volumeNode)
+    return EditUtil.volumeArray(volumeNode).copy()
+
+  def assertVolumeEqual(self, volumeNode, expected):
+    array = EditUtil.volumeArray(volumeNode)
+    self.assertEqual(array.shape, expected.shape)
+    self.assertTrue((array == expected).all())
+
+  def test_UndoRedoTwoVolumes(self):
+    """Undo and redo edits of two label volumes in turn"""
+    undoRedo = UndoRedo()
+    volumeA = self.createLabelVolume('A', (10, 12, 8))
+    volumeB = self.createLabelVolume('B', (6, 5, 4))
+    statesA = [EditUtil.volumeArray(volumeA).copy()]
+    statesB = [EditUtil.volumeArray(volumeB).copy()]
+
+    self.saveState(undoRedo, volumeA)
+    statesA.append(self.edit(volumeA, numpy.s_[2:5, 3:9, 1:4], 1))
+    self.saveState(undoRedo, volumeB)
+    statesB.append(self.edit(volumeB, numpy.s_[1:3, :, 2:], 2))
+    self.saveState(undoRedo, volumeA)
+    statesA.append(self.edit(volumeA, numpy.s_[4:8, 0:2, 5:8], 3))
+    self.assertEqual(len(undoRedo.undoList), 3)
+    # the first check point only keeps the box changed by the first edit
+    self.assertEqual(undoRedo.undoList[0].extent, numpy.s_[2:5, 3:9, 1:4])
+
+    undoRedo.undo()
+    self.assertVolumeEqual(volumeA, statesA[1])
+    self.assertVolumeEqual(volumeB, statesB[1])
+    undoRedo.undo()
+    self.assertVolumeEqual(volumeA, statesA[1])
+    self.assertVolumeEqual(volumeB, statesB[0])
+    undoRedo.undo()
+    self.assertVolumeEqual(volumeA, statesA[0])
+    self.assertVolumeEqual(volumeB, statesB[0])
+    self.assertFalse(undoRedo.undoEnabled())
+
+    undoRedo.redo()
+    self.assertVolumeEqual(volumeA, statesA[1])
+    self.assertVolumeEqual(volumeB, statesB[0])
+    undoRedo.redo()
+    self.assertVolumeEqual(volumeB, statesB[1])
+    undoRedo.redo()
+    self.assertVolumeEqual(volumeA, statesA[2])
+    self.assertVolumeEqual(volumeB, statesB[1])
+    self.assertFalse(undoRedo.redoEnabled())
+
+  def test_UndoRedoUnsavedEdits(self):
+    """Edits made without a check point are undone with the previous edit"""
+    undoRedo = UndoRedo()
+    volume = self.createLabelVolume('A', (8, 8, 8))
+    original = EditUtil.volumeArray(volume).copy()
+
+    self.saveState(undoRedo, volume)
+    self.edit(volume, numpy.s_[1:3, 1:3, 1:3], 1)
+    # e.g. an edit from another module
+    edited = self.edit(volume, numpy.s_[5:7, :, 6:8], 2)
+    undoRedo.undo()
+    self.assertVolumeEqual(volume, original)
+    undoRedo.redo()
+    self.assertVolumeEqual(volume, edited)
+
+    # an unsaved edit after an undo is kept on the redo list
+    self.saveState(undoRedo, volume)
+    secondEdit = self.edit(volume, numpy.s_[0:4, 0:4, 0:4], 3)
+    undoRedo.undo()
+    self.assertVolumeEqual(volume, edited)
+    unsavedEdit = self.edit(volume, numpy.s_[7:8, 7:8, :], 4)
+    undoRedo.undo()
+    self.assertVolumeEqual(volume, original)
+    undoRedo.redo()
+    self.assertVolumeEqual(volume, unsavedEdit)
+    undoRedo.redo()
+    self.assertVolumeEqual(volume, secondEdit)
+
+  def test_UndoRedoUndoSizeEviction(self):
+    """Only the last check points are kept beyond undoSize"""
+    undoSize = 3
+    undoRedo = UndoRedo(undoSize=undoSize)
+    volume = self.createLabelVolume('A', (8, 8, 8))
+    states = [EditUtil.volumeArray(volume).copy()]
+    for step in range(6):
+      self.saveState(undoRedo, volume)
+      states.append(self.edit(volume, numpy.s_[step:step+2, :, :], step + 1))
+
+    numberOfCheckPoints = len(undoRedo.undoList)
+    self.assertTrue(0 < numberOfCheckPoints <= undoSize)
+    while undoRedo.undoEnabled():
+      undoRedo.undo()
+    self.assertVolumeEqual(volume, states[-1 - numberOfCheckPoints])
+    for step in range(numberOfCheckPoints):
+      undoRedo.redo()
+    self.assertVolumeEqual(volume, states[-1])
+
+  def test_UndoRedoMemoryBudgetEviction(self):
+    """Older check points are dropped when they use more than memoryBudget"""
+    undoRedo = UndoRedo(memoryBudget=1)
+    volume = self.createLabelVolume('A', (16, 16, 16))
+    states = [EditUtil.volumeArray(volume).copy()]
+    for step in range(4):
+      self.saveState(undoRedo, volume)
+      noise = numpy.random.randint(1, 100, size=(4, 16, 16))
+      states.append(self.edit(volume, numpy.s_[4*step:4*step+4, :, :], noise))
+
+    # only the last check point, which does not store any voxels yet, fits
+    self.assertEqual(len(undoRedo.undoList), 1)
+    undoRedo.undo()
+    self.assertVolumeEqual(volume, states[-2])
+    self.assertFalse(undoRedo.undoEnabled())
+
+    # with the default budget, all the check points are kept
+    undoRedo = UndoRedo()
+    for step in range(4):
+      self.saveState(undoRedo, volume)
+      self.edit(volume, numpy.s_[4*step:4*step+4, :, :], step)
+    self.assertEqual(len(undoRedo.undoList), 4)
+
+  def test_UndoRedoGeometryChange(self):
+    """Check points of a volume are dropped when its dimensions change"""
+    undoRedo = UndoRedo()
+    volumeA = self.createLabelVolume('A', (6, 6, 6))
+    volumeB = self.createLabelVolume('B', (4, 4, 4))
+    originalB = EditUtil.volumeArray(volumeB).copy()
+
+    self.saveState(undoRedo, volumeB)
+    editedB = self.edit(volumeB, numpy.s_[1:3, :, :], 1)
+    self.saveState(undoRedo, volumeA)
+    self.edit(volumeA, numpy.s_[0:2, :, :], 1)
+
+    self.setDimensions(volumeA, (5, 7, 3))
+    resampledA = self.edit(volumeA, numpy.s_[:, 2:4, :], 2)
+    self.saveState(undoRedo, volumeA)
+    editedA = self.edit(volumeA, numpy.s_[1:2, :, :], 3)
+    self.assertEqual([checkPoint.volumeNode.GetID() for checkPoint in undoRedo.undoList],
+                     [volumeB.GetID(), volumeA.GetID()])
+
+    undoRedo.undo()
+    self.assertVolumeEqual(volumeA, resampledA)
+    undoRedo.undo()
+    self.assertVolumeEqual(volumeB, originalB)
+    undoRedo.redo()
+    self.assertVolumeEqual(volumeB, editedB)
+    undoRedo.redo()
+    self.assertVolumeEqual(volumeA, editedA)
+
+    # a check point taken before a geometry change is not restored
+    self.saveState(undoRedo, volumeA)
+    self.setDimensions(volumeA, (6, 6, 6))
+    resampledA = self.edit(volumeA, numpy.s_[2:3, :, :], 4)
+    undoRedo.undo()
+    self.assertVolumeEqual(volumeA, resampledA)
+
+    # nor are the older check points of the volume, whose boxes do not fit
+    # the new geometry, while the check points of other volumes are kept
+    for dimensions in ((6, 6, 6), (6, 5, 3)):
+      undoRedo = UndoRedo()
+      self.setDimensions(volumeA, (4, 4, 4))
+      self.setDimensions(volumeB, (4, 4, 4))
+      originalB = EditUtil.volumeArray(volumeB).copy()
+      self.saveState(undoRedo, volumeB)
+      editedB = self.edit(volumeB, numpy.s_[0:1, :, :], 1)
+      for step in range(3):
+        self.saveState(undoRedo, volumeA)
+        self.edit(volumeA, numpy.s_[step:step+2, :, :], step + 2)
+      self.setDimensions(volumeA, dimensions)
+      resampledA = self.edit(volumeA, numpy.s_[0:1, :, :], 5)
+
+      undoRedo.undo()
+      self.assertVolumeEqual(volumeA, resampledA)
+      self.assertEqual([checkPoint.volumeNode.GetID() for checkPoint in undoRedo.undoList], [volumeB.GetID()])
+      self.assertFalse(undoRedo.redoEnabled())
+      undoRedo.undo()
+      self.assertVolumeEqual(volumeA, resampledA)
+      self.assertVolumeEqual(volumeB, originalB)
+      undoRedo.redo()
+      self.assertVolumeEqual(volumeB, editedB)
+      self.assertFalse(undoRedo.redoEnabled())
+
+#
+# UndoRedoTest
+#
+
+class UndoRedoTest:
+  """
+  This class is the 'hook' for slicer to detect and recognize the test
+  as a loadable scripted module (with a hidden interface)
+  """
+  def __init__(self, parent):
+    parent.title = "UndoRedoTest"
+    parent.categories = ["Testing"]
+    parent.contributors = ["Steve Pieper (Isomics Inc.)"]
+    parent.helpText = """
+    Test of the editor undo and redo check points.
+    No module interface here, only used in SelfTests module
+    """
+    parent.acknowledgementText = """
+    """
+
+    # don't show this module
+    parent.hidden = True
+
+    try:
+      slicer.selfTests
+    except AttributeError:
+      slicer.selfTests = {}
+    slicer.selfTests['UndoRedoTest'] = self.runTest
+
+  def runTest(self):
+    tester = UndoRedoTesting()
+    tester.setUp()
+    tester.runTest()
+
+
+#
+# UndoRedoTestWidget
+#
+
+class UndoRedoTestWidget:
+  def __init__(self, parent = None):
+    self.parent = parent
+
+  def setup(self):
+    # don't display anything for this widget - it will be hidden anyway
+    pass
+
+  def enter(self):
+    pass
+
+  def exit(self):
+    pass
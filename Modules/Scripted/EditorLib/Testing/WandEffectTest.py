@@ -0,0 +1,158 @@
+import collections
+import time
+import unittest
+import numpy
+import slicer
+import EditorLib
+
+class WandEffectTesting(unittest.TestCase):
+  def setUp(self):
+    numpy.random.seed(0)
+
+  def runTest(self):
+    self.test_WandEffectFloodFill()
+    self.test_WandEffectFloodFillNonContiguous()
+
+  def referenceFill(self, backgroundArray, labelArray, seed, label, lo, hi, paintOver, maxPixels):
+    """The pixel by pixel breadth first fill WandEffectLogic.apply
+    used before floodFill, with the border checks made explicit.
+    """
+    visited = numpy.zeros(labelArray.shape, dtype='bool')
+    pixelsSet = 0
+    toVisit = collections.deque([tuple(seed)])
+    while toVisit:
+      location = toVisit.popleft()
+      if any(c < 0 or c >= s for c, s in zip(location, labelArray.shape)):
+        continue
+      l = labelArray[location]
+      b = backgroundArray[location]
+      if not paintOver and l != 0:
+        continue
+      if paintOver and l == label:
+        if visited[location]:
+          continue
+        visited[location] = True
+      if b < lo or b > hi:
+        continue
+      labelArray[location] = label
+      if l != label:
+        pixelsSet += 1
+      if pixelsSet > maxPixels:
+        break
+      for d in range(len(location)):
+        for step in (-1, 1):
+          neighbor = list(location)
+          neighbor[d] += step
+          toVisit.append(tuple(neighbor))
+    return pixelsSet
+
+  def compareFills(self, shape, paintOver, maxPixels):
+    """Fill a noisy background with a few labeled pixels in the way with
+    floodFill and with the reference, and return the time each took"""
+    backgroundArray = numpy.where(numpy.random.rand(*shape) < 0.9, 50, 0).astype('int16')
+    labelArray = numpy.where(numpy.random.rand(*shape) < 0.05, 2, 0).astype('int16')
+    seed = tuple(s // 2 for s in shape)
+    backgroundArray[seed] = 50
+    labelArray[seed] = 0
+
+    referenceArray = labelArray.copy()
+    startTime = time.time()
+    referenceCount = self.referenceFill(backgroundArray, referenceArray, seed, 1, 40, 60, paintOver, maxPixels)
+    referenceTime = time.time() - startTime
+
+    fillArray = labelArray.copy()
+    startTime = time.time()
+    fillCount = EditorLib.WandEffectLogic.floodFill(backgroundArray, fillArray, seed, 1, 40, 60, paintOver, maxPixels)
+    fillTime = time.time() - startTime
+
+    self.assertEqual(fillCount, referenceCount)
+    if maxPixels == float('inf'):
+      # with a limit, the pixels of the last layer may be taken in another order
+      self.assertTrue((fillArray == referenceArray).all())
+    return referenceTime, fillTime
+
+  def test_WandEffectFloodFill(self):
+    """
+    Compare WandEffectLogic.floodFill with the previous pixel
+    by pixel fill on small planes and volumes.
+    """
+    for paintOver in (0, 1):
+      self.compareFills((32, 32), paintOver, float('inf'))
+      self.compareFills((32, 32), paintOver, 100)
+      self.compareFills((8, 16, 16), paintOver, float('inf'))
+      self.compareFills((8, 16, 16), paintOver, 500)
+
+  def test_WandEffectFloodFillNonContiguous(self):
+    """Fill a plane of a volume, as the wand does in plane mode"""
+    backgroundArray = numpy.where(numpy.random.rand(8, 16, 16) < 0.9, 50, 0).astype('int16')
+    labelArray = numpy.zeros(backgroundArray.shape, dtype='int16')
+    backgroundArray[:, 4, 8] = 50
+    referenceArray = labelArray.copy()
+    referenceCount = self.referenceFill(backgroundArray[:, 4, :], referenceArray[:, 4, :], (4, 8), 1, 40, 60, 0, float('inf'))
+    fillCount = EditorLib.WandEffectLogic.floodFill(backgroundArray[:, 4, :], labelArray[:, 4, :], (4, 8), 1, 40, 60)
+    self.assertEqual(fillCount, referenceCount)
+    self.assertTrue((labelArray == referenceArray).all())
+
+  def benchmark(self):
+    """Print the time of floodFill and of the reference on larger arrays.
+    Not part of the tests, run it from the Python console with
+    WandEffectTest.WandEffectTesting().benchmark()
+    """
+    for paintOver in (0, 1):
+      for shape, maxPixels in (((256, 256), float('inf')), ((64, 128, 128), 100000)):
+        referenceTime, fillTime = self.compareFills(shape, paintOver, maxPixels)
+        print('%s paintOver %d maxPixels %g: reference %.3f s, floodFill %.3f s' %
+              (shape, paintOver, maxPixels, referenceTime, fillTime))
+
+#
+# WandEffectTest
+#
+
+class WandEffectTest:
+  """
+  This class is the 'hook' for slicer to detect and recognize the test
+  as a loadable scripted module (with a hidden interface)
+  """
+  def __init__(self, parent):
+    parent.title = "WandEffectTest"
+    parent.categories = ["Testing"]
+    parent.contributors = ["Yi Gao"]
+    parent.helpText = """
+    Test of the wand effect fill.
+    No module interface here, only used in SelfTests module
+    """
+    parent.acknowledgementText = """
+    """
+
+    # don't show this module
+    parent.hidden = True
+
+    try:
+      slicer.selfTests
+    except AttributeError:
+      slicer.selfTests = {}
+    slicer.selfTests['WandEffectTest'] = self.runTest
+
+  def runTest(self):
+    tester = WandEffectTesting()
+    tester.setUp()
+    tester.runTest()
+
+
+#
+# WandEffectTestWidget
+#
+
+class WandEffectTestWidget:
+  def __init__(self, parent = None):
+    self.parent = parent
+
+  def setup(self):
+    # don't display anything for this widget - it will be hidden anyway
+    pass
+
+  def enter(self):
+    pass
+
+  def exit(self):
+    pass
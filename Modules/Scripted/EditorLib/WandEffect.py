@@ -307,72 +307,85 @@ class WandEffectLogic(LabelEffect.LabelEffectLogic):
       labelDrawArray = labelArray
 
     #
-    # do a recursive search for pixels to change
+    # fill the pixels connected to the clicked one
     #
     self.undoRedo.saveState()
-    value = backgroundDrawArray[ijk]
     label = self.editUtil.getLabel()
     if paintThreshold:
       lo = thresholdMin
       hi = thresholdMax
     else:
+      value = backgroundDrawArray[ijk]
       lo = value - tolerance
       hi = value + tolerance
-    pixelsSet = 0
-    toVisit = [ijk,]
-    # Create a map that contains the location of the pixels
-    # that have been already visited (added or considered to be added).
-    # This is required if paintOver is enabled because then we reconsider
-    # all pixels (not just the ones that have not labelled yet).
-    if paintOver:
-      labelDrawVisitedArray = numpy.zeros(labelDrawArray.shape,dtype='bool')
-
-    while toVisit != []:
-      location = toVisit.pop(0)
-      try:
-        l = labelDrawArray[location]
-        b = backgroundDrawArray[location]
-      except IndexError:
-        continue
-      if (not paintOver and l != 0):
-        # label filled already and not painting over, leave it alone
-        continue
-      if (paintOver and l == label):
-        # label is the current one, but maybe it was filled with another high/low value,
-        # so we have to visit it once (and only once) in this session, too
-        if  labelDrawVisitedArray[location]:
-          # visited already, so don't try to fill it again
-          continue
-        else:
-          # we'll visit this pixel now, so mark it as visited
-          labelDrawVisitedArray[location] = True
-      if b < lo or b > hi:
-        continue
-      labelDrawArray[location] = label
-      if l != label:
-        # only count those pixels that were changed (to allow step-by-step growing by multiple mouse clicks)
-        pixelsSet += 1
-      if pixelsSet > maxPixels:
-        toVisit = []
-      else:
-        if self.fillMode == 'Plane':
-          # add the 4 neighbors to the stack
-          toVisit.append((location[0] - 1, location[1]     ))
-          toVisit.append((location[0] + 1, location[1]     ))
-          toVisit.append((location[0]    , location[1] - 1 ))
-          toVisit.append((location[0]    , location[1] + 1 ))
-        elif self.fillMode == 'Volume':
-          # add the 6 neighbors to the stack
-          toVisit.append((location[0] - 1, location[1]    , location[2]    ))
-          toVisit.append((location[0] + 1, location[1]    , location[2]    ))
-          toVisit.append((location[0]    , location[1] - 1, location[2]    ))
-          toVisit.append((location[0]    , location[1] + 1, location[2]    ))
-          toVisit.append((location[0]    , location[1]    , location[2] - 1))
-          toVisit.append((location[0]    , location[1]    , location[2] + 1))
+    self.floodFill(backgroundDrawArray, labelDrawArray, ijk, label, lo, hi, paintOver, maxPixels)
 
     # signal to slicer that the label needs to be updated
     self.editUtil.markVolumeNodeAsModified(labelNode)
 
+  @staticmethod
+  def floodFill(backgroundArray, labelArray, seed, label, lo, hi, paintOver=False, maxPixels=float('inf')):
+    """Set to label the pixels of labelArray that are connected to seed
+    (4-connected in 2D, 6-connected in 3D) and whose background value
+    is in [lo, hi]. Pixels that already have a label block the fill
+    unless paintOver is set. The fill grows breadth first, one layer
+    of neighbors at a time, and stops once more than maxPixels pixels
+    have been changed. Each layer is processed with numpy, reading the
+    background and label values of the neighbors of the layer only:
+    a neighbor that is not in the previous or the current layer is in
+    the next one, so no array of the size of the volume is allocated and
+    the cost grows with the number of filled pixels, not with the size
+    of the arrays. Returns the number of changed pixels.
+    """
+    import numpy
+    shape = labelArray.shape
+    seed = tuple(seed)
+    if len(seed) != len(shape) or not all(0 <= seed[d] < shape[d] for d in range(len(shape))):
+      return 0
+
+    def fillable(coordinates):
+      """Whether the fill can go through the pixels at coordinates"""
+      background = backgroundArray[coordinates]
+      result = (background >= lo) & (background <= hi)
+      if not paintOver:
+        result &= (labelArray[coordinates] == 0)
+      return result
+
+    if not fillable(seed):
+      return 0
+
+    strides = [int(numpy.prod(shape[d+1:])) for d in range(len(shape))]
+    previousLayer = numpy.zeros(0, dtype=numpy.int64)
+    layer = numpy.array([numpy.ravel_multi_index(seed, shape)], dtype=numpy.int64)
+
+    pixelsSet = 0
+    while layer.size:
+      coordinates = numpy.unravel_index(layer, shape)
+      # only count those pixels that were changed (to allow step-by-step growing by multiple mouse clicks)
+      changed = labelArray[coordinates] != label
+      changedCount = int(changed.sum())
+      if pixelsSet + changedCount > maxPixels:
+        # keep the layer up to the pixel that goes over the limit
+        last = numpy.searchsorted(numpy.cumsum(changed), int(maxPixels - pixelsSet) + 1)
+        labelArray[numpy.unravel_index(layer[:last + 1], shape)] = label
+        pixelsSet += int(changed[:last + 1].sum())
+        break
+      labelArray[coordinates] = label
+      pixelsSet += changedCount
+
+      # fillable neighbors of the layer in the next layer, not wrapping around the borders
+      neighbors = []
+      for d in range(len(shape)):
+        neighbors.append(layer[coordinates[d] > 0] - strides[d])
+        neighbors.append(layer[coordinates[d] < shape[d] - 1] + strides[d])
+      # a pixel can be the neighbor of several pixels of the layer
+      neighbors = numpy.unique(numpy.concatenate(neighbors))
+      neighbors = neighbors[numpy.in1d(neighbors, numpy.concatenate((previousLayer, layer)), assume_unique=True, invert=True)]
+      neighbors = neighbors[fillable(numpy.unravel_index(neighbors, shape))]
+      previousLayer, layer = layer, neighbors
+
+    return pixelsSet
+
 #
 # The WandEffect class definition
 #
@@ -26,6 +26,7 @@ Clicking "Create path" will make a path model and enable the flythrough panel.
 You can manually scroll through the path with the Frame slider. The Play/Pause button toggles animated flythrough.
 The Frame Skip slider speeds up the animation by skipping points on the path.
 The Frame Delay slider slows down the animation by adding more time between frames.
+The Target Frame Rate slider plays the path at a fixed number of frames per second, skipping frames when rendering cannot keep up.
 The View Angle provides is used to approximate the optics of an endoscopy system.
 """
     self.parent.helpText += self.getDefaultModuleDocumentationLink()
@@ -57,6 +58,13 @@ class EndoscopyWidget(ScriptedLoadableModuleWidget):
     self.timer = qt.QTimer()
     self.timer.setInterval(20)
     self.timer.connect('timeout()', self.flyToNext)
+    self.cameraTrack = None
+    self.transformMatrix = vtk.vtkMatrix4x4()
+    # Frame rate held during playback by skipping frames (0 = play every frame)
+    self.targetFrameRate = 0
+    self.playbackStartTime = None
+    self.playbackStartFrame = 0
+    self.playbackFrame = 0
 
   def setup(self):
     ScriptedLoadableModuleWidget.setup(self)
@@ -137,6 +145,18 @@ class EndoscopyWidget(ScriptedLoadableModuleWidget):
     frameDelaySlider.value = 20
     flythroughFormLayout.addRow("Frame delay:", frameDelaySlider)
 
+    # Target frame rate slider
+    targetFrameRateSlider = ctk.ctkSliderWidget()
+    targetFrameRateSlider.toolTip = "Play the path at this many frames per second, skipping frames if rendering is slower."
+    targetFrameRateSlider.connect('valueChanged(double)', self.targetFrameRateSliderValueChanged)
+    targetFrameRateSlider.decimals = 0
+    targetFrameRateSlider.minimum = 0
+    targetFrameRateSlider.maximum = 200
+    targetFrameRateSlider.suffix = " fps"
+    targetFrameRateSlider.specialValueText = "Off"
+    targetFrameRateSlider.value = 0
+    flythroughFormLayout.addRow("Target frame rate:", targetFrameRateSlider)
+
     # View angle slider
     viewAngleSlider = ctk.ctkSliderWidget()
     viewAngleSlider.connect('valueChanged(double)', self.viewAngleSliderValueChanged)
@@ -232,6 +252,7 @@ class EndoscopyWidget(ScriptedLoadableModuleWidget):
     self.transform = model.transform
     self.pathPlaneNormal = model.planeNormal
     self.path = result.path
+    self.cameraTrack = EndoscopyCameraTrack(result.path, model.planeNormal)
 
     # Enable / Disable flythrough button
     self.flythroughCollapsibleButton.enabled = len(result.path) > 0
@@ -248,6 +269,10 @@ class EndoscopyWidget(ScriptedLoadableModuleWidget):
     #print "frameDelaySliderValueChanged:", newValue
     self.timer.interval = newValue
 
+  def targetFrameRateSliderValueChanged(self, newValue):
+    self.targetFrameRate = newValue
+    self.playbackStartTime = None
+
   def viewAngleSliderValueChanged(self, newValue):
     if not self.cameraNode:
       return
@@ -256,6 +281,7 @@ class EndoscopyWidget(ScriptedLoadableModuleWidget):
 
   def onPlayButtonToggled(self, checked):
     if checked:
+      self.playbackStartTime = None
       self.timer.start()
       self.playButton.text = "Stop"
     else:
@@ -264,62 +290,163 @@ class EndoscopyWidget(ScriptedLoadableModuleWidget):
 
   def flyToNext(self):
     currentStep = self.frameSlider.value
-    nextStep = currentStep + self.skip + 1
-    if nextStep > len(self.path) - 2:
-      nextStep = 0
+    if self.targetFrameRate > 0:
+      # advance by the number of frames due since playback started (or the
+      # user moved the slider), so slow rendering skips frames instead of
+      # slowing down the flythrough
+      import time
+      now = time.time()
+      if self.playbackStartTime is None or currentStep != self.playbackFrame:
+        self.playbackStartTime = now
+        self.playbackStartFrame = currentStep
+      nextStep = self.playbackStartFrame + int((now - self.playbackStartTime) * self.targetFrameRate)
+      if nextStep > len(self.path) - 2:
+        nextStep = 0
+        self.playbackStartTime = now
+        self.playbackStartFrame = 0
+      self.playbackFrame = nextStep
+      if nextStep == currentStep:
+        return
+    else:
+      nextStep = currentStep + self.skip + 1
+      if nextStep > len(self.path) - 2:
+        nextStep = 0
     self.frameSlider.value = nextStep
 
   def flyTo(self, f):
     """ Apply the fth step in the path to the global camera"""
     if self.path:
       f = int(f)
-      p = self.path[f]
-      self.camera.SetPosition(*p)
-      foc = self.path[f+1]
-      self.camera.SetFocalPoint(*foc)
-
-      toParent = vtk.vtkMatrix4x4()
-      self.transform.GetMatrixTransformToParent(toParent)
-      toParent.SetElement(0 ,3, p[0])
-      toParent.SetElement(1, 3, p[1])
-      toParent.SetElement(2, 3, p[2])
-
-      # Set up transform orientation component so that
-      # Z axis is aligned with view direction and
-      # Y vector is aligned with the curve's plane normal.
-      # This can be used for example to show a reformatted slice
+      # The camera track holds the pose of each frame: Z axis is aligned with
+      # the view direction and Y axis is a rotation-minimizing normal of the path.
+      # The transform can be used for example to show a reformatted slice
       # using with SlicerIGT extension's VolumeResliceDriver module.
-      import numpy as np
-      zVec = (foc-p)/np.linalg.norm(foc-p)
-      yVec = self.pathPlaneNormal
-      xVec = np.cross(yVec, zVec)
-      toParent.SetElement(0, 0, xVec[0])
-      toParent.SetElement(1, 0, xVec[1])
-      toParent.SetElement(2, 0, xVec[2])
-      toParent.SetElement(0, 1, yVec[0])
-      toParent.SetElement(1, 1, yVec[1])
-      toParent.SetElement(2, 1, yVec[2])
-      toParent.SetElement(0, 2, zVec[0])
-      toParent.SetElement(1, 2, zVec[1])
-      toParent.SetElement(2, 2, zVec[2])
-
-      self.transform.SetMatrixTransformToParent(toParent)
+      pose = self.cameraTrack.poses[f]
+      if self.cameraNode:
+        with slicer.util.NodeModify(self.cameraNode):
+          self.camera.SetPosition(pose[0, 3], pose[1, 3], pose[2, 3])
+          self.camera.SetFocalPoint(*self.cameraTrack.focalPoints[f])
+          self.camera.SetViewUp(pose[0, 1], pose[1, 1], pose[2, 1])
+      self.transformMatrix.DeepCopy(pose.ravel())
+      self.transform.SetMatrixTransformToParent(self.transformMatrix)
+
+
+class EndoscopyLogic(ScriptedLoadableModuleLogic):
+  """Uses ScriptedLoadableModuleLogic base class, available at:
+  https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
+  """
+
+  def createOffscreenRenderWindow(self, size):
+    """Create an offscreen render window of size (width, height) showing the
+    visible model nodes of the scene.
+    """
+    renderer = vtk.vtkRenderer()
+    renderWindow = vtk.vtkRenderWindow()
+    renderWindow.SetOffScreenRendering(1)
+    renderWindow.SetSize(size[0], size[1])
+    renderWindow.AddRenderer(renderer)
+
+    for modelNode in slicer.util.getNodesByClass('vtkMRMLModelNode'):
+      displayNode = modelNode.GetDisplayNode()
+      polyData = modelNode.GetPolyData()
+      if not displayNode or not displayNode.GetVisibility() or not polyData:
+        continue
+      mapper = vtk.vtkPolyDataMapper()
+      mapper.SetInputData(polyData)
+      mapper.ScalarVisibilityOff()
+      actor = vtk.vtkActor()
+      actor.SetMapper(mapper)
+      modelProperty = actor.GetProperty()
+      modelProperty.SetColor(displayNode.GetColor())
+      modelProperty.SetOpacity(displayNode.GetOpacity())
+      modelProperty.SetAmbient(displayNode.GetAmbient())
+      modelProperty.SetDiffuse(displayNode.GetDiffuse())
+      modelProperty.SetSpecular(displayNode.GetSpecular())
+      modelProperty.SetSpecularPower(displayNode.GetPower())
+      modelProperty.SetBackfaceCulling(displayNode.GetBackfaceCulling())
+      modelProperty.SetFrontfaceCulling(displayNode.GetFrontfaceCulling())
+      transformNode = modelNode.GetParentTransformNode()
+      if transformNode and transformNode.IsTransformToWorldLinear():
+        modelToWorld = vtk.vtkMatrix4x4()
+        transformNode.GetMatrixTransformToWorld(modelToWorld)
+        actor.SetUserMatrix(modelToWorld)
+      renderer.AddActor(actor)
+
+    return renderWindow, renderer
+
+  def renderFlythrough(self, path, outputFile, fps=25, size=(640, 480), viewAngle=30, initialNormal=None, extraOptions=None):
+    """Render a flythrough video along path (list of points, e.g.
+    EndoscopyComputePath.path) into outputFile.
+    Frames are rendered one by one in an offscreen render window and streamed
+    to the ffmpeg encoder configured in the Screen Capture module, so no
+    intermediate image files are written and memory use does not depend on
+    the number of frames.
+    extraOptions are ffmpeg output options, H.264 by default.
+
+    Example:
+      result = EndoscopyComputePath(fiducialsNode)
+      EndoscopyLogic().renderFlythrough(result.path, '/tmp/flythrough.mp4')
+    """
+    import ScreenCapture
+    screenCaptureLogic = ScreenCapture.ScreenCaptureLogic()
+    if not screenCaptureLogic.isFfmpegPathValid():
+      screenCaptureLogic.findFfmpeg()
+    if extraOptions is None:
+      extraOptions = screenCaptureLogic.videoFormatPresets[0]["extraVideoOptions"]
+
+    # most codecs require even image width and height
+    size = (int(size[0]) & ~1, int(size[1]) & ~1)
+    track = EndoscopyCameraTrack(path, initialNormal)
+    if track.numberOfFrames == 0:
+      raise ValueError("Flythrough path must contain at least two points")
+
+    renderWindow, renderer = self.createOffscreenRenderWindow(size)
+    camera = renderer.GetActiveCamera()
+    camera.SetViewAngle(viewAngle)
+    windowToImage = vtk.vtkWindowToImageFilter()
+    windowToImage.SetInput(renderWindow)
+    windowToImage.SetInputBufferTypeToRGB()
+    windowToImage.ReadFrontBufferOff()
+
+    logging.info('Rendering %d flythrough frames to %s' % (track.numberOfFrames, outputFile))
+    try:
+      videoStream = screenCaptureLogic.openVideoStream(fps, extraOptions, outputFile, size)
+      try:
+        for pose, focalPoint in zip(track.poses, track.focalPoints):
+          camera.SetPosition(pose[0, 3], pose[1, 3], pose[2, 3])
+          camera.SetFocalPoint(focalPoint[0], focalPoint[1], focalPoint[2])
+          camera.SetViewUp(pose[0, 1], pose[1, 1], pose[2, 1])
+          renderer.ResetCameraClippingRange()
+          renderWindow.Render()
+          windowToImage.Modified()
+          windowToImage.Update()
+          screenCaptureLogic.writeVideoStreamFrame(videoStream, windowToImage.GetOutput())
+      finally:
+        screenCaptureLogic.closeVideoStream(videoStream)
+    finally:
+      renderWindow.Finalize()
+    return outputFile
 
 
 class EndoscopyComputePath:
   """Compute path given a list of fiducials.
   A Hermite spline interpolation is used. See http://en.wikipedia.org/wiki/Cubic_Hermite_spline
 
+  The spline is densely sampled in a single vectorized evaluation, a cumulative
+  arc length table is built from the samples and the path points are found by
+  interpolating that table at multiples of dl.
+
   Example:
     result = EndoscopyComputePath(fiducialListNode)
     print "computer path has %d elements" % len(result.path)
 
   """
 
-  def __init__(self, fiducialListNode, dl = 0.5):
+  def __init__(self, fiducialListNode, dl = 0.5, oversampling = 8):
     import numpy
     self.dl = dl # desired world space step size (in mm)
     self.dt = dl # current guess of parametric stepsize
+    self.oversampling = oversampling # number of spline samples per dl used for the arc length table
     self.fids = fiducialListNode
 
     # hermite interpolation functions
@@ -374,14 +501,14 @@ class EndoscopyComputePath:
     # - first tangent is out vector, last is in vector
     # - sets self.m
     n = self.n
-    fm = numpy.zeros((n,3))
-    for i in xrange(0,n-1):
-      fm[i] = self.p[i+1] - self.p[i]
-    self.m = numpy.zeros((n,3))
-    for i in xrange(1,n-1):
-      self.m[i] = (fm[i-1] + fm[i]) / 2.
-    self.m[0] = fm[0]
-    self.m[n-1] = fm[n-2]
+    if n == 1:
+      self.m = numpy.zeros((n,3))
+    else:
+      fm = numpy.diff(self.p, axis=0)
+      self.m = numpy.zeros((n,3))
+      self.m[1:n-1] = (fm[:-1] + fm[1:]) / 2.
+      self.m[0] = fm[0]
+      self.m[n-1] = fm[n-2]
 
     self.path = [self.p[0]]
     self.calculatePath()
@@ -390,11 +517,63 @@ class EndoscopyComputePath:
     """ Generate a flight path for of steps of length dl """
     #
     # calculate the actual path
-    # - take steps of self.dl in world space
-    # -- if dl steps into next segment, take a step of size "remainder" in the new segment
+    # - sample every segment densely (number of samples proportional to the
+    #   segment chord length) in one vectorized evaluation
+    # - build the cumulative arc length table of the samples
+    # - interpolate the samples at arc lengths 0, dl, 2*dl, ... and at the
+    #   total length so that the path ends at the last control point
     # - put resulting points into self.path
     #
+    import numpy
     n = self.n
+    if n < 2:
+      return
+    chordLengths = numpy.sqrt(((self.p[1:] - self.p[:-1]) ** 2).sum(axis=1))
+    samplesPerSegment = numpy.maximum(2, numpy.ceil(self.oversampling * chordLengths / self.dl)).astype(int)
+
+    # parametric coordinate of each sample within its segment, first sample
+    # of each segment at t=0, the final sample of the curve at t=1
+    segment = numpy.repeat(numpy.arange(n-1), samplesPerSegment)
+    segmentStart = numpy.repeat(numpy.cumsum(samplesPerSegment) - samplesPerSegment, samplesPerSegment)
+    t = (numpy.arange(len(segment)) - segmentStart) / numpy.repeat(samplesPerSegment, samplesPerSegment).astype(float)
+    segment = numpy.append(segment, n-2)
+    t = numpy.append(t, 1.)
+
+    samples = self.points(segment, t)
+    arcLength = numpy.zeros(len(samples))
+    arcLength[1:] = numpy.cumsum(numpy.sqrt(((samples[1:] - samples[:-1]) ** 2).sum(axis=1)))
+
+    totalLength = arcLength[-1]
+    stepLengths = numpy.arange(self.dl, totalLength, self.dl)
+    if totalLength > 0 and (len(stepLengths) == 0 or totalLength - stepLengths[-1] > 1e-6 * self.dl):
+      stepLengths = numpy.append(stepLengths, totalLength)
+    pathPoints = numpy.empty((len(stepLengths), 3))
+    for axis in xrange(3):
+      pathPoints[:, axis] = numpy.interp(stepLengths, arcLength, samples[:, axis])
+    self.path.extend(pathPoints)
+
+  def points(self,segment,t):
+    """ Evaluate the spline at arrays of segment indices and parametric coordinates """
+    t = t[:, None]
+    return (self.h00(t)*self.p[segment] +
+              self.h10(t)*self.m[segment] +
+              self.h01(t)*self.p[segment+1] +
+              self.h11(t)*self.m[segment+1])
+
+  def point(self,segment,t):
+    return (self.h00(t)*self.p[segment] +
+              self.h10(t)*self.m[segment] +
+              self.h01(t)*self.p[segment+1] +
+              self.h11(t)*self.m[segment+1])
+
+  def calculatePathByStepping(self):
+    """ Generate a flight path for of steps of length dl by searching for
+    each step iteratively. This is the original implementation, it is
+    much slower than calculatePath and kept for comparison.
+    """
+    n = self.n
+    self.path = [self.p[0]]
+    self.dt = self.dl
     segment = 0 # which first point of current segment
     t = 0 # parametric current parametric increment
     remainder = 0 # how much of dl isn't included in current step
@@ -407,12 +586,6 @@ class EndoscopyComputePath:
           t, p, remainder = self.step(segment, t, remainder)
       self.path.append(p)
 
-  def point(self,segment,t):
-    return (self.h00(t)*self.p[segment] +
-              self.h10(t)*self.m[segment] +
-              self.h01(t)*self.p[segment+1] +
-              self.h11(t)*self.m[segment+1])
-
   def step(self,segment,t,dl):
     """ Take a step of dl and return the path point and new t
       return:
@@ -544,3 +717,168 @@ class EndoscopyPathModel:
     x = points - ctr[:,np.newaxis]
     M = np.dot(x, x.T) # Could also use np.cov(x) here.
     return ctr, svd(M)[0][:,-1]
+
+
+class EndoscopyCameraTrack:
+  """Precompute the camera pose of every flythrough frame of a path.
+
+  Frame f is at path[f] looking at path[f+1], so a path of N points has N-1
+  frames. The frame axes are rotation-minimizing (computed with the double
+  reflection method, see Wang et al., Computation of rotation minimizing
+  frames, ACM TOG 2008): the Z axis is aligned with the view direction and
+  the Y axis is transported along the path without twisting around it,
+  starting from the given initial normal (e.g. the plane normal of the path).
+
+  Example:
+    track = EndoscopyCameraTrack(result.path, model.planeNormal)
+    pose = track.poses[f] # 4x4 numpy array, columns are X, Y, Z and position
+  """
+
+  def __init__(self, path, initialNormal=None):
+    import numpy
+    path = numpy.asarray(path, dtype=float)
+    self.numberOfFrames = max(0, len(path) - 1)
+    self.poses = numpy.zeros((self.numberOfFrames, 4, 4))
+    self.focalPoints = path[1:]
+    if self.numberOfFrames == 0:
+      return
+
+    positions = path[:-1]
+    directions = path[1:] - path[:-1]
+    lengths = numpy.sqrt((directions ** 2).sum(axis=1))
+    # repeated path points have no direction, use the previous one
+    for i in numpy.nonzero(lengths == 0)[0]:
+      directions[i] = directions[i-1] if i > 0 else [0., 0., 1.]
+      lengths[i] = numpy.linalg.norm(directions[i])
+    tangents = directions / lengths[:, numpy.newaxis]
+
+    normals = numpy.zeros((self.numberOfFrames, 3))
+    normals[0] = self.perpendicular(tangents[0], initialNormal)
+    for i in xrange(self.numberOfFrames - 1):
+      v1 = positions[i+1] - positions[i]
+      c1 = numpy.dot(v1, v1)
+      if c1 == 0:
+        normals[i+1] = normals[i]
+        continue
+      normalL = normals[i] - (2. / c1) * numpy.dot(v1, normals[i]) * v1
+      tangentL = tangents[i] - (2. / c1) * numpy.dot(v1, tangents[i]) * v1
+      v2 = tangents[i+1] - tangentL
+      c2 = numpy.dot(v2, v2)
+      if c2 == 0:
+        normals[i+1] = normalL
+      else:
+        normals[i+1] = normalL - (2. / c2) * numpy.dot(v2, normalL) * v2
+    # remove accumulated round-off error
+    normals -= (normals * tangents).sum(axis=1)[:, numpy.newaxis] * tangents
+    normals /= numpy.sqrt((normals ** 2).sum(axis=1))[:, numpy.newaxis]
+
+    self.poses[:, :3, 0] = numpy.cross(normals, tangents)
+    self.poses[:, :3, 1] = normals
+    self.poses[:, :3, 2] = tangents
+    self.poses[:, :3, 3] = positions
+    self.poses[:, 3, 3] = 1.
+
+  def perpendicular(self, direction, normal=None):
+    """Return the unit vector closest to normal that is perpendicular to direction"""
+    import numpy
+    candidates = [] if normal is None else [numpy.asarray(normal, dtype=float)]
+    candidates += [numpy.array([0., 0., 1.]), numpy.array([0., 1., 0.]), numpy.array([1., 0., 0.])]
+    for candidate in candidates:
+      perpendicular = candidate - numpy.dot(candidate, direction) * direction
+      length = numpy.linalg.norm(perpendicular)
+      if length > 1e-6:
+        return perpendicular / length
+
+
+class EndoscopyTest(ScriptedLoadableModuleTest):
+  """
+  This is the test case for your scripted module.
+  Uses ScriptedLoadableModuleTest base class, available at:
+  https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
+  """
+
+  def setUp(self):
+    """ Do whatever is needed to reset the state - typically a scene clear will be enough.
+    """
+    slicer.mrmlScene.Clear(0)
+
+  def runTest(self):
+    """Run as few or as many tests as needed here.
+    """
+    self.setUp()
+    self.test_ComputePathPerformance()
+    self.setUp()
+    self.test_CameraTrack()
+
+  def createHelixFiducials(self, numberOfPoints):
+    import numpy
+    angles = numpy.linspace(0, 40*numpy.pi, numberOfPoints)
+    fiducials = slicer.vtkMRMLMarkupsFiducialNode()
+    slicer.mrmlScene.AddNode(fiducials)
+    wasModifying = fiducials.StartModify()
+    for angle in angles:
+      fiducials.AddFiducial(30*numpy.cos(angle), 30*numpy.sin(angle), 5*angle)
+    fiducials.EndModify(wasModifying)
+    return fiducials
+
+  def test_ComputePathPerformance(self):
+    """ Compare the arc length table path engine with the original iterative
+    stepping on a path with many control points.
+    """
+    import numpy, time
+    self.delayDisplay("Starting the path performance test")
+    fiducials = self.createHelixFiducials(1200)
+
+    startTime = time.time()
+    result = EndoscopyComputePath(fiducials)
+    arcLengthTime = time.time() - startTime
+    path = numpy.array(result.path)
+
+    startTime = time.time()
+    result.calculatePathByStepping()
+    steppingTime = time.time() - startTime
+    steppingPath = numpy.array(result.path)
+
+    logging.info('Path of %d control points: %d points in %.3fs (iterative stepping: %d points in %.3fs, speedup %.1fx)'
+      % (fiducials.GetNumberOfFiducials(), len(path), arcLengthTime, len(steppingPath), steppingTime,
+      steppingTime / max(arcLengthTime, 1e-6)))
+
+    # path starts and ends on the control points with dl steps in between
+    firstPoint = [0.0, 0.0, 0.0]
+    lastPoint = [0.0, 0.0, 0.0]
+    fiducials.GetNthFiducialPosition(0, firstPoint)
+    fiducials.GetNthFiducialPosition(fiducials.GetNumberOfFiducials()-1, lastPoint)
+    self.assertTrue(numpy.allclose(path[0], firstPoint))
+    self.assertTrue(numpy.allclose(path[-1], lastPoint))
+    stepLengths = numpy.sqrt(((path[1:] - path[:-1]) ** 2).sum(axis=1))
+    self.assertTrue((stepLengths[:-1] <= result.dl + 1e-6).all())
+    self.assertTrue((stepLengths[:-1] > 0.9 * result.dl).all())
+    # both engines follow the same curve
+    self.assertLess(abs(len(path) - len(steppingPath)), 0.05 * len(path))
+
+    self.delayDisplay('Test passed!')
+
+  def test_CameraTrack(self):
+    """ Check that precomputed camera frames are orthonormal, follow the
+    path and do not twist between consecutive frames.
+    """
+    import numpy
+    self.delayDisplay("Starting the camera track test")
+    fiducials = self.createHelixFiducials(50)
+    result = EndoscopyComputePath(fiducials)
+    track = EndoscopyCameraTrack(result.path, [0., 0., 1.])
+    self.assertEqual(track.poses.shape, (len(result.path) - 1, 4, 4))
+
+    rotations = track.poses[:, :3, :3]
+    for rotation in rotations:
+      self.assertTrue(numpy.allclose(numpy.dot(rotation.T, rotation), numpy.eye(3)))
+      self.assertAlmostEqual(numpy.linalg.det(rotation), 1.)
+    path = numpy.array(result.path)
+    self.assertTrue(numpy.allclose(track.poses[:, :3, 3], path[:-1]))
+    viewDirections = path[1:] - path[:-1]
+    viewDirections /= numpy.sqrt((viewDirections ** 2).sum(axis=1))[:, numpy.newaxis]
+    self.assertTrue(numpy.allclose(track.poses[:, :3, 2], viewDirections))
+    normalChanges = numpy.sqrt(((rotations[1:, :, 1] - rotations[:-1, :, 1]) ** 2).sum(axis=1))
+    self.assertLess(normalChanges.max(), 0.1)
+
+    self.delayDisplay('Test passed!')
@@ -301,64 +301,111 @@ class LabelStatisticsLogic(ScriptedLoadableModuleLogic):
     self.labelStats = {}
     self.labelStats['Labels'] = []
 
-    stataccum = vtk.vtkImageAccumulate()
-    stataccum.SetInputConnection(labelNode.GetImageDataConnection())
-    stataccum.Update()
-    lo = int(stataccum.GetMin()[0])
-    hi = int(stataccum.GetMax()[0])
-
-    for i in xrange(lo,hi+1):
-
-      # this->SetProgress((float)i/hi);
-      # std::string event_message = "Label "; std::stringstream s; s << i; event_message.append(s.str());
-      # this->InvokeEvent(vtkLabelStatisticsLogic::LabelStatsOuterLoop, (void*)event_message.c_str());
-
-      # logic copied from slicer3 LabelStatistics
-      # to create the binary volume of the label
-      # //logic copied from slicer2 LabelStatistics MaskStat
-      # // create the binary volume of the label
-      thresholder = vtk.vtkImageThreshold()
-      thresholder.SetInputConnection(labelNode.GetImageDataConnection())
-      thresholder.SetInValue(1)
-      thresholder.SetOutValue(0)
-      thresholder.ReplaceOutOn()
-      thresholder.ThresholdBetween(i,i)
-      thresholder.SetOutputScalarType(grayscaleNode.GetImageData().GetScalarType())
-      thresholder.Update()
-
-      # this.InvokeEvent(vtkLabelStatisticsLogic::LabelStatsInnerLoop, (void*)"0.25");
-
-      #  use vtk's statistics class with the binary labelmap as a stencil
-      stencil = vtk.vtkImageToImageStencil()
-      stencil.SetInputConnection(thresholder.GetOutputPort())
-      stencil.ThresholdBetween(1, 1)
-
-      # this.InvokeEvent(vtkLabelStatisticsLogic::LabelStatsInnerLoop, (void*)"0.5")
-
-      stat1 = vtk.vtkImageAccumulate()
-      stat1.SetInputConnection(grayscaleNode.GetImageDataConnection())
-      stencil.Update()
-      stat1.SetStencilData(stencil.GetOutput())
-
-      stat1.Update()
-
-      # this.InvokeEvent(vtkLabelStatisticsLogic::LabelStatsInnerLoop, (void*)"0.75")
-
-      if stat1.GetVoxelCount() > 0:
-        # add an entry to the LabelStats list
-        self.labelStats["Labels"].append(i)
-        self.labelStats[i,"Index"] = i
-        self.labelStats[i,"Count"] = stat1.GetVoxelCount()
-        self.labelStats[i,"Volume mm^3"] = self.labelStats[i,"Count"] * cubicMMPerVoxel
-        self.labelStats[i,"Volume cc"] = self.labelStats[i,"Volume mm^3"] * ccPerCubicMM
-        self.labelStats[i,"Min"] = stat1.GetMin()[0]
-        self.labelStats[i,"Max"] = stat1.GetMax()[0]
-        self.labelStats[i,"Mean"] = stat1.GetMean()[0]
-        self.labelStats[i,"StdDev"] = stat1.GetStandardDeviation()[0]
-
-        # this.InvokeEvent(vtkLabelStatisticsLogic::LabelStatsInnerLoop, (void*)"1")
-
-    # this.InvokeEvent(vtkLabelStatisticsLogic::EndLabelStats, (void*)"end label stats")
+    # compute the statistics of all labels in a single pass over the volumes
+    # (instead of thresholding and accumulating the volume once per label value)
+    labelArray = slicer.util.arrayFromVolume(labelNode)
+    grayscaleArray = slicer.util.arrayFromVolume(grayscaleNode)
+    if grayscaleArray.ndim == 4:
+      # statistics are computed from the first scalar component
+      grayscaleArray = grayscaleArray[..., 0]
+
+    for i, count, minimum, maximum, mean, stdDev in self.computeLabelStatistics(labelArray, grayscaleArray):
+      # add an entry to the LabelStats list
+      self.labelStats["Labels"].append(i)
+      self.labelStats[i,"Index"] = i
+      self.labelStats[i,"Count"] = count
+      self.labelStats[i,"Volume mm^3"] = self.labelStats[i,"Count"] * cubicMMPerVoxel
+      self.labelStats[i,"Volume cc"] = self.labelStats[i,"Volume mm^3"] * ccPerCubicMM
+      self.labelStats[i,"Min"] = minimum
+      self.labelStats[i,"Max"] = maximum
+      self.labelStats[i,"Mean"] = mean
+      self.labelStats[i,"StdDev"] = stdDev
+
+  # Maximum number of (label, grayscale value) histogram bins used by
+  # computeLabelStatistics for integer grayscale volumes
+  maximumNumberOfHistogramBins = 1 << 22
+  # Number of voxels processed at once when building the histogram
+  chunkSize = 1 << 24
+
+  def computeLabelStatistics(self, labelArray, grayscaleArray):
+    """Compute the statistics of grayscaleArray voxels for every integer label
+    value present in labelArray (same shape) with grouped reductions.
+    Returns a list of (label, count, min, max, mean, stdDev) sorted by label.
+    StdDev is the sample standard deviation, as computed by vtkImageAccumulate.
+    """
+    import numpy
+    labelArray = labelArray.ravel()
+    grayscaleArray = grayscaleArray.ravel()
+    if labelArray.shape != grayscaleArray.shape:
+      raise ValueError("Label and grayscale volumes must have the same dimensions")
+    if labelArray.size == 0:
+      return []
+    if labelArray.dtype.kind == 'f':
+      # only integer label values are labels
+      isInteger = numpy.floor(labelArray) == labelArray
+      labelArray = labelArray[isInteger]
+      grayscaleArray = grayscaleArray[isInteger]
+      if labelArray.size == 0:
+        return []
+    lo = int(labelArray.min())
+    hi = int(labelArray.max())
+    numberOfLabels = hi - lo + 1
+
+    if grayscaleArray.dtype.kind in 'iub':
+      grayscaleMin = int(grayscaleArray.min())
+      numberOfGrayscaleValues = int(grayscaleArray.max()) - grayscaleMin + 1
+      if numberOfLabels * numberOfGrayscaleValues <= self.maximumNumberOfHistogramBins:
+        return self.computeLabelStatisticsFromHistogram(labelArray, grayscaleArray, lo, numberOfLabels,
+          grayscaleMin, numberOfGrayscaleValues)
+
+    # sort voxels by label and reduce each group of equal labels
+    labelIndex = labelArray.astype(numpy.int64) - lo
+    order = numpy.argsort(labelIndex, kind='mergesort')
+    sortedValues = grayscaleArray[order].astype(numpy.float64)
+    counts = numpy.bincount(labelIndex, minlength=numberOfLabels)
+    presentLabelIndices = numpy.nonzero(counts)[0]
+    counts = counts[presentLabelIndices]
+    groupStarts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    minima = numpy.minimum.reduceat(sortedValues, groupStarts)
+    maxima = numpy.maximum.reduceat(sortedValues, groupStarts)
+    means = numpy.add.reduceat(sortedValues, groupStarts) / counts
+    squaredDeviations = numpy.add.reduceat((sortedValues - numpy.repeat(means, counts)) ** 2, groupStarts)
+    return self.labelStatisticsList(presentLabelIndices + lo, counts, minima, maxima, means, squaredDeviations)
+
+  def computeLabelStatisticsFromHistogram(self, labelArray, grayscaleArray, lo, numberOfLabels,
+    grayscaleMin, numberOfGrayscaleValues):
+    """Compute label statistics of integer grayscale values from a joint
+    (label, grayscale value) histogram, which is accumulated chunk by chunk
+    to keep temporary arrays small.
+    """
+    import numpy
+    histogram = numpy.zeros(numberOfLabels * numberOfGrayscaleValues, dtype=numpy.int64)
+    for chunkStart in xrange(0, labelArray.size, self.chunkSize):
+      labelChunk = labelArray[chunkStart:chunkStart+self.chunkSize].astype(numpy.int64)
+      grayscaleChunk = grayscaleArray[chunkStart:chunkStart+self.chunkSize].astype(numpy.int64)
+      binIndex = (labelChunk - lo) * numberOfGrayscaleValues + (grayscaleChunk - grayscaleMin)
+      histogram += numpy.bincount(binIndex, minlength=histogram.size)
+    histogram = histogram.reshape(numberOfLabels, numberOfGrayscaleValues)
+
+    counts = histogram.sum(axis=1)
+    presentLabelIndices = numpy.nonzero(counts)[0]
+    histogram = histogram[presentLabelIndices]
+    counts = counts[presentLabelIndices]
+    values = numpy.arange(grayscaleMin, grayscaleMin + numberOfGrayscaleValues, dtype=numpy.float64)
+    nonEmptyBins = histogram > 0
+    minima = values[numpy.argmax(nonEmptyBins, axis=1)]
+    maxima = values[numberOfGrayscaleValues - 1 - numpy.argmax(nonEmptyBins[:, ::-1], axis=1)]
+    means = histogram.dot(values) / counts
+    squaredDeviations = (histogram * (values[numpy.newaxis, :] - means[:, numpy.newaxis]) ** 2).sum(axis=1)
+    return self.labelStatisticsList(presentLabelIndices + lo, counts, minima, maxima, means, squaredDeviations)
+
+  def labelStatisticsList(self, labels, counts, minima, maxima, means, squaredDeviations):
+    import numpy
+    stdDevs = numpy.zeros(len(counts))
+    multipleVoxels = counts > 1
+    stdDevs[multipleVoxels] = numpy.sqrt(squaredDeviations[multipleVoxels] / (counts[multipleVoxels] - 1))
+    return [(int(label), int(count), float(minimum), float(maximum), float(mean), float(stdDev))
+      for label, count, minimum, maximum, mean, stdDev in zip(labels, counts, minima, maxima, means, stdDevs)]
 
   def getColorNode(self):
     """Returns the color node corresponding to the labelmap. If a color node is explicitly
@@ -499,6 +546,8 @@ class LabelStatisticsTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_LabelStatisticsBasic()
+    self.setUp()
+    self.test_LabelStatisticsValues()
 
   def test_LabelStatisticsBasic(self):
     """
@@ -533,6 +582,47 @@ class LabelStatisticsTest(ScriptedLoadableModuleTest):
 
     self.delayDisplay('test_LabelStatisticsBasic passed!')
 
+  def test_LabelStatisticsValues(self):
+    """
+    Compare the single pass statistics with vtkImageAccumulate results
+    """
+    self.delayDisplay("Starting test_LabelStatisticsValues")
+    import numpy
+    shape = (8, 20, 30)
+    grayscaleArray = numpy.arange(numpy.prod(shape), dtype=numpy.int16).reshape(shape) % 97 - 20
+    labelArray = numpy.zeros(shape, dtype=numpy.int16)
+    labelArray[2:5, 3:10, 4:20] = 3
+    labelArray[6, 15, 25] = 7
+    grayscaleNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+    slicer.util.updateVolumeFromArray(grayscaleNode, grayscaleArray)
+    labelNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLabelMapVolumeNode')
+    slicer.util.updateVolumeFromArray(labelNode, labelArray)
+
+    logic = LabelStatisticsLogic(grayscaleNode, labelNode)
+    self.assertEqual(logic.labelStats["Labels"], [0, 3, 7])
+
+    for label in logic.labelStats["Labels"]:
+      stencil = vtk.vtkImageToImageStencil()
+      thresholder = vtk.vtkImageThreshold()
+      thresholder.SetInputConnection(labelNode.GetImageDataConnection())
+      thresholder.ThresholdBetween(label, label)
+      thresholder.SetInValue(1)
+      thresholder.SetOutValue(0)
+      stencil.SetInputConnection(thresholder.GetOutputPort())
+      stencil.ThresholdBetween(1, 1)
+      stencil.Update()
+      accumulate = vtk.vtkImageAccumulate()
+      accumulate.SetInputConnection(grayscaleNode.GetImageDataConnection())
+      accumulate.SetStencilData(stencil.GetOutput())
+      accumulate.Update()
+      self.assertEqual(logic.labelStats[label, "Count"], accumulate.GetVoxelCount())
+      self.assertAlmostEqual(logic.labelStats[label, "Min"], accumulate.GetMin()[0])
+      self.assertAlmostEqual(logic.labelStats[label, "Max"], accumulate.GetMax()[0])
+      self.assertAlmostEqual(logic.labelStats[label, "Mean"], accumulate.GetMean()[0], places=5)
+      self.assertAlmostEqual(logic.labelStats[label, "StdDev"], accumulate.GetStandardDeviation()[0], places=5)
+
+    self.delayDisplay('test_LabelStatisticsValues passed!')
+
 class Slicelet(object):
   """A slicer slicelet is a module widget that comes up in stand alone mode
   implemented as a python class.
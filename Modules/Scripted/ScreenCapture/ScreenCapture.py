@@ -976,16 +976,21 @@ class ScreenCaptureLogic(ScriptedLoadableModuleLogic):
     if self.cancelRequested:
       raise ValueError('User requested cancel.')
 
-  def createVideo(self, frameRate, extraOptions, outputDir, imageFileNamePattern, videoFileName):
-    self.addLog("Export to video...")
-
-    # Get ffmpeg
+  def getValidFfmpegPath(self):
     import os.path
-    ffmpegPath = os.path.abspath(self.getFfmpegPath())
+    ffmpegPath = self.getFfmpegPath()
     if not ffmpegPath:
       raise ValueError("Video creation failed: ffmpeg executable path is not defined")
+    ffmpegPath = os.path.abspath(ffmpegPath)
     if not os.path.isfile(ffmpegPath):
       raise ValueError("Video creation failed: ffmpeg executable path is invalid: "+ffmpegPath)
+    return ffmpegPath
+
+  def createVideo(self, frameRate, extraOptions, outputDir, imageFileNamePattern, videoFileName):
+    self.addLog("Export to video...")
+
+    # Get ffmpeg
+    ffmpegPath = self.getValidFfmpegPath()
 
     filePathPattern = os.path.join(outputDir, imageFileNamePattern)
     outputVideoFilePath = os.path.join(outputDir, videoFileName)
@@ -1010,6 +1015,77 @@ class ScreenCaptureLogic(ScriptedLoadableModuleLogic):
       logging.debug("ffmpeg standard output: " + output[0])
       logging.debug("ffmpeg error output: " + output[1])
 
+  def openVideoStream(self, frameRate, extraOptions, videoFilePath, imageSize):
+    """
+    Start ffmpeg reading raw RGB frames of imageSize (width, height) from its
+    standard input. Frames are added by writeVideoStreamFrame and the video
+    file is finalized by closeVideoStream, so a video can be created without
+    writing the individual frames into image files.
+    Width and height must be even for most video codecs.
+    """
+    self.addLog("Export to video stream...")
+    ffmpegPath = self.getValidFfmpegPath()
+
+    ffmpegParams = [ffmpegPath,
+                    "-y", # overwrite without asking
+                    "-f", "rawvideo",
+                    "-pix_fmt", "rgb24",
+                    "-s", "%dx%d" % (imageSize[0], imageSize[1]),
+                    "-r", str(frameRate),
+                    "-i", "-"]
+    ffmpegParams += filter(None, extraOptions.split(' '))
+    ffmpegParams.append(videoFilePath)
+
+    self.addLog("Start ffmpeg:\n"+' '.join(ffmpegParams))
+
+    import subprocess, tempfile
+    # ffmpeg error output goes to a file: a pipe that is not read while the
+    # frames are written could fill up and block ffmpeg
+    errorOutput = tempfile.TemporaryFile()
+    videoStream = subprocess.Popen(ffmpegParams, stdin=subprocess.PIPE, stdout=errorOutput, stderr=errorOutput)
+    videoStream.errorOutput = errorOutput
+    videoStream.imageSize = (imageSize[0], imageSize[1])
+    videoStream.videoFilePath = videoFilePath
+    return videoStream
+
+  def writeVideoStreamFrame(self, videoStream, imageData):
+    """
+    Send an RGB or RGBA vtkImageData (e.g. output of vtkWindowToImageFilter)
+    to the video stream opened by openVideoStream.
+    """
+    import vtk.util.numpy_support
+    dimensions = imageData.GetDimensions()
+    if (dimensions[0], dimensions[1]) != videoStream.imageSize:
+      raise ValueError("Video frame size %dx%d does not match video size %dx%d"
+        % (dimensions[0], dimensions[1], videoStream.imageSize[0], videoStream.imageSize[1]))
+    scalars = imageData.GetPointData().GetScalars()
+    pixels = vtk.util.numpy_support.vtk_to_numpy(scalars).reshape(
+      dimensions[1], dimensions[0], scalars.GetNumberOfComponents())
+    # VTK image origin is at the bottom-left, video frames start at the top
+    frame = pixels[::-1, :, :3]
+    # if ffmpeg has stopped, the write raises IOError: the caller must still
+    # call closeVideoStream, which reports the ffmpeg error output
+    videoStream.stdin.write(frame.tostring())
+
+  def closeVideoStream(self, videoStream):
+    """
+    Finish writing the video file of a stream opened by openVideoStream.
+    Calling it again on a closed stream does nothing.
+    """
+    if videoStream.errorOutput.closed:
+      return
+    if not videoStream.stdin.closed:
+      videoStream.stdin.close()
+    videoStream.wait()
+    videoStream.errorOutput.seek(0)
+    output = videoStream.errorOutput.read()
+    videoStream.errorOutput.close()
+    if videoStream.returncode != 0:
+      self.addLog("ffmpeg error output: " + output)
+      raise ValueError("ffmpeg returned with error: " + output)
+    self.addLog("Video export succeeded to file: "+videoStream.videoFilePath)
+    logging.debug("ffmpeg output: " + output)
+
   def deleteTemporaryFiles(self, outputDir, imageFileNamePattern, numberOfImages):
     """
     Delete files after a video has been created from them.
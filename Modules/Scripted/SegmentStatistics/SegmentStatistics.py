@@ -1,7 +1,10 @@
 import os
 import unittest
+import time
+import multiprocessing
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
+from SegmentStatisticsPlugins import *
 import logging
 
 #
@@ -30,6 +33,10 @@ min, max, mean, stdev (intensity statistics).
 Requires segment labelmap representation and selection of a grayscale volume
 Closed surface statistics (CS): surface mm2, volume mm3, volume cc (computed from closed surface).
 Requires segment closed surface representation.
+Additional statistics can be added by registering a SegmentStatisticsPluginBase subclass with
+SegmentStatisticsLogic.registerPlugin. Results are cached per segment, so that recomputation after editing
+only updates the segments that changed. Computation time of each plugin is available in
+SegmentStatisticsLogic.pluginComputeTimes.
 """
     self.parent.helpText += self.getDefaultModuleDocumentationLink()
     self.parent.acknowledgementText = """
@@ -158,21 +165,54 @@ class SegmentStatisticsLogic(ScriptedLoadableModuleLogic):
   https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
   """
 
+  # Plugin classes that are instantiated by each new logic object, see registerPlugin
+  registeredPlugins = [LabelmapSegmentStatisticsPlugin, ScalarVolumeSegmentStatisticsPlugin, ClosedSurfaceSegmentStatisticsPlugin]
+
+  @staticmethod
+  def registerPlugin(pluginClass):
+    """Register a statistics calculator class (derived from SegmentStatisticsPluginBase).
+    Logic objects created afterwards will compute its statistics.
+    """
+    if pluginClass not in SegmentStatisticsLogic.registeredPlugins:
+      SegmentStatisticsLogic.registeredPlugins.append(pluginClass)
+
   def __init__(self):
-    self.keys = ("Segment",
-      "LM voxel count", "LM volume mm3", "LM volume cc",
-      "GS voxel count", "GS volume mm3", "GS volume cc", "GS min", "GS max", "GS mean", "GS stdev",
-      "CS surface mm2", "CS volume mm3", "CS volume cc")
+    self.keys = ("Segment",)
+    self.plugins = []
     self.notAvailableValueString = ""
+    self.numberOfWorkerThreads = multiprocessing.cpu_count()
+    self.workerPool = None
+    self.segmentationNode = None
+    self.grayscaleNode = None
+    self.croppedSegmentLabelmaps = {}
+    # Computation time of the last computeStatistics call, in seconds, for each plugin name
+    self.pluginComputeTimes = {}
+    self.clearResultCache()
+    for pluginClass in SegmentStatisticsLogic.registeredPlugins:
+      self.addPlugin(pluginClass())
     self.reset()
 
+  def addPlugin(self, plugin):
+    """Add a statistics calculator to this logic object only"""
+    plugin.logic = self
+    self.plugins.append(plugin)
+    self.keys += tuple(plugin.keys)
+
   def reset(self):
     """Clear all computation results"""
     self.statistics = {}
     self.statistics["SegmentIDs"] = []
 
+  def clearResultCache(self):
+    """Forget the cached per-segment results so that the next computation starts from scratch"""
+    # (segmentation node ID, plugin name, segment ID) -> (input key, statistics)
+    self.resultCache = {}
+
   def computeStatistics(self, segmentationNode, grayscaleNode, visibleSegmentsOnly = True):
-    import vtkSegmentationCorePython as vtkSegmentationCore
+    """Compute statistics of the segments by all plugins.
+    Results of segments whose inputs have not changed since the previous call are reused.
+    """
+    from multiprocessing.pool import ThreadPool
 
     self.reset()
 
@@ -194,141 +234,78 @@ class SegmentStatisticsLogic(ScriptedLoadableModuleLogic):
       self.statistics["SegmentIDs"].append(segmentID)
       self.statistics[segmentID,"Segment"] = segment.GetName()
 
-    self.addSegmentLabelmapStatistics()
-    self.addGrayscaleVolumeStatistics()
-    self.addSegmentClosedSurfaceStatistics()
-
-  def addSegmentLabelmapStatistics(self):
-    import vtkSegmentationCorePython as vtkSegmentationCore
-
-    containsLabelmapRepresentation = self.segmentationNode.GetSegmentation().ContainsRepresentation(
-      vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName())
-    if not containsLabelmapRepresentation:
-      return
-
-    for segmentID in self.statistics["SegmentIDs"]:
-      segment = self.segmentationNode.GetSegmentation().GetSegment(segmentID)
-      segmentLabelmap = segment.GetRepresentation(vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName())
-
-      # We need to know exactly the value of the segment voxels, apply threshold to make force the selected label value
-      labelValue = 1
-      backgroundValue = 0
-      thresh = vtk.vtkImageThreshold()
-      thresh.SetInputData(segmentLabelmap)
-      thresh.ThresholdByLower(0)
-      thresh.SetInValue(backgroundValue)
-      thresh.SetOutValue(labelValue)
-      thresh.SetOutputScalarType(vtk.VTK_UNSIGNED_CHAR)
-      thresh.Update()
-
-      #  Use binary labelmap as a stencil
-      stencil = vtk.vtkImageToImageStencil()
-      stencil.SetInputData(thresh.GetOutput())
-      stencil.ThresholdByUpper(labelValue)
-      stencil.Update()
-
-      stat = vtk.vtkImageAccumulate()
-      stat.SetInputData(thresh.GetOutput())
-      stat.SetStencilData(stencil.GetOutput())
-      stat.Update()
-
-      # Add data to statistics list
-      cubicMMPerVoxel = reduce(lambda x,y: x*y, segmentLabelmap.GetSpacing())
-      ccPerCubicMM = 0.001
-      self.statistics[segmentID,"LM voxel count"] = stat.GetVoxelCount()
-      self.statistics[segmentID,"LM volume mm3"] = stat.GetVoxelCount() * cubicMMPerVoxel
-      self.statistics[segmentID,"LM volume cc"] = stat.GetVoxelCount() * cubicMMPerVoxel * ccPerCubicMM
-
-  def addSegmentClosedSurfaceStatistics(self):
-    import vtkSegmentationCorePython as vtkSegmentationCore
-
-    containsClosedSurfaceRepresentation = self.segmentationNode.GetSegmentation().ContainsRepresentation(
-      vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationClosedSurfaceRepresentationName())
-    if not containsClosedSurfaceRepresentation:
-      return
-
+    # VTK and MRML calls stay on the main thread, only the numpy reductions
+    # over the cropped segment arrays are handed to the worker threads.
+    self.workerPool = ThreadPool(max(1, self.numberOfWorkerThreads))
+    self.pluginComputeTimes = {}
+    try:
+      for plugin in self.plugins:
+        self.computePluginStatistics(plugin)
+    finally:
+      self.workerPool.close()
+      self.workerPool.join()
+      self.workerPool = None
+      self.croppedSegmentLabelmaps = {}
+
+  def computePluginStatistics(self, plugin):
+    """Add statistics of one plugin to self.statistics, recomputing only segments with modified inputs"""
+    startTime = time.time()
+    segmentationNodeID = self.segmentationNode.GetID()
+
+    inputKeys = {}
+    modifiedSegmentIDs = []
     for segmentID in self.statistics["SegmentIDs"]:
-      segment = self.segmentationNode.GetSegmentation().GetSegment(segmentID)
-      segmentClosedSurface = segment.GetRepresentation(vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationClosedSurfaceRepresentationName())
-
-      # Compute statistics
-      massProperties = vtk.vtkMassProperties()
-      massProperties.SetInputData(segmentClosedSurface)
-
-      # Add data to statistics list
-      ccPerCubicMM = 0.001
-      self.statistics[segmentID,"CS surface mm2"] = massProperties.GetSurfaceArea()
-      self.statistics[segmentID,"CS volume mm3"] = massProperties.GetVolume()
-      self.statistics[segmentID,"CS volume cc"] = massProperties.GetVolume() * ccPerCubicMM
-
-  def addGrayscaleVolumeStatistics(self):
+      inputKey = plugin.getInputKey(segmentID)
+      if inputKey is None:
+        continue
+      inputKeys[segmentID] = inputKey
+      cachedResult = self.resultCache.get((segmentationNodeID, plugin.name, segmentID))
+      if cachedResult is None or cachedResult[0] != inputKey:
+        modifiedSegmentIDs.append(segmentID)
+
+    if modifiedSegmentIDs:
+      computedStatistics = plugin.computeStatistics(modifiedSegmentIDs)
+      for segmentID in modifiedSegmentIDs:
+        self.resultCache[segmentationNodeID, plugin.name, segmentID] = (inputKeys[segmentID], computedStatistics[segmentID])
+
+    # Add data to statistics list
+    for segmentID in inputKeys:
+      for key, value in self.resultCache[segmentationNodeID, plugin.name, segmentID][1].iteritems():
+        self.statistics[segmentID,key] = value
+
+    self.pluginComputeTimes[plugin.name] = time.time() - startTime
+    logging.info("Segment statistics plugin {0}: {1} of {2} segments computed in {3:.3f}s".format(
+      plugin.name, len(modifiedSegmentIDs), len(inputKeys), self.pluginComputeTimes[plugin.name]))
+
+  @staticmethod
+  def arrayFromImage(imageData):
+    """Return the first scalar component of an image as a numpy array indexed as [k,j,i].
+    The array shares memory with the image, so the image must be kept alive while the array is used.
+    """
+    import vtk.util.numpy_support
+    dims = imageData.GetDimensions()
+    scalars = vtk.util.numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars())
+    if scalars.ndim > 1:
+      scalars = scalars[:,0]
+    return scalars.reshape(dims[2], dims[1], dims[0])
+
+  def getCroppedSegmentLabelmap(self, segmentID):
+    """Return the binary labelmap of a segment cropped to its effective (non-empty) extent,
+    or None if the segment is empty. Cropped labelmaps are shared by all plugins
+    during a computeStatistics call.
+    """
+    if segmentID in self.croppedSegmentLabelmaps:
+      return self.croppedSegmentLabelmaps[segmentID]
     import vtkSegmentationCorePython as vtkSegmentationCore
-
-    containsLabelmapRepresentation = self.segmentationNode.GetSegmentation().ContainsRepresentation(
-      vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName())
-    if not containsLabelmapRepresentation:
-      return
-
-    if self.grayscaleNode is None or self.grayscaleNode.GetImageData() is None:
-      return
-
-    # Get geometry of grayscale volume node as oriented image data
-    referenceGeometry_Reference = vtkSegmentationCore.vtkOrientedImageData() # reference geometry in reference node coordinate system
-    referenceGeometry_Reference.SetExtent(self.grayscaleNode.GetImageData().GetExtent())
-    ijkToRasMatrix = vtk.vtkMatrix4x4()
-    self.grayscaleNode.GetIJKToRASMatrix(ijkToRasMatrix)
-    referenceGeometry_Reference.SetGeometryFromImageToWorldMatrix(ijkToRasMatrix)
-
-    # Get transform between grayscale volume and segmentation
-    segmentationToReferenceGeometryTransform = vtk.vtkGeneralTransform()
-    slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(self.segmentationNode.GetParentTransformNode(),
-      self.grayscaleNode.GetParentTransformNode(), segmentationToReferenceGeometryTransform)
-
-    cubicMMPerVoxel = reduce(lambda x,y: x*y, referenceGeometry_Reference.GetSpacing())
-    ccPerCubicMM = 0.001
-
-    for segmentID in self.statistics["SegmentIDs"]:
-      segment = self.segmentationNode.GetSegmentation().GetSegment(segmentID)
-      segmentLabelmap = segment.GetRepresentation(vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName())
-
-      segmentLabelmap_Reference = vtkSegmentationCore.vtkOrientedImageData()
-      vtkSegmentationCore.vtkOrientedImageDataResample.ResampleOrientedImageToReferenceOrientedImage(
-        segmentLabelmap, referenceGeometry_Reference, segmentLabelmap_Reference,
-        False, # nearest neighbor interpolation
-        False, # no padding
-        segmentationToReferenceGeometryTransform)
-
-      # We need to know exactly the value of the segment voxels, apply threshold to make force the selected label value
-      labelValue = 1
-      backgroundValue = 0
-      thresh = vtk.vtkImageThreshold()
-      thresh.SetInputData(segmentLabelmap_Reference)
-      thresh.ThresholdByLower(0)
-      thresh.SetInValue(backgroundValue)
-      thresh.SetOutValue(labelValue)
-      thresh.SetOutputScalarType(vtk.VTK_UNSIGNED_CHAR)
-      thresh.Update()
-
-      #  Use binary labelmap as a stencil
-      stencil = vtk.vtkImageToImageStencil()
-      stencil.SetInputData(thresh.GetOutput())
-      stencil.ThresholdByUpper(labelValue)
-      stencil.Update()
-
-      stat = vtk.vtkImageAccumulate()
-      stat.SetInputData(self.grayscaleNode.GetImageData())
-      stat.SetStencilData(stencil.GetOutput())
-      stat.Update()
-
-      # Add data to statistics list
-      self.statistics[segmentID,"GS voxel count"] = stat.GetVoxelCount()
-      self.statistics[segmentID,"GS volume mm3"] = stat.GetVoxelCount() * cubicMMPerVoxel
-      self.statistics[segmentID,"GS volume cc"] = stat.GetVoxelCount() * cubicMMPerVoxel * ccPerCubicMM
-      if stat.GetVoxelCount()>0:
-        self.statistics[segmentID,"GS min"] = stat.GetMin()[0]
-        self.statistics[segmentID,"GS max"] = stat.GetMax()[0]
-        self.statistics[segmentID,"GS mean"] = stat.GetMean()[0]
-        self.statistics[segmentID,"GS stdev"] = stat.GetStandardDeviation()[0]
+    segment = self.segmentationNode.GetSegmentation().GetSegment(segmentID)
+    segmentLabelmap = segment.GetRepresentation(vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName())
+    croppedLabelmap = None
+    effectiveExtent = [0, -1, 0, -1, 0, -1]
+    if segmentLabelmap and vtkSegmentationCore.vtkOrientedImageDataResample.CalculateEffectiveExtent(segmentLabelmap, effectiveExtent):
+      croppedLabelmap = vtkSegmentationCore.vtkOrientedImageData()
+      vtkSegmentationCore.vtkOrientedImageDataResample.CopyImage(segmentLabelmap, croppedLabelmap, effectiveExtent)
+    self.croppedSegmentLabelmaps[segmentID] = croppedLabelmap
+    return croppedLabelmap
 
   def getStatisticsValueAsString(self, segmentID, key):
     if self.statistics.has_key((segmentID, key)):
@@ -424,6 +401,10 @@ class SegmentStatisticsTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_SegmentStatisticsBasic()
+    self.setUp()
+    self.test_SegmentStatisticsWorkerThreads()
+    self.setUp()
+    self.test_SegmentStatisticsIncremental()
 
   def test_SegmentStatisticsBasic(self):
     """
@@ -482,6 +463,110 @@ class SegmentStatisticsTest(ScriptedLoadableModuleTest):
 
     self.delayDisplay('test_SegmentStatisticsBasic passed!')
 
+  def test_SegmentStatisticsWorkerThreads(self):
+    """
+    Check that results do not depend on the number of worker threads
+    """
+
+    self.delayDisplay("Starting test_SegmentStatisticsWorkerThreads")
+
+    import SampleData
+    from SegmentStatistics import SegmentStatisticsLogic
+
+    sampleDataLogic = SampleData.SampleDataLogic()
+    masterVolumeNode = sampleDataLogic.downloadMRBrainTumor1()
+
+    segmentationNode = slicer.vtkMRMLSegmentationNode()
+    slicer.mrmlScene.AddNode(segmentationNode)
+    segmentationNode.CreateDefaultDisplayNodes()
+    segmentationNode.SetReferenceImageGeometryParameterFromVolumeNode(masterVolumeNode)
+    segmentGeometries = [[10, -6,30,28], [20, 0,65,32], [15, 1, -14, 30], [12, 0, 28, -7]]
+    for segmentGeometry in segmentGeometries:
+      sphereSource = vtk.vtkSphereSource()
+      sphereSource.SetRadius(segmentGeometry[0])
+      sphereSource.SetCenter(segmentGeometry[1], segmentGeometry[2], segmentGeometry[3])
+      sphereSource.Update()
+      segmentationNode.AddSegmentFromClosedSurfaceRepresentation(sphereSource.GetOutput(), segmentationNode.GetSegmentation().GenerateUniqueSegmentID("Test"))
+
+    singleThreadLogic = SegmentStatisticsLogic()
+    singleThreadLogic.numberOfWorkerThreads = 1
+    singleThreadLogic.computeStatistics(segmentationNode, masterVolumeNode)
+
+    multiThreadLogic = SegmentStatisticsLogic()
+    multiThreadLogic.numberOfWorkerThreads = 4
+    multiThreadLogic.computeStatistics(segmentationNode, masterVolumeNode)
+
+    self.assertEqual(singleThreadLogic.exportToString(), multiThreadLogic.exportToString())
+    self.assertEqual(singleThreadLogic.statistics["Test_1","GS voxel count"], singleThreadLogic.statistics["Test_1","LM voxel count"])
+
+    self.delayDisplay('test_SegmentStatisticsWorkerThreads passed!')
+
+  def test_SegmentStatisticsIncremental(self):
+    """
+    Check that only modified segments are recomputed and that custom plugins can be added
+    """
+
+    self.delayDisplay("Starting test_SegmentStatisticsIncremental")
+
+    import vtkSegmentationCorePython as vtkSegmentationCore
+    import SampleData
+    from SegmentStatistics import SegmentStatisticsLogic
+    from SegmentStatisticsPlugins import SegmentStatisticsPluginBase
+
+    class CountingPlugin(SegmentStatisticsPluginBase):
+      name = "Counting"
+      keys = ("Test count",)
+      def __init__(self):
+        SegmentStatisticsPluginBase.__init__(self)
+        self.computedSegmentIDs = []
+      def getInputKey(self, segmentID):
+        segmentLabelmap = self.getSegmentRepresentation(segmentID,
+          vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName())
+        return (segmentLabelmap.GetMTime(),) if segmentLabelmap else None
+      def computeStatistics(self, segmentIDs):
+        self.computedSegmentIDs.extend(segmentIDs)
+        return dict((segmentID, {"Test count": len(self.computedSegmentIDs)}) for segmentID in segmentIDs)
+
+    sampleDataLogic = SampleData.SampleDataLogic()
+    masterVolumeNode = sampleDataLogic.downloadMRBrainTumor1()
+
+    segmentationNode = slicer.vtkMRMLSegmentationNode()
+    slicer.mrmlScene.AddNode(segmentationNode)
+    segmentationNode.CreateDefaultDisplayNodes()
+    segmentationNode.SetReferenceImageGeometryParameterFromVolumeNode(masterVolumeNode)
+    segmentGeometries = [[10, -6,30,28], [20, 0,65,32], [15, 1, -14, 30]]
+    for segmentGeometry in segmentGeometries:
+      sphereSource = vtk.vtkSphereSource()
+      sphereSource.SetRadius(segmentGeometry[0])
+      sphereSource.SetCenter(segmentGeometry[1], segmentGeometry[2], segmentGeometry[3])
+      sphereSource.Update()
+      segmentationNode.AddSegmentFromClosedSurfaceRepresentation(sphereSource.GetOutput(), segmentationNode.GetSegmentation().GenerateUniqueSegmentID("Test"))
+
+    segStatLogic = SegmentStatisticsLogic()
+    countingPlugin = CountingPlugin()
+    segStatLogic.addPlugin(countingPlugin)
+    self.assertTrue("Test count" in segStatLogic.keys)
+
+    segStatLogic.computeStatistics(segmentationNode, masterVolumeNode)
+    self.assertEqual(sorted(countingPlugin.computedSegmentIDs), ["Test", "Test_1", "Test_2"])
+    self.assertTrue("Counting" in segStatLogic.pluginComputeTimes)
+    firstResults = segStatLogic.exportToString()
+    firstVoxelCount = segStatLogic.statistics["Test_1","LM voxel count"]
+
+    # Nothing changed: everything comes from the cache
+    segStatLogic.computeStatistics(segmentationNode, masterVolumeNode)
+    self.assertEqual(len(countingPlugin.computedSegmentIDs), 3)
+    self.assertEqual(segStatLogic.exportToString(), firstResults)
+
+    # Only the modified segment is recomputed
+    labelmapName = vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName()
+    segmentationNode.GetSegmentation().GetSegment("Test_1").GetRepresentation(labelmapName).Modified()
+    segStatLogic.computeStatistics(segmentationNode, masterVolumeNode)
+    self.assertEqual(countingPlugin.computedSegmentIDs[3:], ["Test_1"])
+    self.assertEqual(segStatLogic.statistics["Test_1","LM voxel count"], firstVoxelCount)
+
+    self.delayDisplay('test_SegmentStatisticsIncremental passed!')
+
 class Slicelet(object):
   """A slicer slicelet is a module widget that comes up in stand alone mode
   implemented as a python class.
@@ -0,0 +1,40 @@
+import vtk, slicer
+from SegmentStatisticsPluginBase import *
+
+#
+# ClosedSurfaceSegmentStatisticsPlugin
+#
+
+class ClosedSurfaceSegmentStatisticsPlugin(SegmentStatisticsPluginBase):
+  """Closed surface statistics (CS): surface mm2, volume mm3, volume cc (computed from closed surface).
+  Requires segment closed surface representation.
+  """
+
+  name = "Closed surface"
+  keys = ("CS surface mm2", "CS volume mm3", "CS volume cc")
+
+  def getSegmentClosedSurface(self, segmentID):
+    import vtkSegmentationCorePython as vtkSegmentationCore
+    return self.getSegmentRepresentation(segmentID,
+      vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationClosedSurfaceRepresentationName())
+
+  def getInputKey(self, segmentID):
+    segmentClosedSurface = self.getSegmentClosedSurface(segmentID)
+    if segmentClosedSurface is None:
+      return None
+    return (segmentClosedSurface.GetMTime(),)
+
+  def computeStatistics(self, segmentIDs):
+    ccPerCubicMM = 0.001
+    statistics = {}
+    for segmentID in segmentIDs:
+      # Compute statistics
+      massProperties = vtk.vtkMassProperties()
+      massProperties.SetInputData(self.getSegmentClosedSurface(segmentID))
+
+      statistics[segmentID] = {
+        "CS surface mm2": massProperties.GetSurfaceArea(),
+        "CS volume mm3": massProperties.GetVolume(),
+        "CS volume cc": massProperties.GetVolume() * ccPerCubicMM,
+        }
+    return statistics
@@ -0,0 +1,54 @@
+import vtk, slicer
+import numpy
+from SegmentStatisticsPluginBase import *
+
+#
+# LabelmapSegmentStatisticsPlugin
+#
+
+class LabelmapSegmentStatisticsPlugin(SegmentStatisticsPluginBase):
+  """Segment labelmap statistics (LM): voxel count, volume mm3, volume cc.
+  Requires segment labelmap representation.
+  """
+
+  name = "Labelmap"
+  keys = ("LM voxel count", "LM volume mm3", "LM volume cc")
+
+  def getSegmentLabelmap(self, segmentID):
+    import vtkSegmentationCorePython as vtkSegmentationCore
+    return self.getSegmentRepresentation(segmentID,
+      vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName())
+
+  def getInputKey(self, segmentID):
+    segmentLabelmap = self.getSegmentLabelmap(segmentID)
+    if segmentLabelmap is None:
+      return None
+    return (segmentLabelmap.GetMTime(),)
+
+  @staticmethod
+  def computeVoxelCount(labelArray):
+    return int(numpy.count_nonzero(labelArray > 0))
+
+  def computeStatistics(self, segmentIDs):
+    ccPerCubicMM = 0.001
+    results = {}
+    for segmentID in segmentIDs:
+      segmentLabelmap = self.getSegmentLabelmap(segmentID)
+      cubicMMPerVoxel = reduce(lambda x,y: x*y, segmentLabelmap.GetSpacing())
+      croppedLabelmap = self.logic.getCroppedSegmentLabelmap(segmentID)
+      if croppedLabelmap is None:
+        results[segmentID] = (None, cubicMMPerVoxel)
+        continue
+      labelArray = self.logic.arrayFromImage(croppedLabelmap)
+      results[segmentID] = (self.logic.workerPool.apply_async(self.computeVoxelCount, (labelArray,)), cubicMMPerVoxel)
+
+    statistics = {}
+    for segmentID in segmentIDs:
+      result, cubicMMPerVoxel = results[segmentID]
+      voxelCount = result.get() if result is not None else 0
+      statistics[segmentID] = {
+        "LM voxel count": voxelCount,
+        "LM volume mm3": voxelCount * cubicMMPerVoxel,
+        "LM volume cc": voxelCount * cubicMMPerVoxel * ccPerCubicMM,
+        }
+    return statistics
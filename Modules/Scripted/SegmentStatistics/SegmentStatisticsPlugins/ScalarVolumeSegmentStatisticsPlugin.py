@@ -0,0 +1,130 @@
+import vtk, slicer
+import numpy
+from SegmentStatisticsPluginBase import *
+
+#
+# ScalarVolumeSegmentStatisticsPlugin
+#
+
+class ScalarVolumeSegmentStatisticsPlugin(SegmentStatisticsPluginBase):
+  """Grayscale volume statistics (GS): voxel count, volume mm3, volume cc (where segments overlap grayscale volume),
+  min, max, mean, stdev (intensity statistics).
+  Requires segment labelmap representation and selection of a grayscale volume.
+  """
+
+  name = "Grayscale"
+  keys = ("GS voxel count", "GS volume mm3", "GS volume cc", "GS min", "GS max", "GS mean", "GS stdev")
+
+  def getSegmentLabelmap(self, segmentID):
+    import vtkSegmentationCorePython as vtkSegmentationCore
+    return self.getSegmentRepresentation(segmentID,
+      vtkSegmentationCore.vtkSegmentationConverter.GetSegmentationBinaryLabelmapRepresentationName())
+
+  def getInputKey(self, segmentID):
+    grayscaleNode = self.logic.grayscaleNode
+    if grayscaleNode is None or grayscaleNode.GetImageData() is None:
+      return None
+    segmentLabelmap = self.getSegmentLabelmap(segmentID)
+    if segmentLabelmap is None:
+      return None
+    return (segmentLabelmap.GetMTime(), grayscaleNode.GetID(), grayscaleNode.GetMTime(), grayscaleNode.GetImageData().GetMTime(),
+      self.getTransformModifiedTime(self.logic.segmentationNode), self.getTransformModifiedTime(grayscaleNode))
+
+  @staticmethod
+  def computeGrayscaleStatistics(labelArray, grayscaleArray):
+    """Return (voxel count, min, max, mean, stdev) of the grayscale voxels inside the label.
+    Standard deviation is the sample standard deviation, as reported by vtkImageAccumulate.
+    """
+    values = grayscaleArray[labelArray > 0].astype(numpy.float64)
+    count = values.size
+    if count == 0:
+      return (0, None, None, None, None)
+    stdev = values.std(ddof=1) if count > 1 else 0.0
+    return (count, values.min(), values.max(), values.mean(), stdev)
+
+  def computeStatistics(self, segmentIDs):
+    import vtkSegmentationCorePython as vtkSegmentationCore
+
+    segmentationNode = self.logic.segmentationNode
+    grayscaleNode = self.logic.grayscaleNode
+
+    # Get geometry of grayscale volume node
+    grayscaleExtent = grayscaleNode.GetImageData().GetExtent()
+    ijkToRasMatrix = vtk.vtkMatrix4x4()
+    grayscaleNode.GetIJKToRASMatrix(ijkToRasMatrix)
+    rasToIjkMatrix = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Invert(ijkToRasMatrix, rasToIjkMatrix)
+    grayscaleArray = self.logic.arrayFromImage(grayscaleNode.GetImageData())
+
+    # Get transform between grayscale volume and segmentation
+    segmentationToReferenceGeometryTransform = vtk.vtkGeneralTransform()
+    slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(segmentationNode.GetParentTransformNode(),
+      grayscaleNode.GetParentTransformNode(), segmentationToReferenceGeometryTransform)
+
+    cubicMMPerVoxel = reduce(lambda x,y: x*y, grayscaleNode.GetSpacing())
+    ccPerCubicMM = 0.001
+
+    results = {}
+    for segmentID in segmentIDs:
+      results[segmentID] = None
+      croppedLabelmap = self.logic.getCroppedSegmentLabelmap(segmentID)
+      if croppedLabelmap is None:
+        continue
+
+      # Only resample the region of the grayscale volume that the segment can overlap
+      segmentToReferenceIjkTransform = vtk.vtkGeneralTransform()
+      segmentToReferenceIjkTransform.PostMultiply()
+      segmentImageToWorldMatrix = vtk.vtkMatrix4x4()
+      croppedLabelmap.GetImageToWorldMatrix(segmentImageToWorldMatrix)
+      segmentToReferenceIjkTransform.Concatenate(segmentImageToWorldMatrix)
+      segmentToReferenceIjkTransform.Concatenate(segmentationToReferenceGeometryTransform)
+      segmentToReferenceIjkTransform.Concatenate(rasToIjkMatrix)
+      segmentExtent_Reference = [0, -1, 0, -1, 0, -1]
+      vtkSegmentationCore.vtkOrientedImageDataResample.TransformExtent(croppedLabelmap.GetExtent(),
+        segmentToReferenceIjkTransform, segmentExtent_Reference)
+      for axis in range(3):
+        segmentExtent_Reference[axis*2] = max(segmentExtent_Reference[axis*2], grayscaleExtent[axis*2])
+        segmentExtent_Reference[axis*2+1] = min(segmentExtent_Reference[axis*2+1], grayscaleExtent[axis*2+1])
+      if (segmentExtent_Reference[0] > segmentExtent_Reference[1] or segmentExtent_Reference[2] > segmentExtent_Reference[3]
+        or segmentExtent_Reference[4] > segmentExtent_Reference[5]):
+        continue
+
+      referenceGeometry_Reference = vtkSegmentationCore.vtkOrientedImageData() # reference geometry in reference node coordinate system
+      referenceGeometry_Reference.SetExtent(segmentExtent_Reference)
+      referenceGeometry_Reference.SetGeometryFromImageToWorldMatrix(ijkToRasMatrix)
+
+      segmentLabelmap_Reference = vtkSegmentationCore.vtkOrientedImageData()
+      if not vtkSegmentationCore.vtkOrientedImageDataResample.ResampleOrientedImageToReferenceOrientedImage(
+        croppedLabelmap, referenceGeometry_Reference, segmentLabelmap_Reference,
+        False, # nearest neighbor interpolation
+        False, # no padding
+        segmentationToReferenceGeometryTransform):
+        continue
+
+      labelArray = self.logic.arrayFromImage(segmentLabelmap_Reference)
+      grayscaleCrop = grayscaleArray[
+        segmentExtent_Reference[4]-grayscaleExtent[4]:segmentExtent_Reference[5]-grayscaleExtent[4]+1,
+        segmentExtent_Reference[2]-grayscaleExtent[2]:segmentExtent_Reference[3]-grayscaleExtent[2]+1,
+        segmentExtent_Reference[0]-grayscaleExtent[0]:segmentExtent_Reference[1]-grayscaleExtent[0]+1]
+      # Keep the resampled labelmap referenced until the worker is done with its array
+      results[segmentID] = (self.logic.workerPool.apply_async(self.computeGrayscaleStatistics, (labelArray, grayscaleCrop)),
+        segmentLabelmap_Reference)
+
+    statistics = {}
+    for segmentID in segmentIDs:
+      if results[segmentID] is None:
+        voxelCount, minimum, maximum, mean, stdev = (0, None, None, None, None)
+      else:
+        voxelCount, minimum, maximum, mean, stdev = results[segmentID][0].get()
+      segmentStatistics = {
+        "GS voxel count": voxelCount,
+        "GS volume mm3": voxelCount * cubicMMPerVoxel,
+        "GS volume cc": voxelCount * cubicMMPerVoxel * ccPerCubicMM,
+        }
+      if voxelCount>0:
+        segmentStatistics["GS min"] = minimum
+        segmentStatistics["GS max"] = maximum
+        segmentStatistics["GS mean"] = mean
+        segmentStatistics["GS stdev"] = stdev
+      statistics[segmentID] = segmentStatistics
+    return statistics
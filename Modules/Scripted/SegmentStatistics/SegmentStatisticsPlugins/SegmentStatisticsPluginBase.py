@@ -0,0 +1,57 @@
+import vtk, slicer
+
+#
+# SegmentStatisticsPluginBase
+#
+
+class SegmentStatisticsPluginBase(object):
+  """Base class for segment statistics calculators.
+  A plugin computes one group of statistics (its keys) for a list of segments.
+  SegmentStatisticsLogic caches the results of each segment and only asks the plugin
+  to recompute the segments whose input key (see getInputKey) changed since the
+  previous computation.
+  To add a custom calculator, derive a class from this one and register it with
+  SegmentStatisticsLogic.registerPlugin.
+  """
+
+  name = None
+  keys = ()
+
+  def __init__(self):
+    # Set by SegmentStatisticsLogic when the plugin is added to it
+    self.logic = None
+
+  def getInputKey(self, segmentID):
+    """Return a value that changes whenever any input of the statistics of the segment changes.
+    Return None if the statistics cannot be computed for the segment.
+    """
+    raise NotImplementedError
+
+  def computeStatistics(self, segmentIDs):
+    """Compute statistics of the listed segments.
+    Return a dictionary that maps each segment ID to a dictionary of {key: value}.
+    """
+    raise NotImplementedError
+
+  def getSegmentRepresentation(self, segmentID, representationName):
+    """Return the representation of a segment or None if the segmentation does not contain it."""
+    segmentation = self.logic.segmentationNode.GetSegmentation()
+    if not segmentation.ContainsRepresentation(representationName):
+      return None
+    segment = segmentation.GetSegment(segmentID)
+    if segment is None:
+      return None
+    return segment.GetRepresentation(representationName)
+
+  @staticmethod
+  def getTransformModifiedTime(node):
+    """Return the modification times of all the transforms above a transformable node."""
+    modifiedTimes = []
+    transformNode = node.GetParentTransformNode() if node else None
+    while transformNode:
+      modifiedTimes.append(transformNode.GetMTime())
+      transformToParent = transformNode.GetTransformToParent()
+      if transformToParent:
+        modifiedTimes.append(transformToParent.GetMTime())
+      transformNode = transformNode.GetParentTransformNode()
+    return tuple(modifiedTimes)
@@ -0,0 +1,4 @@
+from SegmentStatisticsPluginBase import *
+from LabelmapSegmentStatisticsPlugin import *
+from ScalarVolumeSegmentStatisticsPlugin import *
+from ClosedSurfaceSegmentStatisticsPlugin import *